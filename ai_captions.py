@@ -3,24 +3,144 @@ AI Caption Generator
 Generates social media captions and hashtags using OpenAI GPT-4
 """
 
-from openai import OpenAI
-from typing import List, Dict
+import asyncio
+import contextvars
+import json
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+from typing import Iterator, List, Dict, Optional, Tuple
 import config
+import metrics
+from caption_cache import CaptionCache, cache_key, get_default_cache
+from model_router import ModelRouter
+from rate_limiter import RateLimiter, backoff_delay
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    # Optional dependency; estimate_tokens falls back to an approximation
+    _ENCODING = None
+
+
+# Bump whenever _build_prompt or the system prompt changes, so cached
+# captions from the old prompt are not reused
+PROMPT_VERSION = '4'
+
+SYSTEM_PROMPT = "You are an expert real estate social media marketer. You write engaging, professional Instagram and Facebook captions that drive engagement and inquiries."
+
+# Tone instructions, used in order when no tones are requested
+TONES = {
+    'professional': 'Professional and descriptive (emphasize value/features)',
+    'warm': 'Warm and inviting (appeal to emotion/lifestyle)',
+    'urgent': 'Urgent and action-oriented (create FOMO/call-to-action)'
+}
+
+# Models that accept response_format={"type": "json_object"}
+JSON_MODE_MODELS = ('gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125', 'gpt-4o',
+                    'gpt-3.5-turbo-1106', 'gpt-3.5-turbo-0125')
+
+# Completion budget: a 100-150 word caption plus 15-20 hashtags is about
+# 300 tokens, so three variations get the original 1000-token limit
+TOKENS_PER_VARIATION = 320
+COMPLETION_OVERHEAD_TOKENS = 40
+
+FALLBACK_CAPTION = {
+    'variation': 1,
+    'caption': "Beautiful property now available! Contact us for details.",
+    'hashtags': "#RealEstate #HomesForSale #Property #DreamHome",
+    'full_text': "Beautiful property now available! Contact us for details.\n\n#RealEstate #HomesForSale #Property #DreamHome",
+    'character_count': 100
+}
 
 
 class CaptionGenerator:
     """Generates social media captions for real estate listings using AI"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: CaptionCache = None,
+                 base_url: str = None, rate_limiter: RateLimiter = None,
+                 structured: bool = None, router: ModelRouter = None):
         self.api_key = api_key or config.OPENAI_API_KEY
         if not self.api_key:
             raise ValueError("OpenAI API key not provided")
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = config.OPENAI_MODEL
+        self.base_url = base_url or config.OPENAI_BASE_URL
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        # Picks the model per task and decides when to hedge slow requests
+        self.router = router or ModelRouter()
+        self.model = self.router.strong_model
+        # Pass cache=False to disable caching for this generator
+        if cache is None and config.CAPTION_CACHE_ENABLED:
+            cache = get_default_cache()
+        self.cache = cache or None
+        self.rate_limiter = rate_limiter or RateLimiter(config.OPENAI_REQUESTS_PER_MINUTE,
+                                                        config.OPENAI_TOKENS_PER_MINUTE)
+        # Structured mode asks for JSON and repairs individual variations
+        self.structured = config.OPENAI_STRUCTURED_OUTPUT if structured is None else structured
+        self.parse_stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._async_client = None
+        self._async_loop = None
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+    
+    def _record(self, **counts) -> None:
+        """Add to the parse statistics"""
+        with self._stats_lock:
+            self.parse_stats.update(counts)
+    
+    def parse_failure_rate(self) -> float:
+        """Share of responses where at least one variation could not be used"""
+        responses = self.parse_stats['responses']
+        return self.parse_stats['parse_failures'] / responses if responses else 0.0
+    
+    def _messages(self, prompt: str) -> List[Dict]:
+        return [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    
+    def _cache_key(self, listing_data: Dict, post_type: str, num_variations: int, model: str,
+                   tones: Optional[List[str]] = None, structured: bool = None) -> Optional[str]:
+        """Cache key for captions written by the given model (None without a cache)"""
+        if not self.cache:
+            return None
+        structured = self.structured if structured is None else structured
+        return cache_key(listing_data, post_type, num_variations, model, PROMPT_VERSION,
+                         tones=describe_tones(num_variations, tones), structured=structured)
+    
+    def _cache_lookup(self, listing_data: Dict, post_type: str, num_variations: int,
+                      force_refresh: bool, tones: Optional[List[str]] = None,
+                      structured: bool = None) -> Optional[List[Dict]]:
+        """Cached captions from the model the task is routed to, or None"""
+        if force_refresh:
+            return None
+        key = self._cache_key(listing_data, post_type, num_variations,
+                              self.router.model_for(num_variations), tones, structured)
+        return self.cache.get(key) if key else None
+    
+    def _cache_store(self, listing_data: Dict, post_type: str, num_variations: int, model: str,
+                     captions: List[Dict], tones: Optional[List[str]] = None,
+                     structured: bool = None) -> None:
+        """Cache captions under the model that actually answered the request"""
+        key = self._cache_key(listing_data, post_type, num_variations, model, tones, structured)
+        # Don't pin the canned fallback caption in the cache
+        if key and captions != [FALLBACK_CAPTION]:
+            self.cache.set(key, captions)
     
     def generate_captions(self, listing_data: Dict, post_type: str = "New Listing", 
-                         num_variations: int = 3) -> List[Dict]:
+                         num_variations: int = 3, force_refresh: bool = False,
+                         tones: Optional[List[str]] = None) -> List[Dict]:
         """
         Generate multiple caption variations for a listing
         
@@ -28,39 +148,578 @@ class CaptionGenerator:
             listing_data: Dictionary containing listing details
             post_type: Type of post (New Listing, Open House, etc.)
             num_variations: Number of caption variations to generate
+            force_refresh: Skip the cache and generate new captions
+                (the new result replaces the cached one)
+            tones: Optional tone per variation (professional, warm, urgent)
             
         Returns:
             List of dictionaries with 'caption' and 'hashtags'
         """
-        prompt = self._build_prompt(listing_data, post_type, num_variations)
-        
+        with metrics.span('captions.generate', post_type=post_type,
+                          variations=num_variations) as span:
+            cached = self._cache_lookup(listing_data, post_type, num_variations,
+                                        force_refresh, tones)
+            if cached is not None:
+                span.set(cached=True)
+                return cached
+            
+            try:
+                if self.structured:
+                    captions, model = self._generate_structured(listing_data, post_type,
+                                                                num_variations, tones)
+                else:
+                    prompt = self._build_prompt(listing_data, post_type, num_variations, tones)
+                    content, model = self._complete(prompt, num_variations)
+                    captions = self._parse_response(content, num_variations)
+                
+            except Exception as e:
+                raise Exception(f"Failed to generate captions: {str(e)}")
+            
+            self._cache_store(listing_data, post_type, num_variations, model, captions, tones)
+            return captions
+    
+    def _completion_options(self, num_variations: int, structured: bool,
+                            model: str = None) -> Dict:
+        model = model or self.model
+        options = {
+            'model': model,
+            'temperature': 0.8,
+            'max_tokens': completion_budget(num_variations)
+        }
+        if structured and model.startswith(JSON_MODE_MODELS):
+            options['response_format'] = {'type': 'json_object'}
+        return options
+    
+    def _timed_create(self, prompt: str, options: Dict):
+        """One chat completion, recorded in the router's stats for its model"""
+        start = time.perf_counter()
         try:
             response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert real estate social media marketer. You write engaging, professional Instagram and Facebook captions that drive engagement and inquiries."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.8,
-                max_tokens=1000
+                messages=self._messages(prompt),
+                **options
+            )
+        except Exception:
+            self.router.record(options['model'], time.perf_counter() - start, ok=False)
+            raise
+        self.router.record(options['model'], time.perf_counter() - start, ok=True)
+        return response
+    
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * config.OPENAI_MAX_CONCURRENCY,
+                    thread_name_prefix='caption-hedge')
+            return self._hedge_executor
+    
+    def _complete(self, prompt: str, num_variations: int,
+                  structured: bool = False) -> Tuple[str, str]:
+        """
+        Send one chat completion to the routed model and return its text
+        and the model that answered
+        
+        Once the model has enough history, a second identical request is
+        sent if the first has not answered within the router's hedge delay,
+        and whichever answers first is used. The synchronous client cannot
+        abort a request in flight, so the slower one is left to finish in
+        the background and its answer is dropped.
+        """
+        options = self._completion_options(num_variations, structured,
+                                           self.router.choose(num_variations))
+        delay = self.router.hedge_delay(options['model'])
+        if delay is None:
+            response = self._timed_create(prompt, options)
+        else:
+            response = self._hedged(prompt, options, delay)
+        _record_usage(response)
+        return response.choices[0].message.content, options['model']
+    
+    def _hedged(self, prompt: str, options: Dict, delay: float):
+        executor = self._get_hedge_executor()
+        
+        def submit():
+            # Each request runs in a copy of the caller's context, so its
+            # metrics land in the caller's span
+            return executor.submit(contextvars.copy_context().run, self._timed_create,
+                                   prompt, options)
+        
+        first = submit()
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        
+        hedge = submit()
+        metrics.add(hedged_requests=1)
+        pending = {first, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.router.record_hedge(options['model'], won=future is hedge)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        self.router.record_hedge(options['model'], won=False)
+        raise error
+    
+    def _generate_structured(self, listing_data: Dict, post_type: str, num_variations: int,
+                             tones: Optional[List[str]] = None) -> Tuple[List[Dict], str]:
+        """
+        Request JSON captions and re-request only the variations that fail validation
+        
+        Returns:
+            Tuple of (captions, model that answered the main request)
+        """
+        prompt = self._build_prompt(listing_data, post_type, num_variations, tones, structured=True)
+        content, model = self._complete(prompt, num_variations, structured=True)
+        captions = self._parse_structured(content, num_variations)
+        
+        tone_names = resolve_tones(num_variations, tones)
+        for index in range(1, num_variations + 1):
+            if index in captions:
+                continue
+            repair_prompt = self._build_prompt(listing_data, post_type, 1, [tone_names[index - 1]],
+                                               structured=True)
+            repaired = self._parse_structured(self._complete(repair_prompt, 1, structured=True)[0],
+                                              1, repair=True)
+            if repaired:
+                captions[index] = dict(repaired[1], variation=index)
+        
+        return self._finish_structured(captions), model
+    
+    def _get_async_client(self) -> AsyncOpenAI:
+        """Async client shared by all requests on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            # Retries are handled here with rate-limit aware backoff
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                             max_retries=0)
+            self._async_loop = loop
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """Close the async client; call before its event loop ends"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+            self._async_loop = None
+    
+    async def _atimed_create(self, prompt: str, options: Dict):
+        """Async _timed_create; a cancelled request is not counted"""
+        start = time.perf_counter()
+        try:
+            response = await self._get_async_client().chat.completions.create(
+                messages=self._messages(prompt),
+                **options
             )
+        except (APIStatusError, APIConnectionError):
+            self.router.record(options['model'], time.perf_counter() - start, ok=False)
+            raise
+        self.router.record(options['model'], time.perf_counter() - start, ok=True)
+        return response
+    
+    async def _ahedged(self, prompt: str, options: Dict, estimated_tokens: float):
+        """
+        Send a request and, if it has not answered within the hedge delay,
+        a second one; the first answer wins and the other is cancelled
+        """
+        delay = self.router.hedge_delay(options['model'])
+        first = asyncio.ensure_future(self._atimed_create(prompt, options))
+        if delay is None:
+            return await first
+        
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
             
-            content = response.choices[0].message.content
-            captions = self._parse_response(content, num_variations)
+            await self.rate_limiter.acquire(estimated_tokens)
+            hedge = asyncio.ensure_future(self._atimed_create(prompt, options))
+            metrics.add(hedged_requests=1)
+            pending = {first, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.router.record_hedge(options['model'], won=task is hedge)
+                        return task.result()
+                    error = task.exception()
+            self.router.record_hedge(options['model'], won=False)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _acreate(self, prompt: str, num_variations: int, structured: bool = False) -> tuple:
+        """
+        Send one chat completion, honoring the rate limiter and retrying 429/5xx
+        
+        Returns:
+            Tuple of (response, model that answered)
+        """
+        for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+            # Routed per attempt, so retries can move off a failing model
+            options = self._completion_options(num_variations, structured,
+                                               self.router.choose(num_variations))
+            estimated_tokens = estimate_tokens(SYSTEM_PROMPT + prompt) + options['max_tokens']
+            await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response = await self._ahedged(prompt, options, estimated_tokens)
+                _record_usage(response)
+                return response, options['model']
+            except (APIStatusError, APIConnectionError) as e:
+                status = getattr(e, 'status_code', None)
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == config.OPENAI_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                if status == 429:
+                    self.rate_limiter.penalize()
+                    retry_after = e.response.headers.get('retry-after')
+                    try:
+                        delay = max(delay, float(retry_after or 0))
+                    except ValueError:
+                        pass
+                await asyncio.sleep(delay)
+    
+    async def agenerate_captions(self, listing_data: Dict, post_type: str = "New Listing",
+                                 num_variations: int = 3, force_refresh: bool = False,
+                                 tones: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Async version of generate_captions for bulk runs
+        
+        Requests share one async client and go through the generator's rate
+        limiter; 429 and 5xx responses are retried with jittered backoff.
+        """
+        with metrics.span('captions.generate', post_type=post_type,
+                          variations=num_variations) as span:
+            cached = self._cache_lookup(listing_data, post_type, num_variations,
+                                        force_refresh, tones)
+            if cached is not None:
+                span.set(cached=True)
+                return cached
+            
+            try:
+                if self.structured:
+                    captions, model = await self._agenerate_structured(listing_data, post_type,
+                                                                       num_variations, tones)
+                else:
+                    prompt = self._build_prompt(listing_data, post_type, num_variations, tones)
+                    response, model = await self._acreate(prompt, num_variations)
+                    content = response.choices[0].message.content
+                    captions = self._parse_response(content, num_variations)
+            except Exception as e:
+                raise Exception(f"Failed to generate captions: {str(e)}")
             
+            self._cache_store(listing_data, post_type, num_variations, model, captions, tones)
             return captions
+    
+    async def _agenerate_structured(self, listing_data: Dict, post_type: str,
+                                    num_variations: int,
+                                    tones: Optional[List[str]] = None) -> Tuple[List[Dict], str]:
+        """Async version of _generate_structured; repairs run concurrently"""
+        prompt = self._build_prompt(listing_data, post_type, num_variations, tones, structured=True)
+        response, model = await self._acreate(prompt, num_variations, structured=True)
+        captions = self._parse_structured(response.choices[0].message.content, num_variations)
+        
+        tone_names = resolve_tones(num_variations, tones)
+        missing = [index for index in range(1, num_variations + 1) if index not in captions]
+        
+        async def repair(index: int) -> None:
+            repair_prompt = self._build_prompt(listing_data, post_type, 1, [tone_names[index - 1]],
+                                               structured=True)
+            response, _ = await self._acreate(repair_prompt, 1, structured=True)
+            repaired = self._parse_structured(response.choices[0].message.content, 1, repair=True)
+            if repaired:
+                captions[index] = dict(repaired[1], variation=index)
+        
+        await asyncio.gather(*(repair(index) for index in missing))
+        return self._finish_structured(captions), model
+    
+    async def generate_many(self, listings: List[Dict], post_type: str = "New Listing",
+                            num_variations: int = 3, max_concurrency: int = None) -> List[Dict]:
+        """
+        Generate captions for many listings with bounded concurrency
+        
+        Args:
+            listings: Listing dictionaries from the scraper
+            post_type: Type of post for every listing
+            num_variations: Number of caption variations per listing
+            max_concurrency: Maximum requests in flight (config default if omitted)
+            
+        Returns:
+            One dictionary per listing, in input order, with 'captions'
+            (or None) and 'error' (or None)
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or config.OPENAI_MAX_CONCURRENCY)
+        
+        async def run(listing_data: Dict) -> Dict:
+            async with semaphore:
+                try:
+                    captions = await self.agenerate_captions(listing_data, post_type, num_variations)
+                    return {'captions': captions, 'error': None}
+                except Exception as e:
+                    return {'captions': None, 'error': str(e)}
+        
+        return await asyncio.gather(*(run(listing) for listing in listings))
+    
+    async def generate_packed(self, listings: List[Dict], post_type: str = "New Listing",
+                              num_variations: int = 3, pack_size: int = None,
+                              max_concurrency: int = None) -> List[Dict]:
+        """
+        Generate captions for many listings, several listings per request
+        
+        The system prompt and requirements are sent once per pack instead of
+        once per listing, and the JSON response is split back per listing.
+        Listings missing or invalid in a pack's response (or in a pack whose
+        request failed) are captioned on their own with generate_many.
+        
+        Args:
+            listings: Listing dictionaries from the scraper
+            post_type: Type of post for every listing
+            num_variations: Number of caption variations per listing
+            pack_size: Listings per request (config.OPENAI_PACK_SIZE if omitted)
+            max_concurrency: Maximum requests in flight (config default if omitted)
             
-        except Exception as e:
-            raise Exception(f"Failed to generate captions: {str(e)}")
+        Returns:
+            One dictionary per listing, in input order, with 'captions'
+            (or None), 'error' (or None) and 'packed' (whether the captions
+            came from a packed request)
+        """
+        pack_size = pack_size or config.OPENAI_PACK_SIZE
+        results: List[Optional[Dict]] = [None] * len(listings)
+        pending = []
+        for index, listing_data in enumerate(listings):
+            cached = self.cached_packed(listing_data, post_type, num_variations)
+            if cached is not None:
+                results[index] = {'captions': cached, 'error': None, 'packed': False}
+            else:
+                pending.append(index)
+        
+        packs = [pending[i:i + pack_size] for i in range(0, len(pending), pack_size)]
+        semaphore = asyncio.Semaphore(max_concurrency or config.OPENAI_MAX_CONCURRENCY)
+        
+        async def run(pack: List[int]) -> None:
+            pack_listings = [listings[index] for index in pack]
+            async with semaphore:
+                with metrics.span('captions.generate_packed', post_type=post_type,
+                                  listings=len(pack), variations=num_variations):
+                    prompt = self._build_packed_prompt(pack_listings, post_type, num_variations)
+                    model = None
+                    try:
+                        response, model = await self._acreate(prompt, num_variations * len(pack),
+                                                              structured=True)
+                        parsed = self.parse_packed_response(response.choices[0].message.content,
+                                                            pack_listings, post_type,
+                                                            num_variations, model)
+                    except Exception:
+                        parsed = {}
+                    if parsed:
+                        metrics.add(prompt_tokens_saved=self._packing_saving(
+                            pack_listings, post_type, num_variations, prompt))
+            for position, index in enumerate(pack, 1):
+                captions = parsed.get(position)
+                if captions:
+                    results[index] = {'captions': captions, 'error': None, 'packed': True}
+        
+        await asyncio.gather(*(run(pack) for pack in packs))
+        
+        missing = [index for index in pending if results[index] is None]
+        if missing:
+            self._record(packed_fallbacks=len(missing))
+            retried = await self.generate_many([listings[index] for index in missing], post_type,
+                                               num_variations, max_concurrency)
+            for index, result in zip(missing, retried):
+                results[index] = dict(result, packed=False)
+        return results
+    
+    def cached_packed(self, listing_data: Dict, post_type: str = "New Listing",
+                      num_variations: int = 3) -> Optional[List[Dict]]:
+        """Captions a packed request would take from the cache, or None"""
+        # Packed responses are always structured JSON
+        return self._cache_lookup(listing_data, post_type, num_variations, False,
+                                  structured=True)
+    
+    def packed_request(self, listings: List[Dict], post_type: str = "New Listing",
+                       num_variations: int = 3) -> Dict:
+        """
+        Chat completion request body captioning several listings at once
+        (e.g. for one line of a batch job)
+        
+        Returns:
+            Dictionary with 'model', 'messages' and the other request options
+        """
+        count = num_variations * len(listings)
+        prompt = self._build_packed_prompt(listings, post_type, num_variations)
+        return dict(self._completion_options(count, True, self.router.model_for(count)),
+                    messages=self._messages(prompt))
     
-    def _build_prompt(self, listing_data: Dict, post_type: str, num_variations: int) -> str:
-        """Build the prompt for OpenAI"""
+    def parse_packed_response(self, content: str, listings: List[Dict],
+                              post_type: str = "New Listing", num_variations: int = 3,
+                              model: str = None) -> Dict[int, List[Dict]]:
+        """
+        Split a packed response per listing and cache each listing's captions
+        
+        Args:
+            content: Completion text of a packed request
+            listings: The listings of the request, in prompt order
+            post_type: Type of post
+            num_variations: Caption variations per listing
+            model: Model that answered (nothing is cached if omitted)
+        
+        Returns:
+            Dictionary mapping listing number (from 1) to its validated
+            captions; listings without usable captions are left out
+        """
+        parsed = self._parse_packed(content, len(listings), num_variations)
+        if model:
+            for position, captions in parsed.items():
+                self._cache_store(listings[position - 1], post_type, num_variations, model,
+                                  captions, structured=True)
+        return parsed
+    
+    def _build_packed_prompt(self, listings: List[Dict], post_type: str, num_variations: int,
+                             tones: Optional[List[str]] = None) -> str:
+        """Prompt asking for captions for several listings as one JSON object"""
+        count = len(listings)
+        if num_variations == 1:
+            task = (f"Generate 1 Instagram/Facebook caption for each of the {count} "
+                    f"real estate {post_type.lower()} listings below.")
+        else:
+            task = (f"Generate {num_variations} different Instagram/Facebook caption "
+                    f"variations for each of the {count} real estate {post_type.lower()} "
+                    f"listings below.")
+        details = "\n\n".join(f"Listing {i}:\n{self._format_details(listing_data)}"
+                               for i, listing_data in enumerate(listings, 1))
+        
+        return f"""{task}
+
+{details}
+
+{_requirements(num_variations, tones)}
+
+4. Write each listing's captions about that listing only.
+
+Respond with only a JSON object in exactly this shape:
+{{"listings": [{{"listing": 1, "variations": [{{"variation": 1, "caption": "caption text here", "hashtags": "#tag1 #tag2 #tag3"}}]}}]}}
+with one entry per listing, numbered 1 to {count}, each with variations numbered 1 to {num_variations}."""
+    
+    def _parse_packed(self, content: str, count: int, num_variations: int) -> Dict[int, List[Dict]]:
+        """
+        Split a packed JSON response per listing
+        
+        Returns:
+            Dictionary mapping listing number to its validated captions;
+            listings without a correctly numbered entry or without any
+            usable variation are left out
+        """
+        entries = _load_json_object(content).get('listings')
+        found = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            # Never guess which listing an entry belongs to
+            index = entry.get('listing')
+            if not isinstance(index, int) or not 1 <= index <= count or index in found:
+                continue
+            variations = entry.get('variations')
+            found[index] = _validate_variations(variations if isinstance(variations, list) else [],
+                                                num_variations)
+        
+        for index in range(1, count + 1):
+            self._record_parse(num_variations, len(found.get(index, {})))
+        return {index: [captions[i] for i in sorted(captions)]
+                for index, captions in found.items() if captions}
+    
+    def _single_prompt_tokens(self, listings: List[Dict], post_type: str,
+                              num_variations: int) -> int:
+        """Prompt tokens of captioning the listings with one request each"""
+        return sum(estimate_tokens(SYSTEM_PROMPT + self._build_prompt(
+            listing_data, post_type, num_variations, structured=self.structured))
+            for listing_data in listings)
+    
+    def _packing_saving(self, listings: List[Dict], post_type: str, num_variations: int,
+                        packed_prompt: str) -> int:
+        """Prompt tokens a packed prompt saves over one request per listing"""
+        return (self._single_prompt_tokens(listings, post_type, num_variations)
+                - estimate_tokens(SYSTEM_PROMPT + packed_prompt))
+    
+    def packing_report(self, listings: List[Dict], post_type: str = "New Listing",
+                       num_variations: int = 3, pack_size: int = None) -> Dict:
+        """
+        Estimated prompt tokens with one request per listing versus packed
+        
+        Returns:
+            Dictionary with 'listings', 'requests' and 'prompt_tokens' for
+            both modes ('single_*' and 'packed_*') and 'saved_per_listing'
+        """
+        pack_size = pack_size or config.OPENAI_PACK_SIZE
+        single = self._single_prompt_tokens(listings, post_type, num_variations)
+        packs = [listings[i:i + pack_size] for i in range(0, len(listings), pack_size)]
+        packed = sum(estimate_tokens(SYSTEM_PROMPT + self._build_packed_prompt(
+            pack, post_type, num_variations)) for pack in packs)
+        return {
+            'listings': len(listings),
+            'single_requests': len(listings),
+            'packed_requests': len(packs),
+            'single_prompt_tokens': single,
+            'packed_prompt_tokens': packed,
+            'saved_per_listing': round((single - packed) / len(listings), 1) if listings else 0.0
+        }
+    
+    def _build_prompt(self, listing_data: Dict, post_type: str, num_variations: int,
+                      tones: Optional[List[str]] = None, structured: bool = False) -> str:
+        """
+        Build the prompt for OpenAI
+        
+        Only the tone instructions for the requested variations are included,
+        and the format is shown once instead of once per variation. With
+        structured=True the captions are requested as a JSON object.
+        """
+        if num_variations == 1:
+            task = f"Generate 1 Instagram/Facebook caption for a real estate {post_type.lower()}."
+            format_intro = "Format it exactly like this:"
+            format_note = ""
+        else:
+            task = (f"Generate {num_variations} different Instagram/Facebook caption "
+                    f"variations for a real estate {post_type.lower()}.")
+            format_intro = "Format each variation exactly like this:"
+            format_note = (f"\n\nNumber them VARIATION 1 to VARIATION {num_variations} "
+                           f"and put a line with only --- between variations.")
+        
+        prompt = f"""{task}
+
+Property Details:
+{self._format_details(listing_data)}
+
+{_requirements(num_variations, tones)}
+
+{format_intro}
+
+VARIATION 1:
+[caption text here]
+
+Hashtags: #tag1 #tag2 #tag3 [etc]{format_note}
+
+Generate now:"""
+        
+        if structured:
+            # Same instructions, but ask for JSON instead of the text layout
+            prompt = prompt[:prompt.index(format_intro)] + (
+                'Respond with only a JSON object in exactly this shape:\n'
+                '{"variations": [{"variation": 1, "caption": "caption text here", '
+                '"hashtags": "#tag1 #tag2 #tag3"}]}\n'
+                f'with one entry per variation, numbered 1 to {num_variations}.'
+            )
+        
+        return prompt
+    
+    def _format_details(self, listing_data: Dict) -> str:
+        """Format the property details section of the prompt"""
         
         # Extract key details
         address = listing_data.get('address', 'Property')
@@ -81,61 +740,18 @@ class CaptionGenerator:
         if sqft:
             details.append(f"{sqft:,} sq ft")
         
-        details_str = ", ".join(details) if details else ""
-        features_str = ", ".join(features) if features else ""
+        lines = [
+            f"- Type: {prop_type}",
+            f"- Address: {address}",
+            f"- Price: {price}",
+            f"- Specs: {', '.join(details)}"
+        ]
+        if features:
+            lines.append(f"- Key Features: {', '.join(features)}")
+        if description:
+            lines.append(f"- Description: {description[:200]}")
         
-        prompt = f"""Generate {num_variations} different Instagram/Facebook caption variations for a real estate {post_type.lower()}.
-
-Property Details:
-- Type: {prop_type}
-- Address: {address}
-- Price: {price}
-- Specs: {details_str}
-{f'- Key Features: {features_str}' if features_str else ''}
-{f'- Description: {description[:200]}' if description else ''}
-
-Requirements:
-1. Create {num_variations} DISTINCT variations with different tones:
-   - Variation 1: Professional and descriptive (emphasize value/features)
-   - Variation 2: Warm and inviting (appeal to emotion/lifestyle)
-   - Variation 3: Urgent and action-oriented (create FOMO/call-to-action)
-
-2. Each caption should:
-   - Be 100-150 words
-   - Include relevant emojis (but don't overdo it)
-   - Have a clear call-to-action (DM, call, visit)
-   - Sound natural, not salesy
-   - Highlight what makes this property special
-
-3. Include 15-20 relevant hashtags for each caption:
-   - Mix of broad (#RealEstate, #HomesForSale) and local tags
-   - Property-specific tags (#LuxuryHome, #FirstTimeHomeBuyer, etc.)
-   - Location-based tags (use generic if location unknown)
-
-Format each variation exactly like this:
-
-VARIATION 1:
-[caption text here]
-
-Hashtags: #tag1 #tag2 #tag3 [etc]
-
----
-
-VARIATION 2:
-[caption text here]
-
-Hashtags: #tag1 #tag2 #tag3 [etc]
-
----
-
-VARIATION 3:
-[caption text here]
-
-Hashtags: #tag1 #tag2 #tag3 [etc]
-
-Generate now:"""
-        
-        return prompt
+        return "\n".join(lines)
     
     def _parse_response(self, content: str, expected_count: int) -> List[Dict]:
         """Parse the AI response into structured caption data"""
@@ -145,70 +761,352 @@ Generate now:"""
         variations = content.split('---')
         
         for i, variation in enumerate(variations[:expected_count], 1):
-            if not variation.strip():
+            caption = self._parse_variation(variation, i)
+            if caption:
+                captions.append(caption)
+        
+        self._record_parse(expected_count, len(captions))
+        
+        # Ensure we have at least one caption
+        if not captions:
+            self._record(fallbacks=1)
+            captions.append(dict(FALLBACK_CAPTION))
+        
+        return captions
+    
+    def _record_parse(self, expected_count: int, valid_count: int) -> None:
+        invalid = max(0, expected_count - valid_count)
+        self._record(responses=1, variations_requested=expected_count,
+                     variations_invalid=invalid, parse_failures=1 if invalid else 0)
+    
+    def _parse_structured(self, content: str, expected_count: int,
+                          repair: bool = False) -> Dict[int, Dict]:
+        """
+        Validate a JSON caption response
+        
+        Returns:
+            Dictionary mapping variation number to caption data, containing
+            only the variations that passed validation
+        """
+        valid = _validate_variations(_load_variations(content), expected_count)
+        if repair:
+            self._record(repairs=1, repair_failures=0 if valid else 1)
+        else:
+            self._record_parse(expected_count, len(valid))
+        return valid
+    
+    def _finish_structured(self, captions: Dict[int, Dict]) -> List[Dict]:
+        """Order validated captions, falling back to the canned caption if none"""
+        if not captions:
+            self._record(fallbacks=1)
+            return [dict(FALLBACK_CAPTION)]
+        return [captions[index] for index in sorted(captions)]
+    
+    def _parse_variation(self, variation: str, index: int) -> Optional[Dict]:
+        """Parse one '---' separated block into caption data, or None if empty"""
+        if not variation.strip():
+            return None
+        
+        # Extract caption and hashtags
+        lines = variation.strip().split('\n')
+        caption_lines = []
+        hashtags = ""
+        
+        in_caption = False
+        for line in lines:
+            line = line.strip()
+            
+            # Skip variation headers
+            if line.startswith('VARIATION'):
+                in_caption = True
                 continue
             
-            # Extract caption and hashtags
-            lines = variation.strip().split('\n')
-            caption_lines = []
-            hashtags = ""
+            # Extract hashtags
+            if line.lower().startswith('hashtags:'):
+                hashtags = line.split(':', 1)[1].strip()
+                break
+            
+            # Collect caption text
+            if in_caption and line and not line.startswith('#'):
+                caption_lines.append(line)
+        
+        caption_text = '\n'.join(caption_lines).strip()
+        
+        if not caption_text:
+            return None
+        
+        return _caption_entry(index, caption_text, hashtags)
+    
+    def stream_captions(self, listing_data: Dict, post_type: str = "New Listing",
+                        num_variations: int = 3, force_refresh: bool = False,
+                        tones: Optional[List[str]] = None) -> Iterator[Dict]:
+        """
+        Generate captions, yielding each variation as soon as it is complete
+        
+        The completion is streamed and split on '---' as it arrives, so the
+        first caption can be shown long before the last one is written. The
+        yielded captions are the same as generate_captions would return.
+        
+        Args:
+            listing_data: Dictionary containing listing details
+            post_type: Type of post (New Listing, Open House, etc.)
+            num_variations: Number of caption variations to generate
+            force_refresh: Skip the cache and generate new captions
+            tones: Optional tone per variation (professional, warm, urgent)
+            
+        Yields:
+            Caption dictionaries in variation order
+        """
+        # The stream runs in its own context, so its metrics span stays open
+        # across yields without becoming the caller's current span
+        context = contextvars.copy_context()
+        captions = self._stream_captions(listing_data, post_type, num_variations,
+                                         force_refresh, tones)
+        try:
+            while True:
+                try:
+                    caption = context.run(next, captions)
+                except StopIteration:
+                    return
+                yield caption
+        finally:
+            context.run(captions.close)
+    
+    def _stream_captions(self, listing_data: Dict, post_type: str, num_variations: int,
+                         force_refresh: bool, tones: Optional[List[str]]) -> Iterator[Dict]:
+        with metrics.span('captions.generate', post_type=post_type,
+                          variations=num_variations, streamed=True) as span:
+            # Streaming always uses the plain-text prompt
+            cached = self._cache_lookup(listing_data, post_type, num_variations,
+                                        force_refresh, tones, structured=False)
+            if cached is not None:
+                span.set(cached=True)
+                yield from cached
+                return
+            
+            prompt = self._build_prompt(listing_data, post_type, num_variations, tones)
+            options = dict(self._completion_options(num_variations, False,
+                                                    self.router.choose(num_variations)),
+                           stream=True)
+            captions = []
+            received = []
+            start = time.perf_counter()
             
-            in_caption = False
-            for line in lines:
-                line = line.strip()
+            try:
+                stream = self.client.chat.completions.create(
+                    messages=self._messages(prompt),
+                    **options
+                )
                 
-                # Skip variation headers
-                if line.startswith('VARIATION'):
-                    in_caption = True
-                    continue
+                buffer = ''
+                index = 0
+                try:
+                    for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content or ''
+                        received.append(content)
+                        buffer += content
+                        
+                        # Same splitting as _parse_response: the leftmost '---' in
+                        # the buffer is the leftmost one in the full completion
+                        while '---' in buffer and index < num_variations:
+                            block, buffer = buffer.split('---', 1)
+                            index += 1
+                            caption = self._parse_variation(block, index)
+                            if caption:
+                                captions.append(caption)
+                                yield caption
+                        
+                        if index >= num_variations:
+                            # Later blocks would be discarded anyway
+                            break
+                finally:
+                    stream.close()
                 
-                # Extract hashtags
-                if line.lower().startswith('hashtags:'):
-                    hashtags = line.split(':', 1)[1].strip()
-                    break
+                if index < num_variations:
+                    caption = self._parse_variation(buffer, index + 1)
+                    if caption:
+                        captions.append(caption)
+                        yield caption
                 
-                # Collect caption text
-                if in_caption and line and not line.startswith('#'):
-                    caption_lines.append(line)
+            except Exception as e:
+                self.router.record(options['model'], time.perf_counter() - start, ok=False)
+                raise Exception(f"Failed to generate captions: {str(e)}")
             
-            caption_text = '\n'.join(caption_lines).strip()
+            self.router.record(options['model'], time.perf_counter() - start, ok=True)
+            if metrics.enabled():
+                # Streamed chunks carry no usage, so count the tokens sent and received
+                metrics.add(requests=1,
+                            prompt_tokens=estimate_tokens(SYSTEM_PROMPT + prompt),
+                            completion_tokens=estimate_tokens(''.join(received)))
+            self._record_parse(num_variations, len(captions))
+            if not captions:
+                self._record(fallbacks=1)
+                captions.append(dict(FALLBACK_CAPTION))
+                yield captions[0]
             
-            if caption_text:
-                captions.append({
-                    'variation': i,
-                    'caption': caption_text,
-                    'hashtags': hashtags,
-                    'full_text': f"{caption_text}\n\n{hashtags}",
-                    'character_count': len(caption_text) + len(hashtags) + 2
-                })
-        
-        # Ensure we have at least one caption
-        if not captions:
-            captions.append({
-                'variation': 1,
-                'caption': "Beautiful property now available! Contact us for details.",
-                'hashtags': "#RealEstate #HomesForSale #Property #DreamHome",
-                'full_text': "Beautiful property now available! Contact us for details.\n\n#RealEstate #HomesForSale #Property #DreamHome",
-                'character_count': 100
-            })
-        
-        return captions
+            self._cache_store(listing_data, post_type, num_variations, options['model'], captions,
+                              tones, structured=False)
     
-    def generate_single_caption(self, listing_data: Dict, tone: str = "professional") -> Dict:
+    def generate_single_caption(self, listing_data: Dict, tone: str = "professional",
+                                post_type: str = "New Listing") -> Dict:
         """
         Generate a single caption with specific tone
         
         Args:
             listing_data: Dictionary containing listing details
             tone: Tone of caption (professional, warm, urgent)
+            post_type: Type of post
             
         Returns:
             Dictionary with caption and hashtags
         """
-        captions = self.generate_captions(listing_data, num_variations=1)
+        captions = self.generate_captions(listing_data, post_type, num_variations=1, tones=[tone])
         return captions[0] if captions else None
 
 
+def _caption_entry(index: int, caption_text: str, hashtags: str) -> Dict:
+    """Caption data in the shape every generation mode returns"""
+    return {
+        'variation': index,
+        'caption': caption_text,
+        'hashtags': hashtags,
+        'full_text': f"{caption_text}\n\n{hashtags}",
+        'character_count': len(caption_text) + len(hashtags) + 2
+    }
+
+
+def _load_json_object(content: str) -> Dict:
+    """The JSON object in a response, tolerating code fences ({} if there is none)"""
+    content = (content or '').strip()
+    start, end = content.find('{'), content.rfind('}')
+    if start == -1 or end < start:
+        return {}
+    try:
+        data = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _load_variations(content: str) -> List:
+    """Pull the 'variations' list out of a JSON response"""
+    variations = _load_json_object(content).get('variations')
+    return variations if isinstance(variations, list) else []
+
+
+def _validate_variations(items: List, expected_count: int) -> Dict[int, Dict]:
+    """Caption data for each usable variation in a parsed JSON list, by number"""
+    valid = {}
+    for position, item in enumerate(items[:expected_count], 1):
+        if not isinstance(item, dict):
+            continue
+        caption_text = item.get('caption')
+        hashtags = item.get('hashtags', '')
+        if isinstance(hashtags, list):
+            hashtags = ' '.join(str(tag) for tag in hashtags)
+        if not isinstance(caption_text, str) or not caption_text.strip():
+            continue
+        if not isinstance(hashtags, str) or '#' not in hashtags:
+            continue
+        index = item.get('variation')
+        if not isinstance(index, int) or not 1 <= index <= expected_count or index in valid:
+            index = position
+        valid[index] = _caption_entry(index, caption_text.strip(), hashtags.strip())
+    return valid
+
+
+def resolve_tones(num_variations: int, tones: Optional[List[str]] = None) -> List[str]:
+    """Tone name for each variation, defaulting to the TONES order repeated"""
+    names = list(tones) if tones else list(TONES)
+    return [names[i % len(names)] for i in range(num_variations)]
+
+
+def describe_tones(num_variations: int, tones: Optional[List[str]] = None) -> List[str]:
+    """
+    Tone instructions for each variation
+    
+    Args:
+        num_variations: Number of variations requested
+        tones: Tone names (keys of TONES) or free-form tone descriptions;
+            defaults to the TONES order, repeated if needed
+        
+    Returns:
+        One instruction line per variation
+    """
+    return [TONES.get(name.lower(), name[:1].upper() + name[1:])
+            for name in resolve_tones(num_variations, tones)]
+
+
+def _requirements(num_variations: int, tones: Optional[List[str]] = None) -> str:
+    """The requirements section shared by single and packed prompts"""
+    tone_lines = describe_tones(num_variations, tones)
+    if num_variations == 1:
+        tone_requirement = f"1. Tone: {tone_lines[0]}"
+    else:
+        tone_requirement = (f"1. Create {num_variations} DISTINCT variations with different tones:\n"
+                            + "\n".join(f"   - Variation {i}: {line}"
+                                        for i, line in enumerate(tone_lines, 1)))
+    return f"""Requirements:
+{tone_requirement}
+
+2. Each caption should:
+   - Be 100-150 words
+   - Include relevant emojis (but don't overdo it)
+   - Have a clear call-to-action (DM, call, visit)
+   - Sound natural, not salesy
+   - Highlight what makes this property special
+
+3. Include 15-20 relevant hashtags for each caption:
+   - Mix of broad (#RealEstate, #HomesForSale) and local tags
+   - Property-specific tags (#LuxuryHome, #FirstTimeHomeBuyer, etc.)
+   - Location-based tags (use generic if location unknown)"""
+
+
+def completion_budget(num_variations: int) -> int:
+    """max_tokens sized to the number of variations requested"""
+    return num_variations * TOKENS_PER_VARIATION + COMPLETION_OVERHEAD_TOKENS
+
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def _record_usage(response) -> None:
+    """Add the completion's token usage to the open metrics span"""
+    if not metrics.enabled():
+        return
+    usage = getattr(response, 'usage', None)
+    metrics.add(requests=1)
+    if usage:
+        metrics.add(prompt_tokens=usage.prompt_tokens or 0,
+                    completion_tokens=usage.completion_tokens or 0)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Count tokens locally
+    
+    Uses tiktoken when it is installed, otherwise approximates BPE by
+    counting each punctuation mark as a token and splitting words into
+    chunks of about four characters.
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return sum(max(1, (len(piece) + 3) // 4) for piece in _TOKEN_PIECES.findall(text))
+
+
+_shared_generator = None
+
+
+def get_generator() -> CaptionGenerator:
+    """Return a CaptionGenerator shared across calls, so its clients stay warm"""
+    global _shared_generator
+    if _shared_generator is None:
+        _shared_generator = CaptionGenerator()
+    return _shared_generator
+
+
 # Convenience function
 def generate_listing_captions(listing_data: Dict, post_type: str = "New Listing") -> List[Dict]:
     """
@@ -221,8 +1119,7 @@ def generate_listing_captions(listing_data: Dict, post_type: str = "New Listing"
     Returns:
         List of caption variations
     """
-    generator = CaptionGenerator()
-    return generator.generate_captions(listing_data, post_type)
+    return get_generator().generate_captions(listing_data, post_type)
 
 
 # Example usage
@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for the listing scraper and caption generator
+Run from the repository root, e.g. python -m benchmarks.bench_scrape
+"""
@@ -0,0 +1,90 @@
+"""
+Caption Throughput Benchmark
+Compares sequential generate_captions with generate_many against a fake server
+"""
+
+import argparse
+import asyncio
+import time
+
+from ai_captions import CaptionGenerator
+from rate_limiter import RateLimiter
+from benchmarks.fake_openai import FakeOpenAIServer
+
+
+def sample_listings(count: int) -> list:
+    return [{
+        'address': f'{i} Main Street',
+        'price': f'${400000 + i * 1000:,}',
+        'bedrooms': 3,
+        'bathrooms': 2,
+        'square_feet': 1800,
+        'property_type': 'House',
+        'description': 'Beautiful updated home in prime location',
+        'features': ['Pool', 'Garage']
+    } for i in range(count)]
+
+
+def bench_streaming(listing: dict, token_latency: float) -> None:
+    """Time to first caption for streamed output versus the batch call"""
+    with FakeOpenAIServer(token_latency=token_latency) as server:
+        generator = CaptionGenerator(api_key='fake', cache=False, base_url=server.base_url)
+        
+        start = time.perf_counter()
+        batch = generator.generate_captions(listing)
+        batch_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        streamed = []
+        first_time = None
+        for caption in generator.stream_captions(listing):
+            if first_time is None:
+                first_time = time.perf_counter() - start
+            streamed.append(caption)
+        stream_time = time.perf_counter() - start
+    
+    print(f"batch: all captions after {batch_time * 1000:.0f} ms")
+    print(f"stream: first caption after {first_time * 1000:.0f} ms, "
+          f"all after {stream_time * 1000:.0f} ms, "
+          f"same as batch: {streamed == batch}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Simulated completion latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--server-rpm', type=float, default=None,
+                        help='Make the fake server answer 429 above this rate')
+    parser.add_argument('--client-rpm', type=float, default=6000)
+    parser.add_argument('--token-latency', type=float, default=0.005,
+                        help='Seconds per streamed chunk for the streaming comparison')
+    args = parser.parse_args()
+    
+    listings = sample_listings(args.listings)
+    
+    with FakeOpenAIServer(latency=args.latency, requests_per_minute=args.server_rpm) as server:
+        generator = CaptionGenerator(api_key='fake', cache=False, base_url=server.base_url,
+                                     rate_limiter=RateLimiter(args.client_rpm, 10_000_000))
+        
+        count = min(len(listings), 10)
+        start = time.perf_counter()
+        for listing in listings[:count]:
+            generator.generate_captions(listing)
+        sequential = count / (time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        results = asyncio.run(generator.generate_many(listings, max_concurrency=args.concurrency))
+        concurrent = len(listings) / (time.perf_counter() - start)
+        errors = sum(1 for result in results if result['error'])
+        
+        print(f"sequential: {sequential:.1f} listings/sec")
+        print(f"generate_many (concurrency {args.concurrency}): {concurrent:.1f} listings/sec")
+        print(f"errors: {errors}, 429s from server: {server.rate_limited}")
+    
+    bench_streaming(listings[0], args.token_latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Hedged Request Benchmark
+Caption latency percentiles against a fake endpoint where a few requests
+are very slow, with and without hedged requests, and where the router
+sends single captions and variation sets
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from ai_captions import CaptionGenerator
+from benchmarks.fake_openai import FakeOpenAIServer
+from model_router import ModelRouter
+from rate_limiter import RateLimiter
+from service import percentile
+
+
+LISTING = {
+    'address': '12 Protea Street, Durbanville', 'price': 'R3,195,000', 'bedrooms': 3,
+    'bathrooms': 2.0, 'square_feet': 1500, 'property_type': 'House',
+    'description': 'Family home with a pool and a built-in braai.', 'features': ['Pool', 'Braai']
+}
+
+
+async def timed_run(generator: CaptionGenerator, count: int, concurrency: int,
+                    single_every: int) -> list:
+    """Caption count listings; every single_every-th asks for one caption"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(i: int) -> float:
+        num_variations = 1 if single_every and i % single_every == 0 else 3
+        async with semaphore:
+            start = time.perf_counter()
+            await generator.agenerate_captions(dict(LISTING, price=f"R{3_000_000 + i:,}"),
+                                               num_variations=num_variations)
+            return time.perf_counter() - start
+    
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def run(fake: FakeOpenAIServer, hedge_percentile: float, args) -> dict:
+    router = ModelRouter(strong_model='gpt-4', fast_model='gpt-3.5-turbo',
+                         hedge_percentile=hedge_percentile)
+    # Limits high enough that only the endpoint's latency is measured
+    generator = CaptionGenerator(api_key='benchmark', base_url=fake.base_url, cache=False,
+                                 router=router, rate_limiter=RateLimiter(1_000_000, 100_000_000))
+    
+    async def session():
+        # Warm-up gives the router the latency history it hedges from
+        await timed_run(generator, args.warmup, args.concurrency, args.single_every)
+        try:
+            return await timed_run(generator, args.requests, args.concurrency, args.single_every)
+        finally:
+            await generator.aclose()
+    
+    timings = sorted(asyncio.run(session()))
+    stats = router.stats()
+    return {
+        'p50': percentile(timings, 50) * 1000,
+        'p99': percentile(timings, 99) * 1000,
+        'mean': statistics.mean(timings) * 1000,
+        'hedges': sum(model['hedges'] for model in stats.values()),
+        'router': stats
+    }
+
+
+def check_recovery(probe_interval: float = 0.05) -> None:
+    """A model that failed is probed and takes its traffic back once it answers"""
+    router = ModelRouter(strong_model='gpt-4', fast_model='gpt-3.5-turbo', window=20,
+                         max_error_rate=0.5, probe_interval=probe_interval)
+    for _ in range(20):
+        router.record('gpt-4', 1.0, ok=False)
+    router.record('gpt-3.5-turbo', 0.1, ok=True)
+    
+    # Failing model: the first choice is a probe, then traffic fails over
+    assert router.choose(3) == 'gpt-4'
+    router.record('gpt-4', 1.0, ok=False)
+    assert router.choose(3) == 'gpt-3.5-turbo'
+    time.sleep(probe_interval)
+    # Recovered model: the next probe succeeds and it is preferred again
+    assert router.choose(3) == 'gpt-4'
+    assert router.choose(3) == 'gpt-3.5-turbo'
+    router.record('gpt-4', 0.5, ok=True)
+    assert [router.choose(3) for _ in range(5)] == ['gpt-4'] * 5
+    print("router recovery: failed model probed and preferred again after a successful probe")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--single-every', type=int, default=4,
+                        help='Every Nth listing asks for a single caption (fast model)')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=1.0)
+    args = parser.parse_args()
+    
+    check_recovery()
+    for label, hedge_percentile in (('single requests', 0), ('hedged at p95', 95)):
+        with FakeOpenAIServer(latency=args.latency, slow_rate=args.slow_rate,
+                              slow_latency=args.slow_latency,
+                              model_latency={'gpt-3.5-turbo': args.latency / 2}) as fake:
+            result = run(fake, hedge_percentile, args)
+        print(f"{label:>16}: p50 {result['p50']:6.1f} ms, p99 {result['p99']:7.1f} ms, "
+              f"mean {result['mean']:6.1f} ms, hedged requests {result['hedges']}")
+    
+    for model, stats in result['router'].items():
+        print(f"  {model}: {stats}")
+
+
+if __name__ == '__main__':
+    main()
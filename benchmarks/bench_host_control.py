@@ -0,0 +1,83 @@
+"""
+Host Control Benchmark
+Scrapes listings spread over a healthy host, a host that rate-limits with
+429 and Retry-After, and a host that is down, with fixed per-host limits and
+no retries versus adaptive limits, retries and circuit breakers
+"""
+
+import argparse
+import time
+
+from benchmarks.stub_server import StubServer
+from host_control import HostController
+from scraper import scrape_many
+
+
+def run(servers: dict, urls_per_host: int, controller: HostController,
+        max_concurrency: int, per_host: int) -> dict:
+    served = {name: (server.requests_served, dict(server.statuses)) for name, server in servers.items()}
+    urls = [f"{server.base_url}/listing/{i}"
+            for i in range(urls_per_host) for server in servers.values()]
+    hosts = {server.base_url.split('://')[1]: name for name, server in servers.items()}
+    
+    results = {name: {'ok': 0, 'errors': 0, 'finished': 0.0} for name in servers}
+    start = time.perf_counter()
+    for result in scrape_many(urls, max_concurrency=max_concurrency, per_host=per_host,
+                              controller=controller):
+        name = hosts[result['url'].split('://')[1].split('/')[0]]
+        results[name]['errors' if result['error'] else 'ok'] += 1
+        results[name]['finished'] = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    
+    for name, server in servers.items():
+        requests_before, statuses_before = served[name]
+        results[name]['requests'] = server.requests_served - requests_before
+        results[name]['throttled'] = server.statuses.get(429, 0) - statuses_before.get(429, 0)
+    return {'seconds': elapsed, 'hosts': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--urls-per-host', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--max-concurrency', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--limited-concurrency', type=int, default=2,
+                        help='Concurrent requests the rate-limited host accepts before 429')
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    args = parser.parse_args()
+    
+    modes = {
+        # What fetch_page did before: no retries, no breaker, fixed limits
+        'fixed': lambda: HostController(max_concurrency=args.per_host, max_retries=0,
+                                        breaker_threshold=0, adaptive=False),
+        'adaptive': lambda: HostController(max_concurrency=args.per_host, max_retries=5,
+                                           backoff_base=0.05, backoff_cap=1.0,
+                                           breaker_threshold=5, breaker_reset=60)
+    }
+    
+    with StubServer(latency=args.latency) as healthy, \
+            StubServer(latency=args.latency, congestion=args.latency / 2,
+                       max_concurrent=args.limited_concurrency, retry_after=args.retry_after) as limited, \
+            StubServer(latency=args.latency, status=503) as down:
+        servers = {'healthy': healthy, 'rate-limited': limited, 'down': down}
+        
+        alone = run({'healthy': healthy}, args.urls_per_host, modes['adaptive'](),
+                    args.max_concurrency, args.per_host)['hosts']['healthy']
+        print(f"healthy host alone: {args.urls_per_host / alone['finished']:.1f} pages/s")
+        
+        for mode, make_controller in modes.items():
+            controller = make_controller()
+            result = run(servers, args.urls_per_host, controller, args.max_concurrency, args.per_host)
+            print(f"\n{mode}: {result['seconds']:.2f} s")
+            stats = controller.stats()
+            for name, host in result['hosts'].items():
+                limit = stats.get(servers[name].base_url.split('://')[1], {})
+                print(f"  {name:>12}: {host['ok']:3}/{args.urls_per_host} ok, "
+                      f"{host['requests']:4} requests sent, {host['throttled']:4} answered 429, "
+                      f"{host['ok'] / host['finished'] if host['finished'] and host['ok'] else 0:6.1f} pages/s, "
+                      f"limit {limit.get('limit', 0):4.1f}, circuit {limit.get('circuit', '-')}")
+
+
+if __name__ == '__main__':
+    main()
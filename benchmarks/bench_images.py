@@ -0,0 +1,73 @@
+"""
+Image Pipeline Benchmark
+Compares serial download-and-resize with image_pipeline for a carousel
+"""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+import requests
+from PIL import Image, ImageOps
+
+from image_pipeline import RENDER_FORMATS, process_listing_images
+from benchmarks.stub_server import StubServer
+
+
+def make_photo(seed: int, size=(3000, 2000)) -> bytes:
+    """Noisy JPEG roughly the size of a portal's full-resolution photo"""
+    rng = random.Random(seed)
+    small = Image.new('RGB', (size[0] // 20, size[1] // 20))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                   for _ in range(small.width * small.height)])
+    buffer = io.BytesIO()
+    small.resize(size, Image.BILINEAR).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def serial(urls, out_dir: str) -> None:
+    """The straightforward approach: one image at a time, full decode"""
+    for i, url in enumerate(urls):
+        content = requests.get(url, timeout=15).content
+        image = Image.open(io.BytesIO(content)).convert('RGB')
+        for name, size in RENDER_FORMATS.items():
+            ImageOps.fit(image, size, method=Image.LANCZOS).save(
+                os.path.join(out_dir, f"{i}-{name}.jpg"), 'JPEG', quality=85)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    
+    pages = {f'/photos/{i}.jpg': make_photo(i) for i in range(args.photos)}
+    # A duplicate under another URL and an icon that should be skipped
+    pages['/cdn/0-large.jpg'] = pages['/photos/0.jpg']
+    icon = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(icon, 'PNG')
+    pages['/static/icon.png'] = icon.getvalue()
+    
+    with StubServer(latency=args.latency, pages=pages) as server:
+        urls = [f"{server.base_url}{path}" for path in pages]
+        
+        with tempfile.TemporaryDirectory() as out_dir:
+            start = time.perf_counter()
+            serial(urls, out_dir)
+            serial_time = time.perf_counter() - start
+        
+        with tempfile.TemporaryDirectory() as images_dir:
+            start = time.perf_counter()
+            records = process_listing_images(urls, images_dir=images_dir)
+            pipeline_time = time.perf_counter() - start
+    
+    print(f"serial:   {serial_time:.2f}s for {len(urls)} images")
+    print(f"pipeline: {pipeline_time:.2f}s, {len(records)} unique photos rendered "
+          f"({serial_time / pipeline_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
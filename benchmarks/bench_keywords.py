@@ -0,0 +1,72 @@
+"""
+Keyword Matching Benchmark
+Time to find vocabulary terms in a large listing page with one substring
+scan per term versus the compiled KeywordMatcher, as the vocabulary grows
+"""
+
+import argparse
+import random
+import statistics
+import string
+import time
+
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import SIZES, load_corpus
+from keywords import KeywordMatcher, get_default_matcher
+
+
+def synthetic_vocabulary(base: dict, size: int, rng: random.Random) -> dict:
+    """The real vocabulary padded with made-up multi-word terms to size terms"""
+    features = {name: list(terms) for name, terms in base['features'].items()}
+    count = sum(len(terms) + 1 for terms in features.values())
+    while count < size:
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                 for _ in range(rng.randint(1, 3))]
+        features[' '.join(words).title()] = []
+        count += 1
+    return {'features': features}
+
+
+def substring_scan(lowered: str, terms) -> list:
+    """The previous approach: one `in` scan of the page per term"""
+    return [term for term in terms if term in lowered]
+
+
+def measure(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='340,1000,3000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    
+    html = next(html for name, label, html in load_corpus({'large': SIZES['large']}) if name == 'za_portal')
+    lowered = BeautifulSoup(html, 'lxml').get_text(' ').lower()
+    print(f"page text: {len(lowered) / 1024:.0f} KB")
+    
+    base = get_default_matcher().vocabulary
+    for size in (int(value) for value in args.sizes.split(',')):
+        vocabulary = synthetic_vocabulary(base, size, rng)
+        terms = [name.lower() for name in vocabulary['features']] + \
+                [term for names in vocabulary['features'].values() for term in names]
+        start = time.perf_counter()
+        matcher = KeywordMatcher(vocabulary)
+        compile_ms = (time.perf_counter() - start) * 1000
+        
+        substring_ms = measure(lambda: substring_scan(lowered, terms), args.repeat)
+        matcher_ms = measure(lambda: matcher.scan(lowered, lowercase=False), args.repeat)
+        print(f"{len(terms):>5} terms: substring scans {substring_ms:7.2f} ms, "
+              f"compiled matcher {matcher_ms:6.2f} ms (compile {compile_ms:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Listing Store Benchmark
+Average price per bedroom by suburb and 'already captioned?' lookups over
+many listings, from JSON blobs (as checkpoints and snapshots keep them)
+versus the columnar listing store
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from listing_store import ListingStore, parse_suburb
+from scraper import parse_price
+
+
+SUBURBS = ['Sea Point', 'Green Point', 'Claremont', 'Rondebosch', 'Durbanville', 'Bellville',
+           'Constantia', 'Hout Bay', 'Observatory', 'Woodstock', 'Milnerton', 'Tokai']
+PROPERTY_TYPES = ['House', 'Apartment', 'Townhouse', 'Condo', 'Land']
+
+
+def sample_listings(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    listings = []
+    for i in range(count):
+        bedrooms = rng.choice([None, 1, 2, 3, 3, 4, 5])
+        amount = rng.randrange(400, 9000) * 1000
+        price = rng.choice([f"${amount:,}", f"R {amount:,}".replace(',', ' '), 'Price not listed'])
+        listings.append({
+            'url': f"https://portal.example.com/listing/{i}",
+            'title': f"{bedrooms or 'Spacious'} bedroom home",
+            'price': price,
+            'address': f"{rng.randrange(1, 200)} Main Road, {rng.choice(SUBURBS)}, Cape Town, 8001",
+            'bedrooms': bedrooms,
+            'bathrooms': rng.choice([None, 1.0, 1.5, 2.0, 2.5, 3.0]),
+            'square_feet': rng.choice([None, rng.randrange(500, 5000)]),
+            'description': 'Light-filled family home close to schools and shops. ' * 4,
+            'images': [f"https://cdn.example.com/{i}/{n}.jpg" for n in range(10)],
+            'property_type': rng.choice(PROPERTY_TYPES),
+            'features': ['Pool', 'Garden', 'Garage']
+        })
+    return listings
+
+
+def price_per_bedroom_from_json(blobs: list) -> dict:
+    """The report as it had to be computed before: parse every blob"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for blob in blobs:
+        listing = json.loads(blob)
+        price = parse_price(listing.get('price'))
+        bedrooms = listing.get('bedrooms')
+        if price is None or not bedrooms:
+            continue
+        group = totals[parse_suburb(listing.get('address'))]
+        group[0] += 1
+        group[1] += price / bedrooms
+    return {suburb: total / count for suburb, (count, total) in totals.items()}
+
+
+def timed(function, repeat: int = 5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+    
+    listings = sample_listings(args.listings)
+    blobs = [json.dumps(listing) for listing in listings]
+    captioned = {listing['url'] for listing in listings[::3]}
+    
+    with tempfile.TemporaryDirectory() as directory:
+        store = ListingStore(directory)
+        start = time.perf_counter()
+        store.append_many(listings)
+        append_ms = (time.perf_counter() - start) * 1000
+        for url in list(captioned)[:args.lookups]:
+            store.mark_captioned(url, 3)
+        
+        _, open_ms = timed(lambda: ListingStore(directory), repeat=3)
+        expected, json_ms = timed(lambda: price_per_bedroom_from_json(blobs), repeat=1)
+        stats, store_ms = timed(lambda: store.group_stats('price_per_bedroom', by='suburb'))
+        for suburb, mean in expected.items():
+            assert abs(stats[suburb]['mean'] - mean) < 1e-6 * mean, suburb
+        _, filter_ms = timed(lambda: store.rows(suburb='Sea Point', min_bedrooms=3,
+                                                max_price=2_000_000, property_type='House'))
+        
+        urls = [listing['url'] for listing in listings[:args.lookups]]
+        by_url = {listing['url']: blob for listing, blob in zip(listings, blobs)}
+        _, json_lookup_ms = timed(lambda: [json.loads(by_url[url]).get('captions') for url in urls])
+        _, store_lookup_ms = timed(lambda: [store.has(url, captioned=True) for url in urls])
+    
+    print(f"{args.listings} listings: appended in {append_ms:.0f} ms, store reopened in {open_ms:.1f} ms")
+    print(f"price per bedroom by suburb: JSON blobs {json_ms:8.1f} ms, store {store_ms:6.1f} ms "
+          f"({json_ms / store_ms:.0f}x)")
+    print(f"filtered rows (suburb, bedrooms, price, type): {filter_ms:.1f} ms")
+    print(f"{args.lookups} captioned lookups: JSON blobs {json_lookup_ms:.1f} ms, "
+          f"store {store_lookup_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Packed Caption Benchmark
+Requests, prompt tokens and time to caption many listings with one request
+per listing versus several listings packed into each request, against a
+fake endpoint that leaves some listings out of packed responses
+"""
+
+import argparse
+import asyncio
+import time
+
+from ai_captions import CaptionGenerator
+from benchmarks.bench_captions import sample_listings
+from benchmarks.fake_openai import FakeOpenAIServer
+from rate_limiter import RateLimiter
+
+
+def run(fake: FakeOpenAIServer, listings: list, pack_size: int, concurrency: int) -> dict:
+    # Limits high enough that only the endpoint's latency is measured
+    generator = CaptionGenerator(api_key='benchmark', base_url=fake.base_url, cache=False,
+                                 structured=True, rate_limiter=RateLimiter(1_000_000, 100_000_000))
+    
+    async def session():
+        try:
+            if pack_size > 1:
+                return await generator.generate_packed(listings, pack_size=pack_size,
+                                                       max_concurrency=concurrency)
+            return await generator.generate_many(listings, max_concurrency=concurrency)
+        finally:
+            await generator.aclose()
+    
+    served = fake.requests_served
+    start = time.perf_counter()
+    results = asyncio.run(session())
+    elapsed = time.perf_counter() - start
+    report = generator.packing_report(listings, pack_size=max(pack_size, 1))
+    return {
+        'seconds': elapsed,
+        'requests': fake.requests_served - served,
+        'prompt_tokens': report['packed_prompt_tokens' if pack_size > 1 else 'single_prompt_tokens'],
+        'captioned': sum(1 for result in results if result['captions']),
+        'fallbacks': generator.parse_stats['packed_fallbacks']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=300)
+    parser.add_argument('--pack-sizes', default='1,5,10')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--failure-rate', type=float, default=0.02,
+                        help='Share of listings left out of a packed response')
+    args = parser.parse_args()
+    listings = sample_listings(args.listings)
+    
+    with FakeOpenAIServer(latency=args.latency, json_failure_rate=args.failure_rate) as fake:
+        for pack_size in (int(value) for value in args.pack_sizes.split(',')):
+            result = run(fake, listings, pack_size, args.concurrency)
+            label = 'one per request' if pack_size <= 1 else f'{pack_size} per request'
+            print(f"{label:>16}: {result['requests']:4} requests, "
+                  f"{result['prompt_tokens']:7} prompt tokens "
+                  f"({result['prompt_tokens'] / len(listings):5.1f} per listing), "
+                  f"{result['seconds']:5.2f} s, {result['captioned']}/{len(listings)} captioned, "
+                  f"{result['fallbacks']} retried alone")
+
+
+if __name__ == '__main__':
+    main()
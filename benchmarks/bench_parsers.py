@@ -0,0 +1,98 @@
+"""
+Parser Backend Benchmark
+Checks that every HTML parser backend extracts identical listing data from
+the fixture corpus, then compares parse and extraction time per page size
+
+Usage:
+    python -m benchmarks.bench_parsers
+    python -m benchmarks.bench_parsers --check-only
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.corpus import SIZES, load_corpus
+from page_parsers import PARSER_BS4, PARSERS
+from scraper import ListingScraper
+
+
+def extract(content, parser: str, restrict_parse: bool) -> tuple:
+    scraper = ListingScraper('https://bench.local/listing', parser=parser,
+                             restrict_parse=restrict_parse)
+    scraper.load_html(content)
+    return scraper.extract_data(), scraper.field_sources, scraper.page_text
+
+
+def check_conformance(corpus) -> int:
+    """
+    Compare every backend with BeautifulSoup on str and bytes input, with
+    and without restricted parsing
+    
+    Returns:
+        Number of pages compared
+    """
+    compared = 0
+    for name, label, html in corpus:
+        for content in (html, html.encode('utf-8')):
+            for restrict_parse in (False, True):
+                expected = extract(content, PARSER_BS4, restrict_parse)
+                for parser in PARSERS:
+                    if parser == PARSER_BS4:
+                        continue
+                    result = extract(content, parser, restrict_parse)
+                    for part, before, after in zip(('extract_data()', 'field_sources', 'page text'),
+                                                   expected, result):
+                        if before != after:
+                            raise AssertionError(
+                                f"{parser} {part} differs from {PARSER_BS4} on {name} ({label}, "
+                                f"{type(content).__name__}, restrict_parse={restrict_parse})")
+                compared += 1
+    return compared
+
+
+def time_backend(html: str, parser: str, repeat: int) -> dict:
+    """Median milliseconds for parsing and for the rest of extract_data()"""
+    parse, rest = [], []
+    for _ in range(repeat):
+        scraper = ListingScraper('https://bench.local/listing', parser=parser)
+        start = time.perf_counter()
+        scraper.load_html(html)
+        parsed = time.perf_counter()
+        scraper.extract_data()
+        parse.append(parsed - start)
+        rest.append(time.perf_counter() - parsed)
+    return {'parse_ms': statistics.median(parse) * 1000,
+            'extract_ms': statistics.median(rest) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check-only', action='store_true', help='Only run the conformance check')
+    args = parser.parse_args()
+    corpus = load_corpus()
+    
+    compared = check_conformance(corpus)
+    print(f"conformance: {', '.join(PARSERS)} identical on {compared} page variants")
+    if args.check_only:
+        return
+    
+    print(f"{'size':<8}{'backend':<8}{'parse ms':>10}{'extract ms':>12}{'total ms':>10}{'speedup':>9}")
+    for label in SIZES:
+        totals = {}
+        for backend in PARSERS:
+            timings = [time_backend(html, backend, args.repeat)
+                       for _, page_label, html in corpus if page_label == label]
+            parse = sum(timing['parse_ms'] for timing in timings)
+            extract_ms = sum(timing['extract_ms'] for timing in timings)
+            totals[backend] = (parse, extract_ms)
+        baseline = sum(totals[PARSER_BS4])
+        for backend, (parse, extract_ms) in totals.items():
+            total = parse + extract_ms
+            print(f"{label:<8}{backend:<8}{parse:>10.1f}{extract_ms:>12.1f}{total:>10.1f}"
+                  f"{baseline / total:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Prompt Token Report
+Compares prompt tokens, max_tokens and completion tokens of the previous
+fixed three-variation prompt with the tone-specific prompt builder, and
+fails if the new prompt is larger or max_tokens is not completion_budget()
+"""
+
+from ai_captions import (_ENCODING, CaptionGenerator, SYSTEM_PROMPT, completion_budget,
+                         estimate_tokens)
+from benchmarks.bench_captions import sample_listings
+from benchmarks.fake_openai import canned_captions
+
+
+# Previous prompt: three-variation instructions and format whatever was requested
+LEGACY_TEMPLATE = """Generate {n} different Instagram/Facebook caption variations for a real estate {post_type}.
+
+Property Details:
+{details}
+
+Requirements:
+1. Create {n} DISTINCT variations with different tones:
+   - Variation 1: Professional and descriptive (emphasize value/features)
+   - Variation 2: Warm and inviting (appeal to emotion/lifestyle)
+   - Variation 3: Urgent and action-oriented (create FOMO/call-to-action)
+
+2. Each caption should:
+   - Be 100-150 words
+   - Include relevant emojis (but don't overdo it)
+   - Have a clear call-to-action (DM, call, visit)
+   - Sound natural, not salesy
+   - Highlight what makes this property special
+
+3. Include 15-20 relevant hashtags for each caption:
+   - Mix of broad (#RealEstate, #HomesForSale) and local tags
+   - Property-specific tags (#LuxuryHome, #FirstTimeHomeBuyer, etc.)
+   - Location-based tags (use generic if location unknown)
+
+Format each variation exactly like this:
+
+VARIATION 1:
+[caption text here]
+
+Hashtags: #tag1 #tag2 #tag3 [etc]
+
+---
+
+VARIATION 2:
+[caption text here]
+
+Hashtags: #tag1 #tag2 #tag3 [etc]
+
+---
+
+VARIATION 3:
+[caption text here]
+
+Hashtags: #tag1 #tag2 #tag3 [etc]
+
+Generate now:"""
+
+LEGACY_MAX_TOKENS = 1000
+
+
+def compare(generator: CaptionGenerator, listing: dict, num_variations: int, tones=None) -> dict:
+    """
+    Prompt, max_tokens and completion tokens before and after for one request
+    
+    The previous prompt always spelled out three variations, so the model
+    wrote three whatever was requested.
+    """
+    details = generator._format_details(listing)
+    legacy = LEGACY_TEMPLATE.format(n=num_variations, post_type='new listing', details=details)
+    prompt = generator._build_prompt(listing, 'New Listing', num_variations, tones)
+    result = {
+        'prompt_before': estimate_tokens(SYSTEM_PROMPT + legacy),
+        'prompt_after': estimate_tokens(SYSTEM_PROMPT + prompt),
+        'max_tokens_before': LEGACY_MAX_TOKENS,
+        'max_tokens_after': generator._completion_options(num_variations, False)['max_tokens'],
+        'completion_before': estimate_tokens(canned_captions(3)),
+        'completion_after': estimate_tokens(canned_captions(num_variations))
+    }
+    
+    assert result['prompt_after'] <= result['prompt_before'], result
+    assert result['max_tokens_after'] == completion_budget(num_variations), result
+    assert result['completion_after'] <= result['completion_before'], result
+    assert result['completion_after'] <= result['max_tokens_after'], result
+    return result
+
+
+def main():
+    generator = CaptionGenerator(api_key='unused', cache=False)
+    listing = sample_listings(1)[0]
+    
+    counting = 'tiktoken' if _ENCODING is not None else 'approximate (tiktoken not installed)'
+    print(f"token counts: {counting}")
+    print(f"{'request':<20}{'prompt before':>14}{'after':>7}{'max_tokens before':>19}{'after':>7}"
+          f"{'completion before':>19}{'after':>7}")
+    for label, num_variations, tones in [
+        ('single (warm)', 1, ['warm']),
+        ('two variations', 2, None),
+        ('three variations', 3, None),
+    ]:
+        result = compare(generator, listing, num_variations, tones)
+        print(f"{label:<20}{result['prompt_before']:>14}{result['prompt_after']:>7}"
+              f"{result['max_tokens_before']:>19}{result['max_tokens_after']:>7}"
+              f"{result['completion_before']:>19}{result['completion_after']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Queue Store Benchmark
+Enqueue and claim latency of QueueStore versus rewriting a JSON file,
+measured as the queue grows
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from config import AGENTS
+from queue_store import QueueStore
+
+
+def sample_post(i: int, rng: random.Random) -> dict:
+    return {
+        'listing_url': f'https://portal.example.com/listing/{i}',
+        'post_type': 'New Listing',
+        'agent': rng.choice(AGENTS),
+        'scheduled_at': time.time() - rng.uniform(0, 7 * 24 * 3600),
+        'captions': [{'caption': 'Stunning family home ' * 8, 'hashtags': '#realestate #forsale'}],
+        'images': [f'https://cdn.example.com/{i}/{n}.jpg' for n in range(10)]
+    }
+
+
+def json_enqueue(path: str, post: dict) -> None:
+    """What the queue.json approach costs: read, append, rewrite"""
+    queue = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            queue = json.load(f)
+    queue.append(post)
+    with open(path, 'w') as f:
+        json.dump(queue, f)
+
+
+def measure(func, samples: int) -> float:
+    timings = []
+    for i in range(samples):
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--json-max', type=int, default=10000,
+                        help='Largest queue size to time the JSON file at')
+    args = parser.parse_args()
+    rng = random.Random(0)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        store = QueueStore(os.path.join(directory, 'queue.db'))
+        json_path = os.path.join(directory, 'queue.json')
+        size = 0
+        for target in (int(value) for value in args.sizes.split(',')):
+            store.enqueue_many(sample_post(i, rng) for i in range(size, target))
+            if target <= args.json_max:
+                with open(json_path, 'w') as f:
+                    json.dump([sample_post(i, rng) for i in range(target)], f)
+            size = target
+            
+            enqueue_ms = measure(lambda i: store.enqueue(sample_post(size + i, rng)), args.samples)
+            claim_ms = measure(lambda i: store.claim('bench'), args.samples)
+            agent_claim_ms = measure(lambda i: store.claim('bench', agent=AGENTS[i % len(AGENTS)]),
+                                     args.samples)
+            line = (f"{target:>7} posts: enqueue {enqueue_ms:.3f} ms, claim {claim_ms:.3f} ms, "
+                    f"claim by agent {agent_claim_ms:.3f} ms")
+            if target <= args.json_max:
+                json_ms = measure(lambda i: json_enqueue(json_path, sample_post(i, rng)),
+                                  min(args.samples, 20))
+                line += f", queue.json enqueue {json_ms:.1f} ms"
+            print(line)
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
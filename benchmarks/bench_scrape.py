@@ -0,0 +1,58 @@
+"""
+Bulk Scraping Benchmark
+Compares sequential scrape_listing calls with scrape_many against a local stub
+"""
+
+import argparse
+import sys
+import time
+
+from scraper import scrape_listing, scrape_many
+from benchmarks.stub_server import StubServer
+
+
+def run(num_urls: int, latency: float, max_concurrency: int, per_host: int) -> dict:
+    with StubServer(latency=latency) as server:
+        urls = [f"{server.base_url}/listing/{i}" for i in range(num_urls)]
+        
+        start = time.perf_counter()
+        for url in urls:
+            scrape_listing(url)
+        sequential = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        errors = sum(1 for result in scrape_many(urls, max_concurrency=max_concurrency,
+                                                 per_host=per_host)
+                     if result['error'])
+        concurrent = time.perf_counter() - start
+    
+    return {
+        'urls': num_urls,
+        'sequential_pages_per_sec': num_urls / sequential,
+        'scrape_many_pages_per_sec': num_urls / concurrent,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--urls', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Simulated server latency in seconds')
+    parser.add_argument('--max-concurrency', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=16)
+    parser.add_argument('--target-rate', type=float, default=None,
+                        help='Exit non-zero if scrape_many is slower than this (pages/sec)')
+    args = parser.parse_args()
+    
+    result = run(args.urls, args.latency, args.max_concurrency, args.per_host)
+    for key, value in result.items():
+        print(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}")
+    
+    if args.target_rate and result['scrape_many_pages_per_sec'] < args.target_rate:
+        print(f"FAIL: below target rate of {args.target_rate} pages/sec")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Selector Lookup Micro-Benchmark
+Compares PageIndex lookups with the equivalent BeautifulSoup find() calls
+"""
+
+import argparse
+import random
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+from page_parsers import SoupDocument
+from scraper import PageIndex
+
+
+# The lookups the extractors perform on every page, as (name, attrs)
+LOOKUPS = [
+    ('meta', {'property': 'og:title'}),
+    ('h1', {}),
+    ('title', {}),
+    ('meta', {'property': 'og:price:amount'}),
+    (None, {'class': re.compile(r'price', re.I)}),
+    (None, {'id': re.compile(r'price', re.I)}),
+    (None, {'data-testid': 'price'}),
+    ('meta', {'property': 'og:street-address'}),
+    (None, {'class': re.compile(r'address', re.I)}),
+    (None, {'id': re.compile(r'address', re.I)}),
+    (None, {'itemprop': 'address'}),
+    (None, {'class': re.compile(r'bed', re.I)}),
+    (None, {'data-testid': re.compile(r'bed', re.I)}),
+    (None, {'class': re.compile(r'bath', re.I)}),
+    (None, {'data-testid': re.compile(r'bath', re.I)}),
+    ('meta', {'name': 'description'}),
+    (None, {'class': re.compile(r'description', re.I)}),
+    (None, {'id': re.compile(r'description', re.I)}),
+    (None, {'itemprop': 'description'}),
+    ('meta', {'property': 'og:image'}),
+]
+
+
+def generate_page(num_cards: int, seed: int = 0) -> str:
+    """Build a large portal-style page with many similar listing cards"""
+    rng = random.Random(seed)
+    cards = []
+    for i in range(num_cards):
+        cards.append(
+            f'<div class="card card-{i % 17}" id="card-{i}">'
+            f'<a class="card-link" href="/listing/{i}"><img src="/img/{i}.jpg" alt=""></a>'
+            f'<span class="card-meta">{rng.randint(1, 6)} rooms</span>'
+            f'<p class="card-blurb">{" ".join(rng.choice(["sunny", "quiet", "spacious", "modern"]) for _ in range(12))}</p>'
+            f'</div>'
+        )
+    # The fields the extractors look for sit at the end of the page
+    return (
+        '<html><head><title>Listing</title>'
+        '<meta property="og:title" content="Family Home"></head><body>'
+        + ''.join(cards) +
+        '<h1>Family Home</h1><div class="listing-price">$450,000</div>'
+        '<div class="property-address">123 Main Street</div>'
+        '<span data-testid="beds">3</span><span data-testid="baths">2</span>'
+        '<div class="description">A lovely home.</div></body></html>'
+    )
+
+
+def bench(html: str, repeat: int) -> dict:
+    soup = BeautifulSoup(html, 'lxml')
+    
+    start = time.perf_counter()
+    for _ in range(repeat):
+        expected = [soup.find(name, attrs=attrs) for name, attrs in LOOKUPS]
+    find_time = (time.perf_counter() - start) / repeat
+    
+    start = time.perf_counter()
+    for _ in range(repeat):
+        index = PageIndex(SoupDocument(soup))
+        indexed = [index.find(name, attrs=attrs) for name, attrs in LOOKUPS]
+    index_time = (time.perf_counter() - start) / repeat
+    
+    if [id(e) for e in expected] != [id(e) for e in indexed]:
+        raise AssertionError("PageIndex returned different elements than find()")
+    
+    return {
+        'elements': len(soup.find_all(True)),
+        'find_ms': find_time * 1000,
+        'index_ms': index_time * 1000,
+        'speedup': find_time / index_time
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pages', nargs='*', help='Saved HTML pages (a generated page is used if omitted)')
+    parser.add_argument('--cards', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    
+    pages = [(path, open(path, 'rb').read()) for path in args.pages]
+    if not pages:
+        pages = [(f'generated ({args.cards} cards)', generate_page(args.cards))]
+    
+    for label, html in pages:
+        result = bench(html, args.repeat)
+        print(f"{label}: {result['elements']} elements, "
+              f"find() {result['find_ms']:.1f} ms, "
+              f"index build + lookups {result['index_ms']:.1f} ms, "
+              f"{result['speedup']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
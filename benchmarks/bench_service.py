@@ -0,0 +1,87 @@
+"""
+Service Mode Benchmark
+Latency of scraping and captioning one listing by starting a new Python
+process per request versus calling the warm listing service
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from ai_captions import CaptionGenerator
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.stub_server import StubServer
+from service import ListingService, create_app
+
+
+COLD_SCRIPT = """
+import sys
+from ai_captions import CaptionGenerator
+from scraper import scrape_listing
+listing = scrape_listing(sys.argv[1])
+CaptionGenerator(api_key='benchmark', base_url=sys.argv[2], cache=False).generate_captions(listing)
+"""
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Skip werkzeug's per-request log line"""
+    
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def cold(url: str, openai_url: str) -> None:
+    """What the dashboard pays today: a fresh interpreter per listing"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', COLD_SCRIPT, url, openai_url], cwd=root, check=True,
+                   env=dict(os.environ, METRICS_SINKS=''))
+
+
+def measure(func, samples: int) -> float:
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Simulated listing page and OpenAI latency (seconds)')
+    args = parser.parse_args()
+    
+    with StubServer(latency=args.latency) as stub, FakeOpenAIServer(latency=args.latency) as fake:
+        url = f"{stub.base_url}/listing/1"
+        generator = CaptionGenerator(api_key='benchmark', base_url=fake.base_url, cache=False)
+        app = create_app(ListingService(generator=generator))
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        session = requests.Session()
+        service_url = f"http://127.0.0.1:{server.port}"
+        
+        def warm() -> None:
+            response = session.post(f"{service_url}/captions", json={'url': url})
+            response.raise_for_status()
+        
+        cold_ms = measure(lambda: cold(url, fake.base_url), args.samples)
+        warm()
+        warm_ms = measure(warm, args.samples)
+        server.shutdown()
+    
+    print(f"new process per listing: {cold_ms:.1f} ms")
+    print(f"warm service:            {warm_ms:.1f} ms ({cold_ms / warm_ms:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Streaming Fetch Benchmark
+Reports peak RSS and parse time for full, streamed and restricted fetches
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.stub_server import StubServer
+
+
+MODES = {
+    'full': {},
+    'stream': {'stream': True},
+    'stream+restrict': {'stream': True, 'restrict_parse': True},
+    'budget+restrict': {'max_bytes': 256 * 1024, 'restrict_parse': True},
+}
+
+# Runs in a fresh interpreter per mode so peak RSS is not shared between modes
+CHILD = """
+import json, resource, sys, time
+from scraper import ListingScraper
+
+url, options = sys.argv[1], json.loads(sys.argv[2])
+scraper = ListingScraper(url, **options)
+
+start = time.perf_counter()
+content = scraper.download()
+download = time.perf_counter() - start
+
+start = time.perf_counter()
+scraper.load_html(content)
+parse = time.perf_counter() - start
+
+data = scraper.extract_data()
+print(json.dumps({
+    'bytes': len(content),
+    'download_ms': download * 1000,
+    'parse_ms': parse * 1000,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'price': data['price'],
+    'bedrooms': data['bedrooms'],
+    'images': len(data['images'])
+}))
+"""
+
+
+def generate_page(script_mb: float) -> str:
+    """Listing page followed by large inline scripts, as on map-heavy portals"""
+    points = ','.join(
+        f'{{"lat":{-33.9 + i * 1e-5:.5f},"lng":{18.4 + i * 1e-5:.5f},"id":{i}}}'
+        for i in range(int(script_mb * 1024 * 1024 / 45))
+    )
+    return f"""<!DOCTYPE html>
+<html><head>
+<title>3 Bed House</title>
+<meta property="og:title" content="Charming 3 Bedroom Family Home">
+<meta property="og:image" content="https://cdn.example.com/photos/front.jpg">
+<meta name="description" content="Updated home with a pool.">
+</head><body>
+<nav>{'<a href="/x">Link</a>' * 200}</nav>
+<main>
+<h1>Charming 3 Bedroom Family Home</h1>
+<div class="listing-price">$450,000</div>
+<div class="property-address">123 Main Street</div>
+<ul class="facts"><li class="beds">3 beds</li><li class="baths">2 baths</li><li>2,100 sq ft</li></ul>
+<div class="description">Spacious house with a pool and garage.</div>
+{''.join(f'<img src="https://cdn.example.com/photos/{i}.jpg">' for i in range(12))}
+</main>
+<footer>{'<p>Footer text</p>' * 200}</footer>
+<script>window.__MAP__ = [{points}];</script>
+</body></html>"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--script-mb', type=float, default=4.0,
+                        help='Size of the inline map JSON in megabytes')
+    args = parser.parse_args()
+    
+    with StubServer(body=generate_page(args.script_mb)) as server:
+        url = f"{server.base_url}/listing/1"
+        for mode, options in MODES.items():
+            output = subprocess.run(
+                [sys.executable, '-c', CHILD, url, json.dumps(options)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:>16}: {result['bytes'] / 1024:8.0f} KB read, "
+                  f"parse {result['parse_ms']:7.1f} ms, "
+                  f"peak RSS {result['peak_rss_mb']:6.1f} MB, "
+                  f"price {result['price']}, beds {result['bedrooms']}, "
+                  f"{result['images']} images")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark Corpus
+Saved listing fixtures in several portal styles, inflated to several sizes
+"""
+
+import os
+import random
+from typing import Dict, List, Tuple
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Target page sizes in bytes (0 keeps the fixture as saved)
+SIZES = {
+    'small': 0,
+    'medium': 256 * 1024,
+    'large': 2 * 1024 * 1024,
+}
+
+
+def fixture_names() -> List[str]:
+    return sorted(name[:-len('.html')] for name in os.listdir(FIXTURES_DIR)
+                  if name.endswith('.html'))
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, f"{name}.html"), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def inflate(html: str, target_bytes: int, seed: int = 0) -> str:
+    """
+    Grow a page to roughly target_bytes the way real portals do
+    
+    Appends a "similar listings" block of cards and an inline map-data
+    script after the listing content, so the extracted fields stay the same
+    while the tree and text get as large as production pages.
+    """
+    if len(html.encode('utf-8')) >= target_bytes:
+        return html
+    
+    rng = random.Random(seed)
+    words = ['sunny', 'quiet', 'spacious', 'modern', 'charming', 'renovated', 'cozy', 'bright']
+    budget = target_bytes - len(html.encode('utf-8'))
+    cards = []
+    points = []
+    size = 0
+    i = 0
+    while size < budget:
+        card = (
+            f'<div class="similar-card" id="similar-{i}">'
+            f'<a href="/listing/{100000 + i}"><img src="/thumbs/{100000 + i}.jpg" alt=""></a>'
+            f'<span class="similar-meta">{rng.randint(1, 6)} rooms &middot; {rng.randint(40, 400)} m2</span>'
+            f'<p>{" ".join(rng.choice(words) for _ in range(16))}</p></div>'
+        )
+        point = f'{{"id":{i},"lat":{rng.uniform(-34, -33):.5f},"lng":{rng.uniform(18, 19):.5f}}}'
+        cards.append(card)
+        points.append(point)
+        size += len(card) + len(point) + 1
+        i += 1
+    
+    extra = (f'<section class="similar-listings">{"".join(cards)}</section>'
+             f'<script>window.__MAP_POINTS__=[{",".join(points)}];</script>')
+    index = html.rfind('</body>')
+    return html[:index] + extra + html[index:]
+
+
+def load_corpus(sizes: Dict[str, int] = None) -> List[Tuple[str, str, str]]:
+    """
+    Returns:
+        List of (fixture name, size label, html)
+    """
+    sizes = SIZES if sizes is None else sizes
+    corpus = []
+    for name in fixture_names():
+        html = load_fixture(name)
+        for label, target in sizes.items():
+            corpus.append((name, label, inflate(html, target) if target else html))
+    return corpus
@@ -0,0 +1,388 @@
+"""
+Fake OpenAI-Compatible Server
+Answers /v1/chat/completions with canned captions for offline benchmarks,
+plus the file upload and batch endpoints of the Batch API
+"""
+
+import email.policy
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from rate_limiter import TokenBucket
+
+
+def canned_json_captions(num_variations: int, rng: random.Random = None,
+                         failure_rate: float = 0.0) -> str:
+    """JSON completion, with each variation malformed at the given rate"""
+    rng = rng or random.Random()
+    variations = []
+    for i in range(1, num_variations + 1):
+        if rng.random() < failure_rate:
+            variations.append({'variation': i, 'caption': ''})
+            continue
+        text = canned_captions(i).split('---')[-1]
+        caption, hashtags = text.split('Hashtags:')
+        variations.append({
+            'variation': i,
+            'caption': caption.replace(f'VARIATION {i}:', '').strip(),
+            'hashtags': hashtags.strip()
+        })
+    return json.dumps({'variations': variations})
+
+
+def canned_packed_captions(count: int, num_variations: int, rng: random.Random = None,
+                           failure_rate: float = 0.0) -> str:
+    """
+    JSON completion for a packed prompt; at the given rate a listing is left
+    out of the response, and each variation is malformed
+    """
+    rng = rng or random.Random()
+    listings = []
+    for index in range(1, count + 1):
+        if rng.random() < failure_rate:
+            continue
+        variations = json.loads(canned_json_captions(num_variations, rng, failure_rate))['variations']
+        listings.append({'listing': index, 'variations': variations})
+    return json.dumps({'listings': listings})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def canned_captions(num_variations: int) -> str:
+    """Completion text in the VARIATION/Hashtags/--- format the parser expects"""
+    blocks = []
+    for i in range(1, num_variations + 1):
+        blocks.append(
+            f"VARIATION {i}:\n"
+            f"Welcome home to this stunning property! Variation {i} highlights the "
+            f"bright open-plan living spaces, the sparkling pool and the easy access "
+            f"to schools and shops. 🏡✨ DM us today to book your private viewing!\n\n"
+            f"Hashtags: #RealEstate #HomesForSale #DreamHome #NewListing #Variation{i}"
+        )
+    return "\n\n---\n\n".join(blocks)
+
+
+class FakeOpenAIServer:
+    """Threaded local server mimicking the chat completions and batch endpoints"""
+    
+    def __init__(self, latency: float = 0.0, requests_per_minute: Optional[float] = None,
+                 token_latency: float = 0.0, json_failure_rate: float = 0.0,
+                 model_latency: Optional[dict] = None, slow_rate: float = 0.0,
+                 slow_latency: float = 0.0, error_rate: float = 0.0,
+                 batch_latency: float = 0.0):
+        """
+        Args:
+            latency: Seconds to wait before answering each request
+            model_latency: Per-model latency overriding latency
+            slow_rate: Share of requests that take slow_latency instead
+                (the occasional very slow completion)
+            slow_latency: Seconds a slow request takes
+            error_rate: Share of requests answered with a 500 error (also
+                applied to each request of a batch)
+            batch_latency: Seconds a submitted batch stays in progress
+            token_latency: Seconds between streamed chunks (about one token each)
+            json_failure_rate: Share of JSON variations returned malformed
+            requests_per_minute: Answer 429 with Retry-After above this rate
+                (allowing bursts of one second's worth of requests)
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.json_failure_rate = json_failure_rate
+        self.model_latency = model_latency or {}
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.batch_latency = batch_latency
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+        self.slow_requests = 0
+        self.models = Counter()
+        self._rng = random.Random(0)
+        self.requests_served = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._bucket = None
+        if requests_per_minute:
+            self._bucket = TokenBucket(requests_per_minute, max(1.0, requests_per_minute / 60))
+        self._server = _Server(('127.0.0.1', 0), self._make_handler())
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def _retry_after(self) -> Optional[float]:
+        """Seconds the client must wait if over the rate limit, else None"""
+        if not self._bucket:
+            return None
+        with self._lock:
+            delay = self._bucket.delay_for(1)
+            if delay > 0:
+                self.rate_limited += 1
+                return delay
+            self._bucket.consume(1)
+            return None
+    
+    def _delay(self, model: str) -> float:
+        """Seconds to hold this request, drawing the injected slow requests"""
+        with self._lock:
+            self.models[model] += 1
+            if self.slow_rate and self._rng.random() < self.slow_rate:
+                self.slow_requests += 1
+                return self.slow_latency
+        return self.model_latency.get(model, self.latency)
+    
+    def _fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+    
+    def completion_text(self, request: dict) -> str:
+        prompt = request['messages'][-1]['content']
+        match = re.search(r'Generate (\d+)', prompt)
+        num_variations = int(match.group(1)) if match else 3
+        packed = re.search(r'for each of the (\d+)', prompt)
+        if packed and '"listings"' in prompt:
+            with self._lock:
+                return canned_packed_captions(int(packed.group(1)), num_variations, self._rng,
+                                              self.json_failure_rate)
+        if '"variations"' in prompt:
+            with self._lock:
+                return canned_json_captions(num_variations, self._rng, self.json_failure_rate)
+        return canned_captions(num_variations)
+    
+    def completion(self, request: dict, text: str) -> dict:
+        """Chat completion response body"""
+        prompt_tokens = sum(len(m['content']) for m in request['messages']) // 4
+        completion_tokens = len(text) // 4
+        with self._lock:
+            self.requests_served += 1
+            served = self.requests_served
+        return {
+            'id': f'chatcmpl-{served}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+    
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+    
+    def create_batch(self, request: dict) -> dict:
+        """Accept a batch and run it in the background"""
+        batch = {
+            'id': self._new_id('batch'),
+            'object': 'batch',
+            'endpoint': request.get('endpoint'),
+            'input_file_id': request.get('input_file_id'),
+            'completion_window': request.get('completion_window'),
+            'metadata': request.get('metadata'),
+            'status': 'in_progress',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0}
+        }
+        with self._lock:
+            self.batches[batch['id']] = batch
+        threading.Thread(target=self._run_batch, args=(batch['id'],), daemon=True).start()
+        return batch
+    
+    def _run_batch(self, batch_id: str) -> None:
+        """Answer every request of a batch, failing some at error_rate"""
+        time.sleep(self.batch_latency)
+        batch = self.batches[batch_id]
+        output, errors = [], []
+        for line in self.files[batch['input_file_id']].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            record = {'id': self._new_id('batch_req'), 'custom_id': item['custom_id'],
+                      'error': None}
+            if self._fail():
+                record['response'] = {'status_code': 500, 'body': {
+                    'error': {'message': 'Injected failure', 'type': 'server_error'}}}
+                errors.append(record)
+            else:
+                body = self.completion(item['body'], self.completion_text(item['body']))
+                record['response'] = {'status_code': 200, 'body': body}
+                output.append(record)
+        
+        with self._lock:
+            for records, field in ((output, 'output_file_id'), (errors, 'error_file_id')):
+                if records:
+                    file_id = f"file-{batch_id}-{field.split('_')[0]}"
+                    self.files[file_id] = ''.join(json.dumps(record) + '\n'
+                                                  for record in records).encode('utf-8')
+                    batch[field] = file_id
+            batch['request_counts'] = {'total': len(output) + len(errors),
+                                       'completed': len(output), 'failed': len(errors)}
+            batch['status'] = 'completed'
+            batch['completed_at'] = int(time.time())
+    
+    def _make_handler(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def _send_json(self, status: int, payload: dict, headers: dict = None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on this request (e.g. a cancelled hedge)
+                    pass
+            
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts[:2] == ['v1', 'batches'] and len(parts) == 3 and parts[2] in fake.batches:
+                    with fake._lock:
+                        self._send_json(200, dict(fake.batches[parts[2]]))
+                    return
+                if (parts[:2] == ['v1', 'files'] and len(parts) == 4 and parts[3] == 'content'
+                        and parts[2] in fake.files):
+                    body = fake.files[parts[2]]
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self._send_json(404, {'error': {'message': f"Unknown path {self.path}",
+                                                'type': 'invalid_request_error'}})
+            
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                if self.path.rstrip('/') == '/v1/files':
+                    self._upload(body)
+                    return
+                request = json.loads(body or b'{}')
+                if self.path.rstrip('/') == '/v1/batches':
+                    self._send_json(200, fake.create_batch(request))
+                    return
+                
+                retry_after = fake._retry_after()
+                if retry_after is not None:
+                    self._send_json(429, {'error': {'message': 'Rate limit reached',
+                                                    'type': 'rate_limit_error'}},
+                                    {'Retry-After': str(math.ceil(retry_after))})
+                    return
+                
+                delay = fake._delay(request.get('model', 'fake'))
+                if delay:
+                    time.sleep(delay)
+                if fake._fail():
+                    self._send_json(500, {'error': {'message': 'Injected failure',
+                                                    'type': 'server_error'}})
+                    return
+                
+                text = fake.completion_text(request)
+                if request.get('stream'):
+                    self._stream(request, text)
+                    return
+                if fake.token_latency:
+                    # A non-streamed answer arrives once every token is generated
+                    time.sleep(fake.token_latency * math.ceil(len(text) / 4))
+                self._send_json(200, fake.completion(request, text))
+            
+            def _upload(self, body: bytes):
+                """Store a multipart file upload (POST /v1/files)"""
+                header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8')
+                message = BytesParser(policy=email.policy.HTTP).parsebytes(header + body)
+                fields = {part.get_param('name', header='content-disposition'): part
+                          for part in message.iter_parts()}
+                content = fields['file'].get_payload(decode=True)
+                file_id = fake._new_id('file')
+                with fake._lock:
+                    fake.files[file_id] = content
+                self._send_json(200, {
+                    'id': file_id,
+                    'object': 'file',
+                    'bytes': len(content),
+                    'created_at': int(time.time()),
+                    'filename': fields['file'].get_filename() or 'upload',
+                    'purpose': fields['purpose'].get_content().strip() if 'purpose' in fields else 'batch',
+                    'status': 'processed'
+                })
+            
+            def _stream(self, request: dict, text: str):
+                """Send the completion as server-sent events, ~4 characters per chunk"""
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                
+                pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+                try:
+                    for i, piece in enumerate(pieces):
+                        if fake.token_latency and i:
+                            time.sleep(fake.token_latency)
+                        chunk = {
+                            'id': 'chatcmpl-stream',
+                            'object': 'chat.completion.chunk',
+                            'created': int(time.time()),
+                            'model': request.get('model', 'fake'),
+                            'choices': [{'index': 0, 'delta': {'content': piece},
+                                         'finish_reason': None}]
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stops reading once it has every variation
+                    return
+                with fake._lock:
+                    fake.requests_served += 1
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self) -> 'FakeOpenAIServer':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
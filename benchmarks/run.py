@@ -0,0 +1,248 @@
+"""
+Benchmark Suite
+Offline regression benchmarks for scraping, extraction and caption parsing
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --threshold 0.25
+
+Every metric is written as {"value", "unit", "better"} so two runs can be
+compared mechanically; the process exits with status 1 when any metric is
+worse than the baseline by more than the threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from scraper import LISTING_FIELDS, SOURCE_HEURISTIC, ListingScraper, scrape_listing, scrape_many
+from ai_captions import CaptionGenerator
+from benchmarks.corpus import load_corpus
+from benchmarks.fake_openai import FakeOpenAIServer, canned_captions, canned_json_captions
+from benchmarks.stub_server import StubServer
+
+
+FIELDS = list(LISTING_FIELDS)
+
+
+def _metric(value: float, unit: str, better: str) -> Dict:
+    return {'value': round(value, 4), 'unit': unit, 'better': better}
+
+
+def _median_ms(func: Callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench_extraction(corpus, repeat: int) -> Dict:
+    """
+    Per-stage latency for every page in the corpus
+    
+    A fresh scraper is used per repetition and the shared stages (parse,
+    index, text analysis, structured data) are timed separately so each
+    _extract_* number is the heuristic extractor's own cost.
+    """
+    stages = ['parse', 'index', 'text_analysis', 'structured_data'] + FIELDS
+    totals = {stage: 0.0 for stage in stages}
+    for name, label, html in corpus:
+        samples = {stage: [] for stage in stages}
+        for _ in range(repeat):
+            scraper = ListingScraper('https://bench.local/listing')
+            start = time.perf_counter()
+            scraper.load_html(html)
+            samples['parse'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            scraper.index
+            samples['index'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            scraper.text_analysis
+            samples['text_analysis'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            scraper.structured_data
+            samples['structured_data'].append(time.perf_counter() - start)
+            for field in FIELDS:
+                extractor = getattr(scraper, f'_extract_{field}')
+                start = time.perf_counter()
+                extractor()
+                samples[field].append(time.perf_counter() - start)
+        for stage in stages:
+            totals[stage] += statistics.median(samples[stage]) * 1000
+    
+    metrics = {f'extract.{stage}_ms': _metric(value, 'ms', 'lower')
+               for stage, value in totals.items()}
+    metrics['extract.total_ms'] = _metric(sum(totals.values()), 'ms', 'lower')
+    
+    # Share of fields filled from structured data instead of heuristics
+    filled = structured = 0
+    for _, _, html in corpus:
+        scraper = ListingScraper('https://bench.local/listing')
+        scraper.load_html(html)
+        scraper.extract_data()
+        filled += len(scraper.field_sources)
+        structured += sum(1 for source in scraper.field_sources.values() if source != SOURCE_HEURISTIC)
+    metrics['extract.structured_field_share'] = _metric(structured / filled, 'ratio', 'higher')
+    return metrics
+
+
+def bench_memory(corpus) -> Dict:
+    """Peak traced allocation while parsing and extracting each page size"""
+    peaks = {}
+    for _, label, html in corpus:
+        tracemalloc.start()
+        scraper = ListingScraper('https://bench.local/listing')
+        scraper.load_html(html)
+        scraper.extract_data()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks[label] = max(peaks.get(label, 0), peak)
+    return {f'memory.{label}_peak_mb': _metric(peak / (1024 * 1024), 'MB', 'lower')
+            for label, peak in peaks.items()}
+
+
+def bench_scraping(corpus, num_urls: int) -> Dict:
+    """End-to-end throughput against the local stub server"""
+    pages = {f'/{name}/{label}': html for name, label, html in corpus if label != 'large'}
+    paths = sorted(pages)
+    with StubServer(pages=pages) as server:
+        urls = [f'{server.base_url}{paths[i % len(paths)]}' for i in range(num_urls)]
+        
+        start = time.perf_counter()
+        for url in urls:
+            scrape_listing(url)
+        sequential = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        errors = sum(1 for result in scrape_many(urls) if result['error'])
+        concurrent = time.perf_counter() - start
+    
+    return {
+        'scrape.sequential_pages_per_sec': _metric(num_urls / sequential, 'pages/s', 'higher'),
+        'scrape.many_pages_per_sec': _metric(num_urls / concurrent, 'pages/s', 'higher'),
+        'scrape.many_errors': _metric(errors, 'count', 'lower'),
+    }
+
+
+def bench_caption_parsing(iterations: int) -> Dict:
+    """Throughput of the plain-text and JSON caption parsers"""
+    generator = CaptionGenerator(api_key='bench', cache=False)
+    text = canned_captions(3)
+    rng = random.Random(0)
+    documents = [canned_json_captions(3, rng) for _ in range(50)]
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        generator._parse_response(text, 3)
+    text_rate = iterations / (time.perf_counter() - start)
+    
+    start = time.perf_counter()
+    for i in range(iterations):
+        generator._parse_structured(documents[i % len(documents)], 3)
+    json_rate = iterations / (time.perf_counter() - start)
+    
+    return {
+        'captions.parse_text_per_sec': _metric(text_rate, 'docs/s', 'higher'),
+        'captions.parse_json_per_sec': _metric(json_rate, 'docs/s', 'higher'),
+    }
+
+
+def bench_caption_generation(num_listings: int) -> Dict:
+    """generate_many throughput against the fake OpenAI server"""
+    listings = [{
+        'address': f'{i} Main Street', 'price': f'${400000 + i * 1000:,}',
+        'bedrooms': 3, 'bathrooms': 2, 'property_type': 'House'
+    } for i in range(num_listings)]
+    with FakeOpenAIServer(latency=0.05) as server:
+        generator = CaptionGenerator(api_key='bench', cache=False, base_url=server.base_url)
+        start = time.perf_counter()
+        results = asyncio.run(generator.generate_many(listings))
+        elapsed = time.perf_counter() - start
+    
+    return {
+        'captions.generate_per_sec': _metric(num_listings / elapsed, 'listings/s', 'higher'),
+        'captions.generate_errors': _metric(sum(1 for r in results if r['error']), 'count', 'lower'),
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> list:
+    """
+    Returns:
+        List of (name, baseline value, current value, relative change) for
+        metrics that got worse by more than threshold
+    """
+    regressions = []
+    for name, metric in current.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        before, after = previous['value'], metric['value']
+        if before == 0:
+            if metric['better'] == 'lower' and after > 0:
+                regressions.append((name, before, after, float('inf')))
+            continue
+        change = (after - before) / before
+        if metric['better'] == 'higher':
+            change = -change
+        if change > threshold:
+            regressions.append((name, before, after, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write results JSON to this path')
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed relative slowdown before failing (default 0.25)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--urls', type=int, default=100)
+    parser.add_argument('--parse-iterations', type=int, default=5000)
+    parser.add_argument('--listings', type=int, default=0,
+                        help='Also benchmark generate_many against the fake server')
+    args = parser.parse_args()
+    
+    corpus = load_corpus()
+    metrics = {}
+    metrics.update(bench_extraction(corpus, args.repeat))
+    metrics.update(bench_memory(corpus))
+    metrics.update(bench_scraping(corpus, args.urls))
+    metrics.update(bench_caption_parsing(args.parse_iterations))
+    if args.listings:
+        metrics.update(bench_caption_generation(args.listings))
+    
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'metrics': metrics,
+    }
+    
+    for name, metric in sorted(metrics.items()):
+        print(f"{name:40s} {metric['value']:>12.3f} {metric['unit']}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['metrics']
+        regressions = compare(metrics, baseline, args.threshold)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before} -> {after} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
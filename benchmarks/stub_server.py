@@ -0,0 +1,166 @@
+"""
+Local Stub Listing Server
+Serves a canned listing page on 127.0.0.1 so scraping can be measured offline
+"""
+
+import mimetypes
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SAMPLE_LISTING = """<!DOCTYPE html>
+<html>
+<head>
+  <title>3 Bed House for Sale</title>
+  <meta property="og:title" content="Charming 3 Bedroom Family Home">
+  <meta property="og:image" content="https://cdn.example.com/photos/front.jpg">
+  <meta name="description" content="Beautiful updated home with a pool and double garage.">
+</head>
+<body>
+  <h1>Charming 3 Bedroom Family Home</h1>
+  <div class="listing-price">$450,000</div>
+  <div class="property-address">123 Main Street, Springfield</div>
+  <ul class="facts">
+    <li class="beds">3 beds</li>
+    <li class="baths">2.5 baths</li>
+    <li>2,100 sq ft</li>
+  </ul>
+  <div class="description">
+    Spacious house with hardwood floors, granite counters, fireplace and a
+    covered patio overlooking the pool.
+  </div>
+  <img src="/photos/kitchen.jpg">
+  <img src="/photos/lounge.jpg">
+  <img src="/static/logo.png">
+</body>
+</html>
+"""
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class StubServer:
+    """
+    Threaded HTTP server returning a listing page for every GET
+    
+    It can also misbehave like a struggling portal: answer every request
+    with an error status, fail a share of requests with 503, rate-limit
+    with 429 and Retry-After above a number of concurrent requests, and
+    slow down as more requests are in flight.
+    """
+    
+    def __init__(self, body: str = SAMPLE_LISTING, latency: float = 0.0, pages: dict = None,
+                 status: int = None, error_rate: float = 0.0, max_concurrent: int = None,
+                 retry_after: float = None, congestion: float = 0.0, seed: int = 0):
+        """
+        Args:
+            body: Page served for any path not in pages
+            latency: Seconds to wait before answering
+            pages: Optional mapping of path to page body (str, or bytes
+                for binary files such as images)
+            status: Answer every request with this status (e.g. 503 for a
+                host that is down)
+            error_rate: Share of requests answered with 503
+            max_concurrent: Requests in flight above which 429 is returned
+            retry_after: Retry-After seconds sent with 429 responses
+            congestion: Extra seconds of latency per other request in flight
+            seed: Seed for the error_rate draws
+        """
+        self.body = body.encode('utf-8')
+        self.pages = {path: page if isinstance(page, bytes) else page.encode('utf-8')
+                      for path, page in (pages or {}).items()}
+        self.latency = latency
+        self.status = status
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.congestion = congestion
+        self.requests_served = 0
+        self.statuses = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._make_handler())
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def _make_handler(self):
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep connections alive
+            protocol_version = 'HTTP/1.1'
+            
+            def do_GET(self):
+                with stub._lock:
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                    others = stub.in_flight - 1
+                    status = stub.status or 200
+                    if stub.max_concurrent is not None and stub.in_flight > stub.max_concurrent:
+                        status = 429
+                    elif stub.error_rate and stub._random.random() < stub.error_rate:
+                        status = 503
+                try:
+                    if stub.latency or stub.congestion:
+                        time.sleep(stub.latency + others * stub.congestion)
+                    self._answer(status)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+            
+            def _answer(self, status: int):
+                with stub._lock:
+                    stub.requests_served += 1
+                    stub.statuses[status] = stub.statuses.get(status, 0) + 1
+                if status != 200:
+                    body = f"Error {status}".encode('utf-8')
+                    self.send_response(status)
+                    if status == 429 and stub.retry_after is not None:
+                        self.send_header('Retry-After', f"{stub.retry_after:g}")
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body = stub.pages.get(self.path, stub.body)
+                self.send_response(200)
+                content_type = mimetypes.guess_type(self.path)[0] or 'text/html; charset=utf-8'
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Streaming clients may hang up once they have enough
+                    pass
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,378 @@
+"""
+Caption Batch Jobs
+Captions many listings at once with packed requests (several listings per
+prompt), either live or as a deferred OpenAI batch: requests are written
+as JSONL, submitted, and the results reconciled per listing when the batch
+has finished
+
+Usage:
+    python caption_batch.py live listings.json
+    python caption_batch.py prepare listings.json --name june
+    python caption_batch.py submit june
+    python caption_batch.py status june
+    python caption_batch.py collect june --retry
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import config
+import metrics
+from ai_captions import CaptionGenerator
+
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+
+# Batch statuses after which the output files no longer change
+FINISHED_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def read_listings(path: str) -> List[Dict]:
+    """Listings from a JSON array or JSON-lines file (- for stdin)"""
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class CaptionBatch:
+    """
+    One batch job, kept in its own directory under config.CAPTION_BATCH_DIR
+    
+    The directory holds the JSONL requests, a manifest (listings, which
+    listings each request carries and the batch's state) and, once
+    collected, the captions per listing. Each request is a packed prompt;
+    custom_id ties its response back to its listings.
+    """
+    
+    def __init__(self, name: str, generator: CaptionGenerator = None, directory: str = None):
+        """
+        Args:
+            name: Job name, used as the directory name
+            generator: Caption generator whose client, prompts and cache are used
+            directory: Parent directory (config.CAPTION_BATCH_DIR if omitted)
+        """
+        self.name = name
+        self.path = os.path.join(directory or config.CAPTION_BATCH_DIR, name)
+        self._generator = generator
+        self.manifest: Dict[str, Any] = {}
+        if os.path.exists(self._file('manifest.json')):
+            with open(self._file('manifest.json'), 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+    
+    @property
+    def generator(self) -> CaptionGenerator:
+        if self._generator is None:
+            self._generator = CaptionGenerator()
+        return self._generator
+    
+    def _file(self, filename: str) -> str:
+        return os.path.join(self.path, filename)
+    
+    def _save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = self._file('manifest.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self._file('manifest.json'))
+    
+    def prepare(self, listings: List[Dict], post_type: str = "New Listing",
+                num_variations: int = 3, pack_size: int = None) -> Dict:
+        """
+        Write the batch requests, skipping listings already in the caption cache
+        
+        Returns:
+            The generator's packing_report for the listings sent
+        """
+        if self.manifest.get('batch_id'):
+            raise Exception(f"Batch {self.name} was already submitted")
+        generator = self.generator
+        pack_size = pack_size or config.OPENAI_PACK_SIZE
+        results = {}
+        pending = []
+        for index, listing_data in enumerate(listings):
+            cached = generator.cached_packed(listing_data, post_type, num_variations)
+            if cached is not None:
+                results[str(index)] = {'captions': cached, 'error': None}
+            else:
+                pending.append(index)
+        
+        packs = {}
+        models = {}
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file('requests.jsonl'), 'w', encoding='utf-8') as f:
+            for start in range(0, len(pending), pack_size):
+                pack = pending[start:start + pack_size]
+                custom_id = f"pack-{len(packs) + 1}"
+                body = generator.packed_request([listings[index] for index in pack],
+                                                post_type, num_variations)
+                f.write(json.dumps({'custom_id': custom_id, 'method': 'POST',
+                                    'url': BATCH_ENDPOINT, 'body': body},
+                                   ensure_ascii=False) + '\n')
+                packs[custom_id] = pack
+                models[custom_id] = body['model']
+        
+        report = generator.packing_report([listings[index] for index in pending], post_type,
+                                          num_variations, pack_size)
+        self.manifest = {
+            'name': self.name,
+            'post_type': post_type,
+            'num_variations': num_variations,
+            'pack_size': pack_size,
+            'created_at': time.time(),
+            'listings': listings,
+            'packs': packs,
+            'models': models,
+            'results': results,
+            'report': report,
+            'status': 'prepared'
+        }
+        self._save()
+        return report
+    
+    def submit(self) -> str:
+        """Upload the requests and start the batch; returns the batch id"""
+        if not self.manifest:
+            raise Exception(f"Batch {self.name} has not been prepared")
+        if self.manifest.get('batch_id'):
+            return self.manifest['batch_id']
+        if not self.manifest['packs']:
+            # Every listing came from the cache
+            self.manifest['status'] = 'completed'
+            self._save()
+            return ''
+        
+        client = self.generator.client
+        try:
+            with open(self._file('requests.jsonl'), 'rb') as f:
+                upload = client.files.create(file=f, purpose='batch')
+            # openai 1.12 has no batches resource, so the endpoint is called directly
+            batch = client.post('/batches', cast_to=Dict[str, Any], body={
+                'input_file_id': upload.id,
+                'endpoint': BATCH_ENDPOINT,
+                'completion_window': config.CAPTION_BATCH_WINDOW,
+                'metadata': {'name': self.name}
+            })
+        except Exception as e:
+            raise Exception(f"Failed to submit batch {self.name}: {str(e)}")
+        
+        self.manifest.update(batch_id=batch['id'], input_file_id=upload.id,
+                             status=batch.get('status'), submitted_at=time.time())
+        self._save()
+        return batch['id']
+    
+    def status(self) -> Dict:
+        """Current state of the batch as reported by the API"""
+        batch_id = self.manifest.get('batch_id')
+        if not batch_id:
+            return {'status': self.manifest.get('status', 'missing')}
+        try:
+            batch = self.generator.client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+        except Exception as e:
+            raise Exception(f"Failed to get status of batch {self.name}: {str(e)}")
+        self.manifest.update(status=batch.get('status'),
+                             output_file_id=batch.get('output_file_id'),
+                             error_file_id=batch.get('error_file_id'))
+        self._save()
+        return batch
+    
+    def _download(self, file_id: Optional[str]) -> List[Dict]:
+        if not file_id:
+            return []
+        content = self.generator.client.files.content(file_id).text
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    
+    def collect(self, retry: bool = False) -> Dict:
+        """
+        Reconcile a finished batch per listing
+        
+        Captions from successful requests are stored in the caption cache.
+        A listing fails on its own when its request failed or its entry in
+        the packed response is missing or unusable; with retry=True the
+        failed listings are captioned again with live packed requests.
+        
+        Returns:
+            Summary with 'listings', 'captioned', 'failed' (listing indexes),
+            'prompt_tokens' (as billed) and 'prompt_tokens_saved_per_listing'
+        """
+        if self.manifest.get('batch_id') and self.manifest.get('status') not in FINISHED_STATUSES:
+            self.status()
+        status = self.manifest.get('status')
+        if status not in FINISHED_STATUSES:
+            raise Exception(f"Batch {self.name} is still {status}")
+        
+        generator = self.generator
+        listings = self.manifest['listings']
+        post_type = self.manifest['post_type']
+        num_variations = self.manifest['num_variations']
+        results = self.manifest['results']
+        prompt_tokens = 0
+        
+        with metrics.span('captions.batch_collect', batch=self.name):
+            try:
+                records = (self._download(self.manifest.get('output_file_id'))
+                           + self._download(self.manifest.get('error_file_id')))
+            except Exception as e:
+                raise Exception(f"Failed to download results of batch {self.name}: {str(e)}")
+            
+            answered = set()
+            for record in records:
+                pack = self.manifest['packs'].get(record.get('custom_id'))
+                if pack is None:
+                    continue
+                answered.add(record['custom_id'])
+                response = record.get('response') or {}
+                body = response.get('body') or {}
+                parsed = {}
+                if response.get('status_code') == 200:
+                    prompt_tokens += (body.get('usage') or {}).get('prompt_tokens', 0)
+                    try:
+                        content = body['choices'][0]['message']['content']
+                    except (KeyError, IndexError, TypeError):
+                        content = None
+                    if isinstance(content, str):
+                        # Manifests written before models were recorded used the routed model
+                        model = (self.manifest.get('models', {}).get(record['custom_id'])
+                                 or generator.router.model_for(num_variations * len(pack)))
+                        parsed = generator.parse_packed_response(
+                            content, [listings[index] for index in pack], post_type,
+                            num_variations, model)
+                        error = 'Listing missing from the packed response'
+                    else:
+                        error = 'Response has no completion'
+                else:
+                    error = ((body.get('error') or record.get('error') or {}).get('message')
+                             or f"Request failed with status {response.get('status_code')}")
+                for position, index in enumerate(pack, 1):
+                    self._settle(index, parsed.get(position), error)
+            
+            # Requests the batch never ran (expired or cancelled)
+            for custom_id, pack in self.manifest['packs'].items():
+                if custom_id not in answered:
+                    for index in pack:
+                        self._settle(index, None, f"Batch {status} before the request ran")
+            
+            failed = sorted(int(index) for index, result in results.items() if result['error'])
+            metrics.add(listings=len(listings), failed_listings=len(failed))
+        
+        if retry and failed:
+            retried = self._retry([listings[index] for index in failed], post_type, num_variations)
+            for index, result in zip(failed, retried):
+                self._settle(index, result['captions'], result['error'])
+            failed = sorted(int(index) for index, result in results.items() if result['error'])
+        
+        self.manifest['collected_at'] = time.time()
+        self._save()
+        with open(self._file('captions.json'), 'w', encoding='utf-8') as f:
+            json.dump([dict(results.get(str(index), {'captions': None, 'error': 'Not collected'}),
+                            listing=listing_data)
+                       for index, listing_data in enumerate(listings)],
+                      f, indent=2, ensure_ascii=False)
+        
+        report = self.manifest['report']
+        return {
+            'listings': len(listings),
+            'captioned': len(listings) - len(failed),
+            'failed': failed,
+            'prompt_tokens': prompt_tokens,
+            'prompt_tokens_saved_per_listing': report['saved_per_listing']
+        }
+    
+    def _settle(self, index: int, captions: Optional[List[Dict]], error: str) -> None:
+        """Record one listing's outcome (its captions are already cached)"""
+        current = self.manifest['results'].get(str(index))
+        if current and current['captions']:
+            # Settled by an earlier collect or retry
+            return
+        if captions:
+            self.manifest['results'][str(index)] = {'captions': captions, 'error': None}
+        else:
+            self.manifest['results'][str(index)] = {'captions': None, 'error': error}
+    
+    def _retry(self, listings: List[Dict], post_type: str, num_variations: int) -> List[Dict]:
+        return caption_live(self.generator, listings, post_type, num_variations,
+                            self.manifest['pack_size'])
+
+
+def caption_live(generator: CaptionGenerator, listings: List[Dict], post_type: str = "New Listing",
+                 num_variations: int = 3, pack_size: int = None) -> List[Dict]:
+    """Caption listings now with packed requests (see CaptionGenerator.generate_packed)"""
+    async def run() -> List[Dict]:
+        try:
+            return await generator.generate_packed(listings, post_type, num_variations, pack_size)
+        finally:
+            await generator.aclose()
+    
+    return asyncio.run(run())
+
+
+def _print_report(report: Dict) -> None:
+    print(f"{report['listings']} listings: {report['single_requests']} requests "
+          f"({report['single_prompt_tokens']} prompt tokens) one per listing, "
+          f"{report['packed_requests']} packed ({report['packed_prompt_tokens']} prompt tokens); "
+          f"{report['saved_per_listing']} prompt tokens saved per listing", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption many listings with packed or batched requests")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    live = commands.add_parser('live', help="Caption now with packed requests")
+    prepare = commands.add_parser('prepare', help="Write a batch job's requests")
+    for command in (live, prepare):
+        command.add_argument('listings', help="JSON array or JSON-lines file of listings, or -")
+        command.add_argument('--post-type', default='New Listing', choices=config.POST_TYPES)
+        command.add_argument('--variations', type=int, default=3)
+        command.add_argument('--pack-size', type=int, default=config.OPENAI_PACK_SIZE,
+                             help="Listings per request")
+    prepare.add_argument('--name', required=True, help="Job name")
+    
+    for name, help_text in (('submit', "Upload and start a prepared job"),
+                            ('status', "Show a submitted job's status"),
+                            ('collect', "Reconcile a finished job per listing")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('name', help="Job name")
+    commands.choices['collect'].add_argument('--retry', action='store_true',
+                                             help="Caption failed listings again with live requests")
+    args = parser.parse_args()
+    
+    try:
+        if args.command == 'live':
+            listings = read_listings(args.listings)
+            generator = CaptionGenerator()
+            _print_report(generator.packing_report(listings, args.post_type, args.variations,
+                                                   args.pack_size))
+            results = caption_live(generator, listings, args.post_type, args.variations,
+                                   args.pack_size)
+            print(json.dumps([dict(result, listing=listing_data)
+                              for listing_data, result in zip(listings, results)],
+                             indent=2, ensure_ascii=False))
+        elif args.command == 'prepare':
+            report = CaptionBatch(args.name).prepare(read_listings(args.listings), args.post_type,
+                                                     args.variations, args.pack_size)
+            _print_report(report)
+        elif args.command == 'submit':
+            print(CaptionBatch(args.name).submit())
+        elif args.command == 'status':
+            print(json.dumps(CaptionBatch(args.name).status(), indent=2))
+        else:
+            print(json.dumps(CaptionBatch(args.name).collect(retry=args.retry), indent=2))
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        metrics.flush()
+
+
+if __name__ == '__main__':
+    main()
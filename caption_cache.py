@@ -0,0 +1,139 @@
+"""
+Caption Cache
+Content-addressed cache for generated captions (in-memory LRU over a disk store)
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import config
+
+
+# Listing fields that feed the prompt; nothing else affects the captions
+CAPTION_FIELDS = ('address', 'price', 'bedrooms', 'bathrooms', 'square_feet',
+                  'property_type', 'description', 'features')
+
+
+def _normalize(value):
+    """Normalize a listing value so cosmetic differences share a cache entry"""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def cache_key(listing_data: Dict, post_type: str, num_variations: int,
+              model: str, prompt_version: str, **options) -> str:
+    """
+    Build a stable hash for a caption request
+    
+    Args:
+        listing_data: Listing details passed to the generator
+        post_type: Type of post
+        num_variations: Number of caption variations requested
+        model: Model name
+        prompt_version: Version of the prompt template
+        **options: Any other request options that change the output
+        
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = {
+        'listing': {field: _normalize(listing_data.get(field)) for field in CAPTION_FIELDS},
+        'post_type': post_type,
+        'num_variations': num_variations,
+        'model': model,
+        'prompt_version': prompt_version,
+        'options': options
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class CaptionCache:
+    """Caption cache with an in-memory LRU in front of JSON files on disk"""
+    
+    def __init__(self, directory: str = None, ttl: int = None, memory_size: int = None):
+        """
+        Args:
+            directory: Where cached captions are stored
+            ttl: Seconds before a cached result expires
+            memory_size: Number of results kept in memory
+        """
+        self.directory = directory or config.CAPTION_CACHE_DIR
+        self.ttl = config.CAPTION_CACHE_TTL if ttl is None else ttl
+        self.memory_size = config.CAPTION_CACHE_MEMORY_SIZE if memory_size is None else memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """Return cached captions for a key, or None if missing or expired"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        
+        if entry is None:
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self._remember(key, entry)
+        
+        if time.time() - entry['stored_at'] > self.ttl:
+            self.delete(key)
+            return None
+        
+        # Callers may edit captions, so never hand out the cached objects
+        return copy.deepcopy(entry['captions'])
+    
+    def set(self, key: str, captions: List[Dict]) -> None:
+        """Store captions for a key"""
+        entry = {'stored_at': time.time(), 'captions': copy.deepcopy(captions)}
+        self._remember(key, entry)
+        
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+    
+    def delete(self, key: str) -> None:
+        """Remove a key from memory and disk"""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+    
+    def _remember(self, key: str, entry: Dict) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+
+_default_cache = None
+
+
+def get_default_cache() -> CaptionCache:
+    """Shared cache instance so every generator sees the same memory LRU"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CaptionCache()
+    return _default_cache
@@ -6,7 +6,24 @@ load_dotenv()
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-OPENAI_MODEL = 'gpt-4'
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')  # variation sets
+OPENAI_FAST_MODEL = os.getenv('OPENAI_FAST_MODEL', OPENAI_MODEL)  # single captions and repairs
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # Optional OpenAI-compatible endpoint
+OPENAI_STRUCTURED_OUTPUT = os.getenv('OPENAI_STRUCTURED_OUTPUT', 'False').lower() == 'true'
+
+# OpenAI rate limits for bulk caption runs
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '5'))
+OPENAI_PACK_SIZE = int(os.getenv('OPENAI_PACK_SIZE', '5'))  # listings per packed caption request
+
+# Model routing and hedged requests (see model_router.py)
+OPENAI_ROUTER_WINDOW = int(os.getenv('OPENAI_ROUTER_WINDOW', '200'))  # requests per model in the rolling stats
+OPENAI_ROUTER_MAX_ERROR_RATE = float(os.getenv('OPENAI_ROUTER_MAX_ERROR_RATE', '0.5'))
+OPENAI_ROUTER_PROBE_INTERVAL = float(os.getenv('OPENAI_ROUTER_PROBE_INTERVAL', '30'))  # seconds between probes of an avoided model
+OPENAI_HEDGE_PERCENTILE = float(os.getenv('OPENAI_HEDGE_PERCENTILE', '95'))  # 0 disables hedging
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', '20'))
 
 # Meta API Configuration
 META_ACCESS_TOKEN = os.getenv('META_ACCESS_TOKEN')
@@ -20,8 +37,67 @@ DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 # Storage Settings
 DATA_DIR = 'data'
 QUEUE_FILE = os.path.join(DATA_DIR, 'queue.json')
+QUEUE_DB = os.path.join(DATA_DIR, 'queue.db')  # replaces QUEUE_FILE, which is imported on first use
+LISTING_SNAPSHOT_DB = os.path.join(DATA_DIR, 'listings.db')  # last scrape of each watched listing
+LISTING_STORE_DIR = os.path.join(DATA_DIR, 'listing_store')  # typed columns of every scraped listing (see listing_store.py)
 IMAGES_DIR = os.path.join(DATA_DIR, 'images')
 
+# Image Pipeline Settings
+IMAGE_DOWNLOAD_WORKERS = int(os.getenv('IMAGE_DOWNLOAD_WORKERS', '8'))
+IMAGE_MIN_DIMENSION = int(os.getenv('IMAGE_MIN_DIMENSION', '400'))  # pixels, smaller images are skipped
+IMAGE_HASH_INDEX = os.path.join(DATA_DIR, 'image_hashes')  # '.bin' hashes and '.jsonl' URL map
+IMAGE_HASH_THRESHOLD = int(os.getenv('IMAGE_HASH_THRESHOLD', '6'))  # max differing dHash bits for a near-duplicate
+IMAGE_HASH_INDEX_ENABLED = os.getenv('IMAGE_HASH_INDEX_ENABLED', 'False').lower() == 'true'  # reuse photos across listings
+
+# HTTP Cache Settings (listing page cache used by the scraper)
+HTTP_CACHE_DIR = os.path.join(DATA_DIR, 'http_cache')
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', str(6 * 60 * 60)))
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+HTTP_CACHE_ONLY = os.getenv('HTTP_CACHE_ONLY', 'False').lower() == 'true'
+
+# Listing Page Fetching (per-host adaptive concurrency, retries and circuit breakers, see host_control.py)
+SCRAPE_CONNECT_TIMEOUT = float(os.getenv('SCRAPE_CONNECT_TIMEOUT', '5'))
+SCRAPE_READ_TIMEOUT = float(os.getenv('SCRAPE_READ_TIMEOUT', '10'))  # ceiling, and the timeout before a host has samples
+SCRAPE_MIN_READ_TIMEOUT = float(os.getenv('SCRAPE_MIN_READ_TIMEOUT', '2'))
+SCRAPE_TIMEOUT_FACTOR = float(os.getenv('SCRAPE_TIMEOUT_FACTOR', '4'))  # read timeout as a multiple of the host's average latency
+SCRAPE_MAX_RETRIES = int(os.getenv('SCRAPE_MAX_RETRIES', '3'))
+SCRAPE_BACKOFF_BASE = float(os.getenv('SCRAPE_BACKOFF_BASE', '0.5'))  # seconds
+SCRAPE_BACKOFF_CAP = float(os.getenv('SCRAPE_BACKOFF_CAP', '20'))
+SCRAPE_MAX_RETRY_AFTER = float(os.getenv('SCRAPE_MAX_RETRY_AFTER', '60'))  # longer Retry-After waits fail instead
+HOST_MAX_CONCURRENCY = int(os.getenv('HOST_MAX_CONCURRENCY', '8'))  # AIMD ceiling for requests in flight per host
+HOST_LATENCY_FACTOR = float(os.getenv('HOST_LATENCY_FACTOR', '3'))  # latency over this multiple of the host's best counts as congestion
+HOST_BREAKER_THRESHOLD = int(os.getenv('HOST_BREAKER_THRESHOLD', '5'))  # consecutive failures that open a host's circuit; 0 disables
+HOST_BREAKER_RESET = float(os.getenv('HOST_BREAKER_RESET', '30'))  # seconds before a probe request is let through
+
+# HTML Parser for listing pages: lxml (fast, reads lxml's tree directly) or bs4 (BeautifulSoup)
+HTML_PARSER = os.getenv('HTML_PARSER', 'lxml')
+
+# Caption Cache Settings (reuses captions for identical requests)
+CAPTION_CACHE_ENABLED = os.getenv('CAPTION_CACHE_ENABLED', 'True').lower() == 'true'
+CAPTION_CACHE_DIR = os.path.join(DATA_DIR, 'caption_cache')
+CAPTION_CACHE_TTL = int(os.getenv('CAPTION_CACHE_TTL', str(7 * 24 * 60 * 60)))
+CAPTION_CACHE_MEMORY_SIZE = int(os.getenv('CAPTION_CACHE_MEMORY_SIZE', '256'))
+
+# Caption Batch Jobs (OpenAI Batch API, see caption_batch.py)
+CAPTION_BATCH_DIR = os.path.join(DATA_DIR, 'caption_batches')
+CAPTION_BATCH_WINDOW = os.getenv('CAPTION_BATCH_WINDOW', '24h')
+
+# Keyword Vocabulary (property types and features matched in listing text)
+KEYWORD_VOCABULARY = os.getenv('KEYWORD_VOCABULARY',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keywords.json'))
+
+# Metrics Settings (comma-separated sinks: log, json, prometheus; empty disables)
+METRICS_SINKS = [name.strip() for name in os.getenv('METRICS_SINKS', '').split(',') if name.strip()]
+METRICS_JSON_FILE = os.getenv('METRICS_JSON_FILE', os.path.join(DATA_DIR, 'metrics.jsonl'))
+METRICS_PROMETHEUS_FILE = os.getenv('METRICS_PROMETHEUS_FILE', os.path.join(DATA_DIR, 'metrics.prom'))
+
+# Service Settings (local API for the dashboard, see service.py)
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', '8765'))
+SERVICE_SOCKET = os.getenv('SERVICE_SOCKET')  # Unix socket path, overrides host/port
+SERVICE_POOL_SIZE = int(os.getenv('SERVICE_POOL_SIZE', '10'))
+SERVICE_STATS_WINDOW = int(os.getenv('SERVICE_STATS_WINDOW', '1000'))  # requests per endpoint in /stats
+
 # Agent Configuration (customize for your wife's company)
 AGENTS = [
     'Sarah Johnson',
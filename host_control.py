@@ -0,0 +1,370 @@
+"""
+Host Control
+Per-host adaptive concurrency (AIMD), Retry-After handling, decorrelated-jitter
+retries and circuit breakers for listing page requests
+"""
+
+import email.utils
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+import config
+import metrics
+from rate_limiter import decorrelated_jitter
+
+
+# Statuses meaning the host is overloaded or failing, retried with backoff
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Request outcomes fed back into a host's state
+OUTCOME_OK = 'ok'
+OUTCOME_THROTTLED = 'throttled'  # 429: the host is up but wants fewer requests
+OUTCOME_FAILED = 'failed'  # 5xx, timeout or connection error
+
+# Circuit breaker states
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+# Successful requests a host needs before its latency counts as a signal
+LATENCY_MIN_SAMPLES = 10
+# Seconds a response must also exceed that baseline by, so jitter on fast hosts is ignored
+LATENCY_MIN_EXCESS = 0.05
+# Weight of the newest request in a host's average latency
+LATENCY_SMOOTHING = 0.2
+
+
+class FetchError(Exception):
+    """Raised when a listing page cannot be fetched"""
+    
+    def __init__(self, message: str, url: str = None, status: Optional[int] = None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+
+
+class CircuitOpenError(FetchError):
+    """Raised without sending a request while a host's circuit is open"""
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header, given as seconds or an HTTP date
+    
+    Returns:
+        Non-negative seconds, or None when the header is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class HostState:
+    """Concurrency limit, latency and circuit breaker of one host"""
+    
+    def __init__(self, max_concurrency: int):
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.average_latency = None
+        self.recent_latencies = deque(maxlen=50)
+        self.circuit = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.counts = {'requests': 0, 'throttled': 0, 'failed': 0, 'retries': 0, 'rejected': 0}
+        self.changed = threading.Condition()
+    
+    @property
+    def slots(self) -> int:
+        return max(1, int(self.limit))
+    
+    def baseline(self) -> Optional[float]:
+        """Best recent latency, the reference for congestion"""
+        if len(self.recent_latencies) < LATENCY_MIN_SAMPLES:
+            return None
+        return min(self.recent_latencies)
+
+
+class HostController:
+    """
+    Shares request slots, backoff and circuit breakers per host between every
+    scraper in the process
+    
+    Each host starts at max_concurrency requests in flight. A 429, a 5xx, a
+    timeout or a response much slower than the host's best recent latency
+    halves its limit (at most once per average round trip); every other
+    success raises it by 1/limit, so it grows by about one per round of
+    requests (AIMD). A Retry-After header pauses all requests to the host.
+    After breaker_threshold consecutive failures the host's circuit opens and
+    requests fail immediately with CircuitOpenError until breaker_reset
+    seconds have passed, when a single probe request decides whether it closes.
+    """
+    
+    def __init__(self, max_concurrency: int = None, max_retries: int = None,
+                 backoff_base: float = None, backoff_cap: float = None,
+                 max_retry_after: float = None, latency_factor: float = None,
+                 breaker_threshold: int = None, breaker_reset: float = None,
+                 adaptive: bool = True):
+        """
+        Args:
+            max_concurrency: Ceiling (and starting point) for requests in
+                flight per host
+            max_retries: Retries after a retryable failure
+            backoff_base: Smallest retry delay in seconds
+            backoff_cap: Largest retry delay in seconds
+            max_retry_after: Longest Retry-After wait honored; longer ones fail
+            latency_factor: Latency over this multiple of the host's best
+                recent latency counts as congestion
+            breaker_threshold: Consecutive failures that open a host's
+                circuit (0 disables the breaker)
+            breaker_reset: Seconds an open circuit waits before a probe
+            adaptive: Adjust the per-host limit; when False every host keeps
+                max_concurrency
+        
+        Omitted values come from config.
+        """
+        self.max_concurrency = max_concurrency or config.HOST_MAX_CONCURRENCY
+        self.max_retries = config.SCRAPE_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or config.SCRAPE_BACKOFF_BASE
+        self.backoff_cap = backoff_cap or config.SCRAPE_BACKOFF_CAP
+        self.max_retry_after = (config.SCRAPE_MAX_RETRY_AFTER if max_retry_after is None
+                                else max_retry_after)
+        self.latency_factor = latency_factor or config.HOST_LATENCY_FACTOR
+        self.breaker_threshold = (config.HOST_BREAKER_THRESHOLD if breaker_threshold is None
+                                  else breaker_threshold)
+        self.breaker_reset = config.HOST_BREAKER_RESET if breaker_reset is None else breaker_reset
+        self.adaptive = adaptive
+        self._hosts: Dict[str, HostState] = {}
+        self._lock = threading.Lock()
+    
+    def _state(self, host: str) -> HostState:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState(self.max_concurrency)
+            return state
+    
+    def slots(self, url: str) -> int:
+        """Requests the host of a URL currently accepts in flight"""
+        state = self._state(host_of(url))
+        with state.changed:
+            return state.slots
+    
+    def delay(self, url: str) -> float:
+        """Seconds until the host of a URL accepts requests again (Retry-After)"""
+        state = self._state(host_of(url))
+        with state.changed:
+            return max(0.0, state.blocked_until - time.monotonic())
+    
+    def timeout(self, url: str) -> tuple:
+        """
+        (connect, read) timeout for the host of a URL: a multiple of its
+        average latency within configured bounds, so requests to a host
+        that has stalled give up sooner
+        """
+        state = self._state(host_of(url))
+        with state.changed:
+            average = state.average_latency
+        read = config.SCRAPE_READ_TIMEOUT
+        if average is not None:
+            read = min(read, max(config.SCRAPE_MIN_READ_TIMEOUT, average * config.SCRAPE_TIMEOUT_FACTOR))
+        return config.SCRAPE_CONNECT_TIMEOUT, read
+    
+    def _admit(self, state: HostState, url: str) -> None:
+        """Wait for a free slot on the host, failing fast while its circuit is open"""
+        with state.changed:
+            while True:
+                now = time.monotonic()
+                if state.circuit == CIRCUIT_OPEN:
+                    if now - state.opened_at < self.breaker_reset:
+                        state.counts['rejected'] += 1
+                        raise CircuitOpenError(f"Failed to fetch page: circuit open for {host_of(url)}",
+                                               url=url)
+                    state.circuit = CIRCUIT_HALF_OPEN
+                if state.circuit == CIRCUIT_HALF_OPEN and state.probing:
+                    state.counts['rejected'] += 1
+                    raise CircuitOpenError(f"Failed to fetch page: circuit open for {host_of(url)}",
+                                           url=url)
+                
+                wait = state.blocked_until - now
+                if wait > self.max_retry_after:
+                    raise FetchError(f"Failed to fetch page: {host_of(url)} asked to retry after "
+                                     f"{wait:.0f}s", url=url, status=429)
+                if wait <= 0 and state.in_flight < state.slots:
+                    break
+                state.changed.wait(wait if wait > 0 else None)
+            
+            if state.circuit == CIRCUIT_HALF_OPEN:
+                state.probing = True
+            state.in_flight += 1
+            state.counts['requests'] += 1
+    
+    def _release(self, state: HostState, seconds: float, outcome: Optional[str],
+                 retry_after: Optional[float] = None) -> None:
+        """Free the slot and feed the outcome (if any) into the limit and the breaker"""
+        with state.changed:
+            now = time.monotonic()
+            state.in_flight -= 1
+            state.probing = False
+            if outcome is None:
+                state.changed.notify_all()
+                return
+            if retry_after is not None:
+                state.blocked_until = max(state.blocked_until, now + retry_after)
+            
+            if outcome == OUTCOME_OK:
+                baseline = state.baseline()
+                congested = (baseline is not None and seconds > baseline * self.latency_factor and
+                             seconds - baseline > LATENCY_MIN_EXCESS)
+                state.recent_latencies.append(seconds)
+                state.average_latency = (seconds if state.average_latency is None else
+                                         state.average_latency + LATENCY_SMOOTHING *
+                                         (seconds - state.average_latency))
+                state.consecutive_failures = 0
+                state.circuit = CIRCUIT_CLOSED
+            else:
+                congested = True
+                state.counts[outcome] += 1
+                if outcome == OUTCOME_FAILED:
+                    state.consecutive_failures += 1
+                    if state.circuit == CIRCUIT_HALF_OPEN or (
+                            self.breaker_threshold and
+                            state.consecutive_failures >= self.breaker_threshold):
+                        state.circuit = CIRCUIT_OPEN
+                        state.opened_at = now
+            
+            if self.adaptive:
+                if congested:
+                    # Multiplicative decrease, once per round trip so one burst counts once
+                    if now - state.last_decrease >= (state.average_latency or 0.0):
+                        state.limit = max(1.0, state.limit / 2)
+                        state.last_decrease = now
+                else:
+                    state.limit = min(float(self.max_concurrency), state.limit + 1 / state.limit)
+            state.changed.notify_all()
+    
+    def get(self, session, url: str, **kwargs) -> requests.Response:
+        """
+        GET a URL within its host's limits, retrying 429, 5xx, timeouts and
+        connection errors with decorrelated-jitter backoff
+        
+        Args:
+            session: requests session (or the requests module) to send with
+            url: Page URL
+            **kwargs: Passed to session.get() (headers, timeout, stream)
+        
+        Returns:
+            Response with a status below 400
+        
+        Raises:
+            CircuitOpenError: The host's circuit is open
+            FetchError: The request failed for good
+        """
+        state = self._state(host_of(url))
+        delay = self.backoff_base
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with state.changed:
+                    state.counts['retries'] += 1
+                metrics.add(retries=1)
+            self._admit(state, url)
+            retry_after = None
+            start = time.monotonic()
+            try:
+                response = session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._release(state, time.monotonic() - start, OUTCOME_FAILED)
+                error = FetchError(f"Failed to fetch page: {str(e)}", url=url)
+            except BaseException:
+                # Not the host's fault (invalid URL, too many redirects, interrupted)
+                self._release(state, time.monotonic() - start, None)
+                raise
+            else:
+                seconds = time.monotonic() - start
+                status = response.status_code
+                if status not in RETRY_STATUSES:
+                    self._release(state, seconds, OUTCOME_OK)
+                    if status >= 400:
+                        response.close()
+                        raise FetchError(f"Failed to fetch page: HTTP {status} for {url}",
+                                         url=url, status=status)
+                    return response
+                
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+                self._release(state, seconds, OUTCOME_THROTTLED if status == 429 else OUTCOME_FAILED,
+                              retry_after)
+                error = FetchError(f"Failed to fetch page: HTTP {status} for {url}",
+                                   url=url, status=status)
+            
+            if attempt == self.max_retries:
+                raise error
+            if retry_after is not None and retry_after > self.max_retry_after:
+                raise error
+            delay = decorrelated_jitter(delay, self.backoff_base, self.backoff_cap)
+            if retry_after is None:
+                time.sleep(delay)
+            # Otherwise _admit waits out the Retry-After pause, along with every other request to the host
+        raise error
+    
+    def bind(self, session) -> 'ControlledSession':
+        """Session-like wrapper whose get() goes through this controller"""
+        return ControlledSession(self, session)
+    
+    def stats(self) -> Dict:
+        """Limit, breaker state and request counts per host"""
+        with self._lock:
+            hosts = dict(self._hosts)
+        report = {}
+        for host, state in hosts.items():
+            with state.changed:
+                report[host] = dict(state.counts, limit=round(state.limit, 2),
+                                    in_flight=state.in_flight, circuit=state.circuit,
+                                    average_latency_ms=round((state.average_latency or 0.0) * 1000, 1))
+        return report
+
+
+class ControlledSession:
+    """Stands in for a requests session where only get() is used (HTTPCache.fetch)"""
+    
+    def __init__(self, controller: HostController, session):
+        self.controller = controller
+        self.session = session
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.controller.get(self.session, url, **kwargs)
+
+
+_default_controller = None
+_default_lock = threading.Lock()
+
+
+def get_default_controller() -> HostController:
+    """Controller shared by every scraper that is not given one"""
+    global _default_controller
+    with _default_lock:
+        if _default_controller is None:
+            _default_controller = HostController()
+    return _default_controller
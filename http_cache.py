@@ -0,0 +1,239 @@
+"""
+HTTP Response Cache
+Stores listing pages on disk and revalidates them with conditional requests
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+import config
+
+
+# Query parameters that never change the page content
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid')
+
+# Eviction frees space down to this fraction of max_bytes, so the stores
+# that follow don't each rescan the directory at the cap
+EVICT_LOW_WATER = 0.9
+
+
+class CacheMissError(Exception):
+    """Raised in cache-only mode when a URL has never been cached"""
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so equivalent listing links share one cache entry
+    
+    Lowercases the scheme and host, drops default ports, fragments and
+    tracking parameters, and sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+class HTTPCache:
+    """On-disk response cache with ETag/Last-Modified revalidation and LRU eviction"""
+    
+    def __init__(self, directory: str = None, ttl: int = None,
+                 max_bytes: int = None, cache_only: bool = None):
+        """
+        Args:
+            directory: Where cached responses are stored
+            ttl: Seconds a cached page is served without revalidation
+            max_bytes: Size cap for cached bodies; beyond it, least recently
+                used entries are evicted down to EVICT_LOW_WATER of the cap
+            cache_only: Never touch the network, serve cached pages only
+        """
+        self.directory = directory or config.HTTP_CACHE_DIR
+        self.ttl = config.HTTP_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = config.HTTP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.cache_only = config.HTTP_CACHE_ONLY if cache_only is None else cache_only
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+    
+    def get(self, url: str) -> Optional[Dict]:
+        """Return the cached entry for a URL (metadata plus 'body'), or None"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(body_path, 'rb') as f:
+                entry['body'] = f.read()
+        except (OSError, ValueError):
+            return None
+        # The metadata file's mtime records the last access for LRU eviction;
+        # the entry may have been evicted since it was read
+        try:
+            os.utime(meta_path)
+        except FileNotFoundError:
+            pass
+        return entry
+    
+    def store(self, url: str, body: bytes, headers: Optional[Dict] = None,
+              complete: bool = True) -> None:
+        """Store a response body with its validators"""
+        headers = headers or {}
+        meta_path, body_path = self._paths(url)
+        entry = {
+            'url': normalize_url(url),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'size': len(body),
+            'complete': complete
+        }
+        
+        with self._lock:
+            previous = self._entry_size(meta_path)
+            self._write_atomic(body_path, body)
+            self._write_atomic(meta_path, json.dumps(entry).encode('utf-8'))
+            self._total_bytes = self.total_bytes() - previous + len(body)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+    
+    def refresh(self, url: str) -> None:
+        """Mark a cached entry as freshly validated (after a 304)"""
+        meta_path, _ = self._paths(url)
+        with self._lock:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                entry['stored_at'] = time.time()
+                self._write_atomic(meta_path, json.dumps(entry).encode('utf-8'))
+            except (OSError, ValueError):
+                pass
+    
+    def fetch(self, url: str, session: Optional[requests.Session] = None,
+              headers: Optional[Dict] = None, timeout: float = 10,
+              read_body: Optional[Callable] = None) -> bytes:
+        """
+        Return the page body, from cache when fresh, revalidating when stale
+        
+        Args:
+            url: Page URL
+            session: Optional pooled session to use for network requests
+            headers: Extra request headers
+            timeout: Request timeout in seconds
+            read_body: Optional reader for a streamed response returning
+                (body, truncated); truncated bodies are only reused by
+                later streamed fetches
+            
+        Returns:
+            Response body bytes
+            
+        Raises:
+            CacheMissError: In cache-only mode when the URL isn't cached, or
+                only a truncated streamed body is cached and read_body is None
+        """
+        entry = self.get(url)
+        if entry and read_body is None and not entry.get('complete', True):
+            # A partial body from a streamed fetch can't stand in for the full page
+            entry = None
+        
+        if self.cache_only:
+            if entry is None:
+                raise CacheMissError(f"Not cached in full (cache-only mode): {url}")
+            return entry['body']
+        
+        if entry and time.time() - entry['stored_at'] < self.ttl:
+            return entry['body']
+        
+        request_headers = dict(headers or {})
+        if entry:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        
+        http = session or requests
+        response = http.get(url, headers=request_headers, timeout=timeout,
+                            stream=read_body is not None)
+        
+        if response.status_code == 304 and entry:
+            response.close()
+            self.refresh(url)
+            return entry['body']
+        
+        response.raise_for_status()
+        if read_body:
+            body, truncated = read_body(response)
+        else:
+            body, truncated = response.content, False
+        self.store(url, body, response.headers, complete=not truncated)
+        return body
+    
+    def total_bytes(self) -> int:
+        """Total size of cached bodies"""
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, _, size in self._scan())
+        return self._total_bytes
+    
+    def clear(self) -> None:
+        """Remove every cached response"""
+        with self._lock:
+            for meta_path, _, _ in self._scan():
+                self._remove(meta_path)
+            self._total_bytes = 0
+    
+    def _scan(self) -> list:
+        """List (meta path, last access, body size) for every entry"""
+        entries = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith('.json'):
+                entries.append((item.path, item.stat().st_mtime, self._entry_size(item.path)))
+        return entries
+    
+    def _evict(self) -> None:
+        """Drop least recently used entries until under the low-water mark"""
+        target = self.max_bytes * EVICT_LOW_WATER
+        for meta_path, _, size in sorted(self._scan(), key=lambda e: e[1]):
+            if self._total_bytes <= target:
+                break
+            self._remove(meta_path)
+            self._total_bytes -= size
+    
+    @staticmethod
+    def _entry_size(meta_path: str) -> int:
+        body_path = meta_path[:-len('.json')] + '.body'
+        try:
+            return os.path.getsize(body_path)
+        except OSError:
+            return 0
+    
+    @staticmethod
+    def _remove(meta_path: str) -> None:
+        for path in (meta_path, meta_path[:-len('.json')] + '.body'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
@@ -0,0 +1,229 @@
+"""
+Perceptual Image Index
+Difference hashes (dHash) of listing photos with fast Hamming-distance lookup,
+used to collapse near-duplicate shots and recognize photos seen before
+"""
+
+import io
+import json
+import os
+import threading
+from array import array
+from collections import defaultdict
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import config
+
+
+HASH_BITS = 64
+# The hash is split into bands for multi-index lookup; two hashes within
+# distance d share at least one band within distance d // BANDS
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    64-bit difference hash: one bit per horizontally adjacent pixel pair of
+    a 9x8 grayscale thumbnail, set when the left pixel is brighter
+    """
+    # JPEGs can be decoded at 1/8 scale, which is plenty for a 9x8 thumbnail
+    image.draft('L', (64, 64))
+    pixels = list(image.convert('L').resize((9, 8), Image.BOX).getdata())
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_bytes(content: bytes) -> int:
+    with Image.open(io.BytesIO(content)) as image:
+        return dhash(image)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _band_neighbors(value: int, radius: int) -> List[int]:
+    """All band values within the given Hamming radius of value"""
+    neighbors = [value]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), distance):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            neighbors.append(flipped)
+    return neighbors
+
+
+class ImageHashIndex:
+    """
+    Append-only dHash index stored under DATA_DIR
+    
+    Hashes live in a flat file of unsigned 64-bit integers (8 bytes per
+    photo); a JSON-lines sidecar maps image URLs and content hashes to
+    entry ids. Lookups use one table per band, so a query only compares
+    against entries that share a nearby band instead of scanning the file.
+    """
+    
+    def __init__(self, path: str = None, threshold: int = None):
+        """
+        Args:
+            path: File prefix for '<path>.bin' and '<path>.jsonl'
+                (config.IMAGE_HASH_INDEX if omitted)
+            threshold: Default Hamming distance for a near-duplicate
+        """
+        self.path = path or config.IMAGE_HASH_INDEX
+        self.threshold = config.IMAGE_HASH_THRESHOLD if threshold is None else threshold
+        self.hashes = array('Q')
+        self.entries: List[Dict] = []
+        self.urls: Dict[str, int] = {}
+        self._bands = [defaultdict(list) for _ in range(BANDS)]
+        self._lock = threading.Lock()
+        self._load()
+    
+    def _load(self) -> None:
+        bin_path = f"{self.path}.bin"
+        if os.path.exists(bin_path):
+            with open(bin_path, 'rb') as f:
+                data = f.read()
+            # Ignore a partial record left by an interrupted write
+            self.hashes.frombytes(data[:len(data) - len(data) % self.hashes.itemsize])
+        
+        # Metadata rows are matched to hashes by id; a row whose hash never
+        # reached the .bin file (or was replaced by a later add) is dropped
+        entries: Dict[int, Dict] = {}
+        meta_path = f"{self.path}.jsonl"
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entry_id = row.get('id')
+                    if not isinstance(entry_id, int) or not 0 <= entry_id < len(self.hashes):
+                        continue
+                    if 'url' in row:
+                        # Aliases only count for the entry written before them
+                        if entry_id in entries:
+                            self.urls[row['url']] = entry_id
+                    else:
+                        stored = f"{self.hashes[entry_id]:016x}"
+                        if row.get('dhash', stored) == stored:
+                            entries[entry_id] = row
+        
+        # A hash whose metadata was never written (interrupted add) is dropped
+        count = len(self.hashes)
+        while count and count - 1 not in entries:
+            count -= 1
+        if count < len(self.hashes):
+            del self.hashes[count:]
+            with open(bin_path, 'r+b') as f:
+                f.truncate(count * self.hashes.itemsize)
+        self.entries = [entries.get(entry_id) for entry_id in range(count)]
+        self.urls = {url: entry_id for url, entry_id in self.urls.items() if entry_id < count}
+        for entry_id, value in enumerate(self.hashes):
+            if self.entries[entry_id] is not None:
+                self._index_bands(entry_id, value)
+    
+    def _index_bands(self, entry_id: int, value: int) -> None:
+        for band in range(BANDS):
+            self._bands[band][(value >> (band * BAND_BITS)) & BAND_MASK].append(entry_id)
+    
+    def _append_meta(self, row: Dict) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.jsonl", 'a', encoding='utf-8') as f:
+            f.write(json.dumps(row) + '\n')
+    
+    def __len__(self) -> int:
+        return len(self.hashes)
+    
+    def add(self, value: int, url: str = None, **meta) -> int:
+        """
+        Store a hash with metadata (e.g. sha256, path)
+        
+        Returns:
+            The new entry id
+        """
+        with self._lock:
+            entry_id = len(self.hashes)
+            entry = dict(meta, id=entry_id, dhash=f"{value:016x}")
+            # Hash first: metadata is only trusted for ids that have a hash
+            with open(f"{self.path}.bin", 'ab') as f:
+                array('Q', [value]).tofile(f)
+            self._append_meta(entry)
+            self.hashes.append(value)
+            self.entries.append(entry)
+            self._index_bands(entry_id, value)
+            if url:
+                self._alias(url, entry_id)
+            return entry_id
+    
+    def alias(self, url: str, entry_id: int) -> None:
+        """Record that a URL serves the photo of an existing entry"""
+        with self._lock:
+            self._alias(url, entry_id)
+    
+    def _alias(self, url: str, entry_id: int) -> None:
+        if self.urls.get(url) != entry_id:
+            self._append_meta({'url': url, 'id': entry_id})
+            self.urls[url] = entry_id
+    
+    def lookup_url(self, url: str) -> Optional[Dict]:
+        """Entry for a URL seen before, so it need not be fetched again"""
+        entry_id = self.urls.get(url)
+        return self.entries[entry_id] if entry_id is not None else None
+    
+    def find(self, value: int, threshold: int = None) -> List[Tuple[int, int]]:
+        """
+        Entries within a Hamming distance of a hash
+        
+        Returns:
+            List of (entry id, distance), closest first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        radius = threshold // BANDS
+        candidates = set()
+        for band in range(BANDS):
+            table = self._bands[band]
+            for key in _band_neighbors((value >> (band * BAND_BITS)) & BAND_MASK, radius):
+                ids = table.get(key)
+                if ids:
+                    candidates.update(ids)
+        
+        hashes = self.hashes
+        matches = []
+        for entry_id in candidates:
+            distance = (hashes[entry_id] ^ value).bit_count()
+            if distance <= threshold:
+                matches.append((entry_id, distance))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+    
+    def nearest(self, value: int, threshold: int = None) -> Optional[Dict]:
+        """Closest known entry within the threshold, or None"""
+        matches = self.find(value, threshold)
+        return self.entries[matches[0][0]] if matches else None
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_default_index() -> ImageHashIndex:
+    """Shared index at config.IMAGE_HASH_INDEX"""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = ImageHashIndex()
+    return _default_index
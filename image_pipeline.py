@@ -0,0 +1,443 @@
+"""
+Listing Image Pipeline
+Downloads listing photos concurrently, stores them by content hash and
+renders the square and portrait crops used for Instagram and Facebook posts
+"""
+
+import atexit
+import hashlib
+import io
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageOps
+
+import config
+import metrics
+from image_index import ImageHashIndex, dhash_bytes, get_default_index, hamming
+from scraper import DEFAULT_HEADERS, create_session
+
+
+# Output sizes for social formats (width, height)
+RENDER_FORMATS = {
+    'square': (1080, 1080),
+    'portrait': (1080, 1350)
+}
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Dimensions are read from at most this many leading bytes
+HEADER_LIMIT = 256 * 1024
+
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp'}
+
+# JPEG start-of-frame markers (C4, C8 and CC are not frames)
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length field
+_JPEG_STANDALONE = frozenset([0x01, 0xD8] + list(range(0xD0, 0xD8)))
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """
+    Read image dimensions from the leading bytes of a file without decoding it
+    
+    Args:
+        data: The first bytes of a PNG, JPEG, GIF or WebP file
+    
+    Returns:
+        (width, height, format), or None if the format is unknown or more
+        bytes are needed
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) >= 24 and data[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', data[16:24])
+            return width, height, 'png'
+        return None
+    
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) >= 10:
+            width, height = struct.unpack('<HH', data[6:10])
+            return width, height, 'gif'
+        return None
+    
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ' and len(data) >= 30 and data[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF, 'webp'
+        if chunk == b'VP8L' and len(data) >= 25 and data[20] == 0x2F:
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, 'webp'
+        if chunk == b'VP8X' and len(data) >= 30:
+            width = int.from_bytes(data[24:27], 'little') + 1
+            height = int.from_bytes(data[27:30], 'little') + 1
+            return width, height, 'webp'
+        return None
+    
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_size(data)
+    
+    return None
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """Walk JPEG segments until the start-of-frame header"""
+    i = 2
+    length = len(data)
+    while i + 4 <= length:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before the marker
+            i += 1
+            continue
+        if marker in _JPEG_STANDALONE:
+            i += 2
+            continue
+        if marker in _JPEG_SOF:
+            if i + 9 > length:
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height, 'jpeg'
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+
+def _decoded_size(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """Dimensions from Pillow, for files whose header image_size cannot read"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.width, image.height, (image.format or '').lower()
+    except Exception:
+        return None
+
+
+def _original_path(digest: str, image_format: str, images_dir: str) -> str:
+    extension = EXTENSIONS.get(image_format, 'img')
+    return os.path.join(images_dir, 'originals', digest[:2], f"{digest}.{extension}")
+
+
+def _render_path(digest: str, name: str, images_dir: str) -> str:
+    return os.path.join(images_dir, name, digest[:2], f"{digest}.jpg")
+
+
+def _store(content: bytes, digest: str, image_format: str, images_dir: str) -> str:
+    """Write a downloaded image once; identical content shares one file"""
+    path = _original_path(digest, image_format, images_dir)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    return path
+
+
+def fetch_image(url: str, session: requests.Session, images_dir: str,
+                min_dimension: int = 0, hash_image: bool = False) -> Dict:
+    """
+    Download one image, checking its size from the header bytes first
+    
+    Images smaller than min_dimension on either side are abandoned as soon
+    as the header has arrived, so icons and thumbnails are never fully
+    downloaded.
+    
+    Returns:
+        Dictionary with 'url', 'sha256', 'path', 'width', 'height',
+        'format', 'bytes', 'dhash' (when hash_image is set), 'skipped'
+        (reason or None) and 'error'
+    """
+    record = {'url': url, 'sha256': None, 'path': None, 'width': None, 'height': None,
+              'format': None, 'bytes': 0, 'dhash': None, 'skipped': None, 'error': None}
+    try:
+        with metrics.span('images.download') as span:
+            response = session.get(url, headers=DEFAULT_HEADERS, timeout=15, stream=True)
+            try:
+                response.raise_for_status()
+                chunks = []
+                received = 0
+                size = None
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    chunks.append(chunk)
+                    received += len(chunk)
+                    if size is None and received <= HEADER_LIMIT + DOWNLOAD_CHUNK_SIZE:
+                        size = image_size(b''.join(chunks))
+                        if size and min(size[0], size[1]) < min_dimension:
+                            record.update(width=size[0], height=size[1], format=size[2],
+                                          skipped='too_small')
+                            return record
+            finally:
+                response.close()
+            span.add(bytes=received)
+        
+        content = b''.join(chunks)
+        if size is None:
+            # Headers past HEADER_LIMIT (e.g. a large embedded EXIF thumbnail
+            # before the JPEG frame) are read from the whole file
+            size = image_size(content) or _decoded_size(content)
+            if size is None:
+                raise Exception("Unrecognized image format")
+            if min(size[0], size[1]) < min_dimension:
+                record.update(width=size[0], height=size[1], format=size[2],
+                              skipped='too_small')
+                return record
+        
+        digest = hashlib.sha256(content).hexdigest()
+        record.update(sha256=digest, width=size[0], height=size[1], format=size[2],
+                      bytes=len(content),
+                      path=_store(content, digest, size[2], images_dir))
+        if hash_image:
+            record['dhash'] = dhash_bytes(content)
+    except Exception as e:
+        record['error'] = f"Failed to download image: {str(e)}"
+    return record
+
+
+def download_images(urls: List[str], session: requests.Session = None,
+                    max_workers: int = None, min_dimension: int = None,
+                    images_dir: str = None, index: ImageHashIndex = None) -> List[Dict]:
+    """
+    Download listing images concurrently over one pooled session
+    
+    Args:
+        urls: Image URLs (e.g. from ListingScraper._extract_images)
+        session: Optional session to reuse (a pooled one is created if omitted)
+        max_workers: Parallel downloads (config default if omitted)
+        min_dimension: Skip images smaller than this on either side
+        images_dir: Storage root (config.IMAGES_DIR if omitted)
+        index: Optional perceptual-hash index shared across listings; URLs
+            it already knows are not fetched again and new photos are
+            added to it (near-identical shots within the listing are
+            collapsed either way)
+    
+    Returns:
+        One record per URL, in input order. Records of the same photo (same
+        content, or within the index's Hamming threshold) are marked
+        'duplicate' after the first; 'known' marks photos the index had
+        already seen on another listing.
+    """
+    max_workers = max_workers or config.IMAGE_DOWNLOAD_WORKERS
+    min_dimension = config.IMAGE_MIN_DIMENSION if min_dimension is None else min_dimension
+    images_dir = images_dir or config.IMAGES_DIR
+    
+    records = [None] * len(urls)
+    to_fetch = []
+    for position, url in enumerate(urls):
+        entry = index.lookup_url(url) if index is not None else None
+        if entry and os.path.exists(entry.get('path', '')):
+            records[position] = _known_record(url, entry)
+        else:
+            to_fetch.append(position)
+    
+    if to_fetch:
+        own_session = session is None
+        if own_session:
+            session = create_session(pool_size=max_workers)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetched = executor.map(
+                    lambda url: fetch_image(url, session, images_dir, min_dimension,
+                                            hash_image=True),
+                    [urls[position] for position in to_fetch])
+                for position, record in zip(to_fetch, fetched):
+                    record['known'] = False
+                    records[position] = record
+        finally:
+            if own_session:
+                session.close()
+    
+    _mark_duplicates(records, index.threshold if index is not None else config.IMAGE_HASH_THRESHOLD)
+    if index is not None:
+        _update_index(records, index)
+    return records
+
+
+def _known_record(url: str, entry: Dict) -> Dict:
+    return {'url': url, 'sha256': entry.get('sha256'), 'path': entry.get('path'),
+            'width': entry.get('width'), 'height': entry.get('height'),
+            'format': entry.get('format'), 'bytes': 0, 'dhash': int(entry['dhash'], 16),
+            'skipped': None, 'error': None, 'known': True}
+
+
+def _mark_duplicates(records: List[Dict], threshold: int) -> None:
+    """Flag repeats of an earlier photo in the same listing, exact or near"""
+    seen_digests = set()
+    kept_hashes = []
+    for record in records:
+        digest = record['sha256']
+        value = record.get('dhash')
+        duplicate = digest in seen_digests or (
+            value is not None and any(hamming(value, kept) <= threshold for kept in kept_hashes))
+        record['duplicate'] = duplicate
+        if digest and not duplicate:
+            seen_digests.add(digest)
+            if value is not None:
+                kept_hashes.append(value)
+
+
+def _update_index(records: List[Dict], index: ImageHashIndex) -> None:
+    """Add newly fetched photos to the index, or alias them to a known one"""
+    for record in records:
+        if record['known'] or record['dhash'] is None:
+            continue
+        match = index.nearest(record['dhash'])
+        if match:
+            # Same photo already stored for another listing or CDN URL;
+            # remember this URL too so it is not fetched next time
+            index.alias(record['url'], match['id'])
+            if not record['duplicate']:
+                record['known'] = True
+        elif not record['duplicate']:
+            index.add(record['dhash'], url=record['url'], sha256=record['sha256'],
+                      path=record['path'], width=record['width'], height=record['height'],
+                      format=record['format'])
+
+
+def render_image(path: str, digest: str, formats: Dict[str, Tuple[int, int]],
+                 images_dir: str) -> Dict[str, str]:
+    """
+    Render center crops of one stored image (runs in a worker process)
+    
+    Returns:
+        Mapping of format name to rendered JPEG path
+    """
+    targets = {name: _render_path(digest, name, images_dir) for name in formats}
+    missing = {name: size for name, size in formats.items() if not os.path.exists(targets[name])}
+    if not missing:
+        return targets
+    
+    with Image.open(path) as image:
+        # Let the JPEG decoder downscale while decoding when the source is
+        # much larger than the biggest output
+        largest = max(max(size) for size in missing.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        
+        for name, size in missing.items():
+            rendered = ImageOps.fit(image, size, method=Image.LANCZOS)
+            target = targets[name]
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            rendered.save(temp_path, 'JPEG', quality=85, optimize=True)
+            os.replace(temp_path, target)
+    
+    return targets
+
+
+_render_pool = None
+_render_lock = threading.Lock()
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    """Process pool shared by render_images calls, started on first use"""
+    global _render_pool
+    with _render_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+            atexit.register(_render_pool.shutdown)
+        return _render_pool
+
+
+def render_images(records: List[Dict], formats: Dict[str, Tuple[int, int]] = None,
+                  max_workers: int = None, images_dir: str = None,
+                  executor: ProcessPoolExecutor = None) -> List[Dict]:
+    """
+    Render social crops for downloaded images in a process pool
+    
+    Each distinct photo is rendered once; renders already on disk are reused.
+    Adds a 'renders' mapping (format name -> path) to every stored record.
+    
+    Args:
+        records: Records from download_images
+        formats: Output sizes by name (RENDER_FORMATS if omitted)
+        max_workers: Worker processes of a pool used for this call only;
+            without it (or an executor) the module's shared pool is used
+        images_dir: Storage root (config.IMAGES_DIR if omitted)
+        executor: Optional long-lived process pool to reuse
+    """
+    formats = formats or RENDER_FORMATS
+    images_dir = images_dir or config.IMAGES_DIR
+    
+    unique = {}
+    for record in records:
+        if record.get('path') and record['sha256'] not in unique:
+            unique[record['sha256']] = record['path']
+    if not unique:
+        return records
+    
+    own_executor = executor is None and max_workers is not None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    elif executor is None:
+        # Reused across listings, so each call doesn't pay for starting processes
+        executor = _get_render_pool()
+    
+    try:
+        with metrics.span('images.render', images=len(unique)):
+            futures = {digest: executor.submit(render_image, path, digest, formats, images_dir)
+                       for digest, path in unique.items()}
+            renders = {}
+            errors = {}
+            for digest, future in futures.items():
+                try:
+                    renders[digest] = future.result()
+                except Exception as e:
+                    errors[digest] = f"Failed to render image: {str(e)}"
+    finally:
+        if own_executor:
+            executor.shutdown()
+    
+    for record in records:
+        digest = record.get('sha256')
+        if digest in renders:
+            record['renders'] = renders[digest]
+        elif digest in errors:
+            record['error'] = errors[digest]
+    return records
+
+
+def process_listing_images(urls: List[str], session: requests.Session = None,
+                           formats: Dict[str, Tuple[int, int]] = None,
+                           images_dir: str = None, index: ImageHashIndex = None,
+                           use_index: bool = None) -> List[Dict]:
+    """
+    Download, dedupe and render the images for one listing
+    
+    Args:
+        urls: Image URLs for the listing
+        session: Optional session to reuse
+        formats: Output sizes by name (RENDER_FORMATS if omitted)
+        images_dir: Storage root (config.IMAGES_DIR if omitted)
+        index: Optional perceptual-hash index shared across listings
+        use_index: Use the shared index at config.IMAGE_HASH_INDEX when no
+            index is given (config.IMAGE_HASH_INDEX_ENABLED if omitted)
+    
+    Returns:
+        Records for the usable photos (not skipped, failed or duplicated),
+        in the listing's image order
+    """
+    if index is None and (config.IMAGE_HASH_INDEX_ENABLED if use_index is None else use_index):
+        index = get_default_index()
+    records = download_images(urls, session=session, images_dir=images_dir, index=index)
+    usable = [record for record in records
+              if record['path'] and not record['duplicate'] and not record['error']]
+    return render_images(usable, formats=formats, images_dir=images_dir)
+
+
+# Example usage
+if __name__ == '__main__':
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description="Download and render one listing's images")
+    parser.add_argument('urls', nargs='+', help='Image URLs')
+    parser.add_argument('--index', action='store_true',
+                        help='Reuse photos already seen on other listings (shared hash index)')
+    args = parser.parse_args()
+    for record in process_listing_images(args.urls, use_index=args.index or None):
+        print(json.dumps(record, indent=2))
@@ -0,0 +1,159 @@
+"""
+Keyword Matching
+Finds vocabulary terms (property types, features) in page text with one
+compiled pattern per category, matching whole words only
+"""
+
+import json
+import re
+from typing import Dict, List, Optional
+
+import config
+
+
+# Spaces and hyphens inside a term match any run of either, so
+# 'walk-in closet' also finds 'walk in\ncloset'
+_SEPARATOR = r'[-\s]+'
+_SEPARATOR_RUN = re.compile(_SEPARATOR)
+
+
+def _key(term: str) -> str:
+    return _SEPARATOR_RUN.sub(' ', term.strip().lower())
+
+
+def _trie(terms) -> Dict:
+    root = {}
+    for term in terms:
+        node = root
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return root
+
+
+def _trie_pattern(node: Dict) -> str:
+    """
+    Regex for a trie: each node is one alternation keyed by the next
+    character, so matching never tries more than one branch per character
+    and the cost does not grow with the number of terms
+    """
+    branches = [(_SEPARATOR if char == ' ' else re.escape(char)) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    if '' in node:
+        # Greedy, so the longest term wins ('double garage' over 'garage')
+        return f"(?:{body})?"
+    return body
+
+
+def compile_terms(terms) -> re.Pattern:
+    """
+    One pattern matching any of the terms on word boundaries, allowing a
+    plural 's' (so 'deck' matches 'decks' but not 'decked')
+    """
+    keys = sorted({_key(term) for term in terms if term.strip()})
+    if not keys:
+        return re.compile(r'(?!)')
+    return re.compile(rf"(?<!\w)(?:{_trie_pattern(_trie(keys))})s?(?!\w)")
+
+
+class KeywordMatcher:
+    """Vocabulary of canonical names and the terms that mean them, per category"""
+    
+    def __init__(self, vocabulary: Dict[str, Dict[str, List[str]]]):
+        """
+        Args:
+            vocabulary: Category (e.g. 'features') -> canonical name
+                (e.g. 'Braai') -> terms that mean it (e.g. ['braai',
+                'built-in braai']); a term listed twice in a category keeps
+                its first name
+        """
+        self.vocabulary = vocabulary
+        self._terms: Dict[str, Dict[str, str]] = {}
+        self._patterns: Dict[str, re.Pattern] = {}
+        for category, names in vocabulary.items():
+            terms = {}
+            for name, aliases in names.items():
+                for term in [name] + list(aliases):
+                    terms.setdefault(_key(term), name)
+            self._terms[category] = terms
+            self._patterns[category] = compile_terms(terms)
+    
+    @classmethod
+    def from_file(cls, path: str = None) -> 'KeywordMatcher':
+        """Load a JSON vocabulary (config.KEYWORD_VOCABULARY if omitted)"""
+        path = path or config.KEYWORD_VOCABULARY
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        except Exception as e:
+            raise Exception(f"Failed to load keyword vocabulary {path}: {str(e)}")
+    
+    @property
+    def categories(self) -> List[str]:
+        return list(self._patterns)
+    
+    def _name(self, category: str, matched: str) -> Optional[str]:
+        terms = self._terms[category]
+        key = _key(matched)
+        name = terms.get(key)
+        if name is None and key.endswith('s'):
+            name = terms.get(key[:-1])
+        return name
+    
+    def scan(self, text: str, lowercase: bool = True,
+             categories: List[str] = None) -> Dict[str, List[Dict]]:
+        """
+        Find every vocabulary term in the text
+        
+        Args:
+            text: Page text
+            lowercase: Lowercase the text first (pass False if it already is)
+            categories: Only these categories (all if omitted)
+        
+        Returns:
+            Category -> list of {'name', 'count', 'first'} (character offset
+            of the first mention), most frequent first and earliest first
+            among equals
+        """
+        if lowercase:
+            text = text.lower()
+        results = {}
+        for category in categories or self._patterns:
+            pattern = self._patterns[category]
+            found = {}
+            for match in pattern.finditer(text):
+                name = self._name(category, match.group())
+                if name is None:
+                    continue
+                entry = found.get(name)
+                if entry is None:
+                    found[name] = {'name': name, 'count': 1, 'first': match.start()}
+                else:
+                    entry['count'] += 1
+            results[category] = sorted(found.values(),
+                                       key=lambda entry: (-entry['count'], entry['first']))
+        return results
+    
+    def find(self, text: str, category: str) -> List[str]:
+        """Canonical names of a category found in the text, best ranked first"""
+        if category not in self._patterns:
+            return []
+        return [entry['name'] for entry in self.scan(text, categories=[category])[category]]
+    
+    def best(self, text: str, category: str) -> Optional[str]:
+        names = self.find(text, category)
+        return names[0] if names else None
+
+
+_default_matcher = None
+
+
+def get_default_matcher() -> KeywordMatcher:
+    """Shared matcher for config.KEYWORD_VOCABULARY"""
+    global _default_matcher
+    if _default_matcher is None:
+        _default_matcher = KeywordMatcher.from_file()
+    return _default_matcher
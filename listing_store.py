@@ -0,0 +1,563 @@
+"""
+Listing Store
+Scraped listings normalized into typed columns (numeric price, integer
+bedrooms, float bathrooms and floor area) in an append-only NumPy-backed
+table under DATA_DIR, with vectorized filters and grouped aggregates
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the store is then safe for one process only
+    fcntl = None
+
+import config
+from scraper import parse_price
+
+
+# Column name -> storage dtype; 'category' columns hold int32 codes into a
+# per-column dictionary of strings
+COLUMNS = {
+    'url': 'category',
+    'suburb': 'category',
+    'property_type': 'category',
+    'price': '<f8',
+    'bedrooms': '<i2',
+    'bathrooms': '<f4',
+    'square_feet': '<f8',
+    'captions': '<i2',  # caption variations generated (0: not captioned yet)
+    'scraped_at': '<f8'
+}
+CODE_DTYPE = '<i4'
+
+# Missing integers are stored as -1, missing floats as NaN and missing
+# strings as the empty string
+NULL_INT = -1
+
+# Largest plausible room counts; larger values (usually a heuristic match on
+# some other number) are stored as missing rather than wrapping the int16
+MAX_ROOMS = 100
+MAX_CAPTIONS = np.iinfo(np.int16).max
+
+# Values computed from stored columns for group_stats()
+DERIVED_VALUES = ('price_per_bedroom', 'price_per_square_foot')
+
+_POSTAL_CODE = re.compile(r'\b\d{4,6}\b')
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = re.search(r'\d[\d,]*(?:\.\d+)?', value)
+        if match:
+            return float(match.group().replace(',', ''))
+    return None
+
+
+def _rooms(value) -> Optional[float]:
+    """A room count, or None when missing or implausible"""
+    number = _number(value)
+    if number is None or not 0 <= number <= MAX_ROOMS:
+        return None
+    return number
+
+
+def parse_suburb(address) -> str:
+    """
+    Suburb or town of a listing address, e.g. 'Springfield' for
+    '123 Main Street, Springfield, IL 62704'
+    
+    Returns:
+        The part after the street, or '' when the address is missing
+    """
+    if not isinstance(address, str) or address == 'Address not found':
+        return ''
+    parts = [part.strip() for part in address.split(',') if part.strip()]
+    if not parts:
+        return ''
+    # The first part is the street when there is more than one
+    suburb = parts[1] if len(parts) > 1 else parts[0]
+    return ' '.join(_POSTAL_CODE.sub('', suburb).split())
+
+
+def normalize_listing(listing_data: Dict, captions: int = 0,
+                      scraped_at: Optional[float] = None) -> Dict:
+    """
+    Typed row for an extract_data() result
+    
+    Args:
+        listing_data: Listing as returned by ListingScraper.extract_data()
+        captions: Caption variations generated for the listing so far
+        scraped_at: Epoch time of the scrape (now if omitted)
+    
+    Returns:
+        Dictionary with one value per column; missing numbers, and room
+        counts above MAX_ROOMS, are None
+    """
+    bedrooms = _rooms(listing_data.get('bedrooms'))
+    return {
+        'url': listing_data.get('url') or '',
+        'suburb': parse_suburb(listing_data.get('address')),
+        'property_type': listing_data.get('property_type') or '',
+        'price': parse_price(listing_data.get('price')),
+        'bedrooms': int(bedrooms) if bedrooms is not None else None,
+        'bathrooms': _rooms(listing_data.get('bathrooms')),
+        'square_feet': _number(listing_data.get('square_feet')),
+        'captions': max(0, min(int(captions), MAX_CAPTIONS)),
+        'scraped_at': time.time() if scraped_at is None else scraped_at
+    }
+
+
+class ListingStore:
+    """
+    Append-only columnar table of normalized listings
+    
+    Each column lives in its own flat file ('<column>.bin', little-endian),
+    so queries read only the columns they touch and filter with NumPy. String
+    columns are dictionary-encoded: the file holds int32 codes and
+    '<column>.jsonl' holds one value per code. A re-scraped or newly
+    captioned listing is appended as a new row; queries see the latest row
+    per URL unless asked for history.
+    
+    Several processes may share a directory: appends hold an exclusive
+    lock on '.lock' and first read what other writers appended, so
+    dictionary codes stay consistent, and queries pick up new rows.
+    """
+    
+    def __init__(self, directory: str = None):
+        """
+        Args:
+            directory: Where the column files live (config.LISTING_STORE_DIR
+                if omitted)
+        """
+        self.directory = directory or config.LISTING_STORE_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._columns: Dict[str, np.ndarray] = {}
+        self._values: Dict[str, List[str]] = {}
+        self._codes: Dict[str, Dict[str, int]] = {}
+        # Bytes of each '<column>.jsonl' already read into _values
+        self._dictionary_bytes: Dict[str, int] = {}
+        self._latest: Optional[np.ndarray] = None
+        self._latest_by_url: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        with self._lock, self._file_lock(exclusive=True):
+            self._load()
+    
+    def _path(self, column: str, suffix: str = '.bin') -> str:
+        return os.path.join(self.directory, column + suffix)
+    
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Lock the store directory against writers in other processes"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _dtype(column: str) -> str:
+        return CODE_DTYPE if COLUMNS[column] == 'category' else COLUMNS[column]
+    
+    def _load(self) -> None:
+        for column in COLUMNS:
+            dtype = np.dtype(self._dtype(column))
+            path = self._path(column)
+            data = b''
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+            # Ignore a partial value left by an interrupted write
+            self._columns[column] = np.frombuffer(data[:len(data) - len(data) % dtype.itemsize],
+                                                  dtype=dtype).copy()
+            
+            if COLUMNS[column] == 'category':
+                self._values[column] = []
+                self._codes[column] = {}
+                self._dictionary_bytes[column] = 0
+                self._read_dictionary(column, repair=True)
+        
+        # Only rows written to every column (with known dictionary values) are usable
+        count = min(len(values) for values in self._columns.values())
+        for column, values in self._columns.items():
+            if COLUMNS[column] == 'category':
+                invalid = np.flatnonzero(values[:count] >= len(self._values[column]))
+                if len(invalid):
+                    count = int(invalid[0])
+        for column in COLUMNS:
+            self._columns[column] = self._columns[column][:count]
+        self._truncate_files(count)
+        
+        urls = self._columns['url']
+        # np.unique returns the first occurrence, so search the reversed codes
+        codes, first = np.unique(urls[::-1], return_index=True)
+        self._latest_by_url = dict(zip(codes.tolist(), (len(urls) - 1 - first).tolist()))
+    
+    def _read_dictionary(self, column: str, repair: bool = False) -> None:
+        """
+        Read values appended to a category column's dictionary since the last
+        read; with repair (under the exclusive lock) a line cut short by an
+        interrupted write is dropped from the file
+        """
+        path = self._path(column, '.jsonl')
+        valid = self._dictionary_bytes[column]
+        if not os.path.exists(path) or os.path.getsize(path) == valid:
+            return
+        values = self._values[column]
+        codes = self._codes[column]
+        with open(path, 'rb') as f:
+            f.seek(valid)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    value = json.loads(line)
+                except ValueError:
+                    break
+                codes[value] = len(values)
+                values.append(value)
+                valid += len(line)
+        self._dictionary_bytes[column] = valid
+        if repair and valid != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+    
+    def _refresh(self, repair: bool = False) -> None:
+        """
+        Pick up rows appended by other processes; with repair (under the
+        exclusive lock) files are also cut back to the usable rows
+        """
+        for column in COLUMNS:
+            if COLUMNS[column] == 'category':
+                self._read_dictionary(column, repair)
+        start = len(self)
+        count = min(os.path.getsize(self._path(column)) // np.dtype(self._dtype(column)).itemsize
+                    if os.path.exists(self._path(column)) else 0 for column in COLUMNS)
+        if count > start:
+            added = {}
+            for column in COLUMNS:
+                dtype = np.dtype(self._dtype(column))
+                with open(self._path(column), 'rb') as f:
+                    f.seek(start * dtype.itemsize)
+                    added[column] = np.frombuffer(f.read((count - start) * dtype.itemsize),
+                                                  dtype=dtype)
+            # Rows whose dictionary values are not written yet wait for the next refresh
+            for column, values in added.items():
+                if COLUMNS[column] == 'category':
+                    invalid = np.flatnonzero(values[:count - start] >= len(self._values[column]))
+                    if len(invalid):
+                        count = start + int(invalid[0])
+            for column, values in added.items():
+                self._columns[column] = np.concatenate([self._columns[column],
+                                                        values[:count - start]])
+            for offset, code in enumerate(self._columns['url'][start:count].tolist()):
+                self._latest_by_url[code] = start + offset
+            self._latest = None
+        if repair:
+            self._truncate_files(len(self))
+    
+    def _sync(self) -> None:
+        """Refresh when another process has appended since the last look (caller holds _lock)"""
+        size = len(self) * np.dtype(CODE_DTYPE).itemsize
+        path = self._path('url')
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with self._file_lock(exclusive=False):
+                self._refresh()
+    
+    def refresh(self) -> None:
+        """Load rows other processes have appended to the directory"""
+        with self._lock:
+            self._sync()
+    
+    def _truncate_files(self, count: int) -> None:
+        """Cut column files back to the usable rows so later appends line up"""
+        for column in COLUMNS:
+            path = self._path(column)
+            size = count * np.dtype(self._dtype(column)).itemsize
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+    
+    def __len__(self) -> int:
+        """Rows stored, including superseded versions of a listing"""
+        return len(self._columns['url'])
+    
+    def _encode_category(self, column: str, values: List) -> np.ndarray:
+        """Dictionary codes for strings, writing values not seen before to the dictionary"""
+        codes = self._codes[column]
+        known = self._values[column]
+        added = []
+        encoded = np.empty(len(values), dtype=CODE_DTYPE)
+        for position, value in enumerate(values):
+            value = value or ''
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(known)
+                known.append(value)
+                added.append(json.dumps(value, ensure_ascii=False) + '\n')
+            encoded[position] = code
+        if added:
+            data = ''.join(added).encode('utf-8')
+            with open(self._path(column, '.jsonl'), 'ab') as f:
+                f.write(data)
+            self._dictionary_bytes[column] += len(data)
+        return encoded
+    
+    def _encode(self, column: str, values: List) -> np.ndarray:
+        kind = COLUMNS[column]
+        if kind == 'category':
+            return self._encode_category(column, values)
+        if np.dtype(kind).kind == 'i':
+            return np.array([NULL_INT if value is None else value for value in values], dtype=kind)
+        return np.array([np.nan if value is None else value for value in values], dtype=kind)
+    
+    def append_rows(self, rows: List[Dict]) -> None:
+        """
+        Append normalized rows (see normalize_listing()) in one write per column
+        """
+        if not rows:
+            return
+        with self._lock, self._file_lock(exclusive=True):
+            # Codes must follow what other writers have added to the dictionaries
+            self._refresh(repair=True)
+            start = len(self)
+            encoded = {column: self._encode(column, [row[column] for row in rows])
+                       for column in COLUMNS}
+            # Dictionaries are written first, so stored codes always resolve
+            for column, values in encoded.items():
+                with open(self._path(column), 'ab') as f:
+                    f.write(values.tobytes())
+                self._columns[column] = np.concatenate([self._columns[column], values])
+            for offset, code in enumerate(encoded['url'].tolist()):
+                self._latest_by_url[code] = start + offset
+            self._latest = None
+    
+    def append(self, listing_data: Dict, captions: int = 0, scraped_at: Optional[float] = None) -> None:
+        """Normalize and store one extract_data() result"""
+        self.append_rows([normalize_listing(listing_data, captions, scraped_at)])
+    
+    def append_many(self, listings: Iterable[Dict], scraped_at: Optional[float] = None) -> int:
+        """
+        Normalize and store many extract_data() results
+        
+        Returns:
+            Number of listings stored
+        """
+        rows = [normalize_listing(listing, scraped_at=scraped_at) for listing in listings]
+        self.append_rows(rows)
+        return len(rows)
+    
+    def mark_captioned(self, url: str, captions: int) -> bool:
+        """
+        Record that captions were generated for a stored listing
+        
+        Returns:
+            False when the URL has never been stored
+        """
+        row = self.latest(url)
+        if row is None:
+            return False
+        row['captions'] = max(0, min(int(captions), MAX_CAPTIONS))
+        self.append_rows([row])
+        return True
+    
+    def _latest_rows(self) -> np.ndarray:
+        """Index of the newest row of every URL, in storage order"""
+        if self._latest is None:
+            self._latest = np.sort(np.fromiter(self._latest_by_url.values(), dtype=np.int64,
+                                               count=len(self._latest_by_url)))
+        return self._latest
+    
+    def _row(self, index: int) -> Dict:
+        row = {}
+        for column, kind in COLUMNS.items():
+            value = self._columns[column][index]
+            if kind == 'category':
+                row[column] = self._values[column][value]
+            elif np.dtype(kind).kind == 'i':
+                row[column] = None if value == NULL_INT else int(value)
+            else:
+                row[column] = None if np.isnan(value) else float(value)
+        return row
+    
+    def _latest_index(self, url: str) -> Optional[int]:
+        code = self._codes['url'].get(url)
+        return self._latest_by_url.get(code) if code is not None else None
+    
+    def latest(self, url: str) -> Optional[Dict]:
+        """Newest row stored for a URL, or None"""
+        with self._lock:
+            self._sync()
+            index = self._latest_index(url)
+            return self._row(index) if index is not None else None
+    
+    def has(self, url: str, captioned: bool = False) -> bool:
+        """Whether a URL is stored (and, with captioned, already has captions)"""
+        with self._lock:
+            self._sync()
+            index = self._latest_index(url)
+            return index is not None and (not captioned or self._columns['captions'][index] > 0)
+    
+    def _mask(self, rows: np.ndarray, suburb: str = None, property_type: str = None,
+              min_price: float = None, max_price: float = None,
+              min_bedrooms: int = None, max_bedrooms: int = None,
+              min_bathrooms: float = None, captioned: bool = None) -> np.ndarray:
+        columns = self._columns
+        mask = np.ones(len(rows), dtype=bool)
+        for column, value in (('suburb', suburb), ('property_type', property_type)):
+            if value is not None:
+                code = self._codes[column].get(value, -1)
+                mask &= columns[column][rows] == code
+        if min_price is not None:
+            mask &= columns['price'][rows] >= min_price
+        if max_price is not None:
+            mask &= columns['price'][rows] <= max_price
+        if min_bedrooms is not None:
+            mask &= columns['bedrooms'][rows] >= min_bedrooms
+        if max_bedrooms is not None:
+            bedrooms = columns['bedrooms'][rows]
+            mask &= (bedrooms != NULL_INT) & (bedrooms <= max_bedrooms)
+        if min_bathrooms is not None:
+            mask &= columns['bathrooms'][rows] >= min_bathrooms
+        if captioned is not None:
+            mask &= (columns['captions'][rows] > 0) == captioned
+        return mask
+    
+    def select(self, history: bool = False, **filters) -> np.ndarray:
+        """
+        Row indexes matching the filters
+        
+        Args:
+            history: Include superseded rows instead of only the latest per URL
+            **filters: suburb, property_type, min_price, max_price,
+                min_bedrooms, max_bedrooms, min_bathrooms, captioned
+        
+        Returns:
+            Array of row indexes in storage order
+        """
+        with self._lock:
+            self._sync()
+            rows = np.arange(len(self)) if history else self._latest_rows()
+            return rows[self._mask(rows, **filters)]
+    
+    def rows(self, limit: Optional[int] = None, **filters) -> List[Dict]:
+        """Latest rows matching the filters as dictionaries"""
+        indexes = self.select(**filters)
+        if limit is not None:
+            indexes = indexes[:limit]
+        with self._lock:
+            return [self._row(index) for index in indexes.tolist()]
+    
+    def column(self, name: str, **filters) -> np.ndarray:
+        """
+        Values of one column (or derived value) for the latest rows matching
+        the filters; category columns are returned as their strings
+        """
+        indexes = self.select(**filters)
+        with self._lock:
+            if name in DERIVED_VALUES:
+                return self._derived(name, indexes)
+            values = self._columns[name][indexes]
+            if COLUMNS[name] == 'category':
+                return np.array(self._values[name], dtype=object)[values]
+            return values
+    
+    def _derived(self, name: str, indexes: np.ndarray) -> np.ndarray:
+        price = self._columns['price'][indexes]
+        if name == 'price_per_bedroom':
+            divisor = self._columns['bedrooms'][indexes].astype('<f8')
+        else:
+            divisor = self._columns['square_feet'][indexes]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(divisor > 0, price / divisor, np.nan)
+    
+    def group_stats(self, value: str, by: str, **filters) -> Dict[str, Dict]:
+        """
+        Count, mean, min and max of a numeric column or derived value per
+        value of a category column, over the latest rows
+        
+        Usage:
+            store.group_stats('price_per_bedroom', by='suburb', property_type='House')
+        
+        Args:
+            value: Numeric column or one of DERIVED_VALUES
+            by: Category column to group by
+            **filters: As for select()
+        
+        Returns:
+            Mapping of group to {'count', 'mean', 'min', 'max'}, largest
+            groups first; rows missing the value are left out
+        """
+        if COLUMNS.get(by) != 'category':
+            raise ValueError(f"Cannot group by {by}: not a category column")
+        if value not in DERIVED_VALUES and (value not in COLUMNS or COLUMNS[value] == 'category'):
+            raise ValueError(f"Cannot aggregate {value}: not a numeric column")
+        
+        indexes = self.select(**filters)
+        with self._lock:
+            if value in DERIVED_VALUES:
+                values = self._derived(value, indexes)
+            else:
+                values = self._columns[value][indexes].astype('<f8')
+                if np.dtype(COLUMNS[value]).kind == 'i':
+                    values[values == NULL_INT] = np.nan
+            groups = self._columns[by][indexes]
+            names = list(self._values[by])
+        
+        present = ~np.isnan(values)
+        values, groups = values[present], groups[present]
+        size = len(names)
+        counts = np.bincount(groups, minlength=size)
+        sums = np.bincount(groups, weights=values, minlength=size)
+        minimums = np.full(size, np.inf)
+        maximums = np.full(size, -np.inf)
+        np.minimum.at(minimums, groups, values)
+        np.maximum.at(maximums, groups, values)
+        
+        stats = {}
+        for code in np.argsort(-counts, kind='stable').tolist():
+            if not counts[code]:
+                break
+            stats[names[code]] = {
+                'count': int(counts[code]),
+                'mean': float(sums[code] / counts[code]),
+                'min': float(minimums[code]),
+                'max': float(maximums[code])
+            }
+        return stats
+    
+    def summary(self) -> Dict:
+        """Listing counts for a dashboard"""
+        latest = self.select()
+        captioned = self.select(captioned=True)
+        return {'rows': len(self), 'listings': len(latest), 'captioned': len(captioned)}
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_store() -> ListingStore:
+    """Store under config.LISTING_STORE_DIR shared by the process"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ListingStore()
+    return _default_store
@@ -0,0 +1,261 @@
+"""
+Listing Watch
+Snapshots of watched listings with per-field fingerprints, so daily
+re-scrapes only re-caption listings whose caption-relevant details changed
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import config
+import metrics
+from ai_captions import FALLBACK_CAPTION, CaptionGenerator
+from caption_cache import CAPTION_FIELDS
+from http_cache import HTTPCache
+from scraper import LISTING_FIELDS, parse_price, scrape_listing, scrape_many
+
+
+STATUS_NEW = 'new'
+STATUS_CHANGED = 'changed'
+STATUS_UNCHANGED = 'unchanged'
+
+# Post types from config.POST_TYPES
+DEFAULT_POST_TYPE = config.POST_TYPES[0]
+PRICE_REDUCTION = 'Price Reduction'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    url TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    fingerprints TEXT NOT NULL,
+    captions TEXT,
+    post_type TEXT,
+    first_seen REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    changed_at REAL NOT NULL
+);
+"""
+
+
+def _normalize(field: str, value):
+    """Drop differences that don't change the listing (spacing, image order)"""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, list):
+        items = [_normalize(field, item) for item in value]
+        # A reshuffled carousel is the same set of photos
+        return sorted(items, key=str) if field == 'images' else items
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def fingerprint(field: str, value) -> str:
+    encoded = json.dumps(_normalize(field, value), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def fingerprints(listing_data: Dict) -> Dict[str, str]:
+    """Fingerprint of every extracted field"""
+    return {field: fingerprint(field, listing_data.get(field)) for field in LISTING_FIELDS}
+
+
+def diff(old_data: Dict, new_data: Dict, old_fingerprints: Dict[str, str] = None) -> Dict[str, Dict]:
+    """
+    Fields whose value changed between two extract_data() results
+    
+    Returns:
+        Mapping of field name to {'old': value, 'new': value}
+    """
+    old_fingerprints = old_fingerprints or fingerprints(old_data)
+    new_fingerprints = fingerprints(new_data)
+    return {
+        field: {'old': old_data.get(field), 'new': new_data.get(field)}
+        for field in LISTING_FIELDS
+        if old_fingerprints.get(field) != new_fingerprints[field]
+    }
+
+
+def is_price_drop(changes: Dict[str, Dict]) -> bool:
+    change = changes.get('price')
+    if not change:
+        return False
+    old_price = parse_price(change['old'])
+    new_price = parse_price(change['new'])
+    return old_price is not None and new_price is not None and new_price < old_price
+
+
+class SnapshotStore:
+    """Latest snapshot of each watched listing in SQLite (WAL mode)"""
+    
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: Database file (config.LISTING_SNAPSHOT_DB if omitted)
+        """
+        self.path = path or config.LISTING_SNAPSHOT_DB
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def get(self, url: str) -> Optional[Dict]:
+        row = self._connection().execute("SELECT * FROM snapshots WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'url': row['url'],
+            'data': json.loads(row['data']),
+            'fingerprints': json.loads(row['fingerprints']),
+            'captions': json.loads(row['captions']) if row['captions'] else None,
+            'post_type': row['post_type'],
+            'first_seen': row['first_seen'],
+            'updated_at': row['updated_at'],
+            'changed_at': row['changed_at']
+        }
+    
+    def save(self, url: str, data: Dict, captions: Optional[List[Dict]],
+             post_type: Optional[str], changed: bool) -> None:
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO snapshots (url, data, fingerprints, captions, post_type, "
+                "first_seen, updated_at, changed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET data = excluded.data, "
+                "fingerprints = excluded.fingerprints, captions = excluded.captions, "
+                "post_type = excluded.post_type, updated_at = excluded.updated_at, "
+                "changed_at = CASE WHEN ? THEN excluded.changed_at ELSE snapshots.changed_at END",
+                (url, json.dumps(data, default=str), json.dumps(fingerprints(data)),
+                 json.dumps(captions) if captions is not None else None, post_type,
+                 now, now, now, changed))
+    
+    def urls(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT url FROM snapshots ORDER BY url")]
+    
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ListingWatcher:
+    """Re-scrapes watched listings and re-captions only what changed"""
+    
+    def __init__(self, store: SnapshotStore = None, generator: CaptionGenerator = None,
+                 cache: HTTPCache = None, num_variations: int = 3):
+        """
+        Args:
+            store: Snapshot store (config.LISTING_SNAPSHOT_DB if omitted)
+            generator: Caption generator, created on first use if omitted
+            cache: Optional HTTP cache so unchanged pages revalidate cheaply
+            num_variations: Caption variations for a changed listing
+        """
+        self.store = store or SnapshotStore()
+        self._generator = generator
+        self.cache = cache
+        self.num_variations = num_variations
+    
+    @property
+    def generator(self) -> CaptionGenerator:
+        if self._generator is None:
+            self._generator = CaptionGenerator()
+        return self._generator
+    
+    def check(self, url: str, listing_data: Dict = None) -> Dict:
+        """
+        Compare a listing with its last snapshot and caption it if needed
+        
+        Args:
+            url: Listing URL
+            listing_data: A fresh extract_data() result (scraped if omitted)
+        
+        Returns:
+            Dictionary with 'url', 'status' (new, changed or unchanged),
+            'changes' (field -> old/new), 'post_type', 'captions' and
+            'recaptioned' (whether the caption generator was called)
+        """
+        if listing_data is None:
+            listing_data = scrape_listing(url, cache=self.cache)
+        
+        snapshot = self.store.get(url)
+        if snapshot is None:
+            status = STATUS_NEW
+            changes = {}
+            relevant = True
+            post_type = DEFAULT_POST_TYPE
+        else:
+            changes = diff(snapshot['data'], listing_data, snapshot['fingerprints'])
+            status = STATUS_CHANGED if changes else STATUS_UNCHANGED
+            relevant = any(field in CAPTION_FIELDS for field in changes) or not snapshot['captions']
+            # A price reduction is only news on the check that sees it; the
+            # next check re-captions to replace the reduction wording
+            post_type = PRICE_REDUCTION if is_price_drop(changes) else DEFAULT_POST_TYPE
+            relevant = relevant or snapshot['post_type'] == PRICE_REDUCTION
+        
+        captions = snapshot['captions'] if snapshot else None
+        if relevant:
+            with metrics.span('watch.recaption', post_type=post_type):
+                captions = self.generator.generate_captions(listing_data, post_type,
+                                                            self.num_variations)
+        
+        # The canned fallback is not kept, so the next check tries again
+        stored = None if captions == [FALLBACK_CAPTION] else captions
+        self.store.save(url, listing_data, stored, post_type, changed=status != STATUS_UNCHANGED)
+        return {
+            'url': url,
+            'status': status,
+            'changes': changes,
+            'post_type': post_type,
+            'captions': captions,
+            'recaptioned': relevant
+        }
+    
+    def check_many(self, urls: Iterable[str], max_concurrency: int = 8) -> Iterator[Dict]:
+        """
+        Re-scrape listings concurrently and check each one as it arrives
+        
+        Yields:
+            check() results, or {'url', 'error'} for listings that failed
+        """
+        for result in scrape_many(urls, max_concurrency=max_concurrency, cache=self.cache):
+            if result['error']:
+                yield {'url': result['url'], 'error': result['error']}
+                continue
+            try:
+                yield self.check(result['url'], result['data'])
+            except Exception as e:
+                yield {'url': result['url'], 'error': str(e)}
+
+
+# Example usage
+if __name__ == '__main__':
+    import sys
+    
+    watcher = ListingWatcher(cache=HTTPCache())
+    urls = sys.argv[1:] or watcher.store.urls()
+    for result in watcher.check_many(urls):
+        if 'error' in result:
+            print(f"{result['url']}: error {result['error']}")
+            continue
+        changed = ', '.join(result['changes']) or 'nothing'
+        print(f"{result['url']}: {result['status']} ({changed} changed), "
+              f"post type {result['post_type']}, re-captioned: {result['recaptioned']}")
@@ -0,0 +1,280 @@
+"""
+Pipeline Metrics
+Lightweight span tracer for the scrape -> caption pipeline with pluggable sinks
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Innermost open span for the current thread or asyncio task
+_current_span = contextvars.ContextVar('metrics_span', default=None)
+
+
+class Span:
+    """One timed stage; numeric counters added while it is open are kept on it"""
+    
+    __slots__ = ('tracer', 'name', 'attrs', 'counts', 'parent', 'start', 'duration', '_token')
+    
+    def __init__(self, tracer: 'Tracer', name: str, attrs: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.counts = {}
+        self.parent = None
+        self.start = 0.0
+        self.duration = 0.0
+        self._token = None
+    
+    def __enter__(self) -> 'Span':
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+    
+    def add(self, **counts) -> None:
+        """Increment numeric counters such as bytes or tokens"""
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+    
+    def set(self, **attrs) -> None:
+        """Attach descriptive attributes"""
+        self.attrs.update(attrs)
+    
+    def to_dict(self) -> Dict:
+        return {
+            'span': self.name,
+            'parent': self.parent.name if self.parent else None,
+            'seconds': round(self.duration, 6),
+            **self.attrs,
+            **self.counts
+        }
+
+
+class _NullSpan:
+    """Shared no-op span returned while metrics are disabled"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> '_NullSpan':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+    
+    def add(self, **counts) -> None:
+        pass
+    
+    def set(self, **attrs) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class LogSink:
+    """Writes one log line per finished span"""
+    
+    def __init__(self, log: logging.Logger = None, level: int = logging.INFO):
+        self.log = log or logger
+        self.level = level
+    
+    def emit(self, span: Span) -> None:
+        if not self.log.isEnabledFor(self.level):
+            return
+        fields = ' '.join(f"{key}={value}" for key, value in {**span.attrs, **span.counts}.items())
+        self.log.log(self.level, "span=%s ms=%.2f %s", span.name, span.duration * 1000, fields)
+    
+    def flush(self) -> None:
+        pass
+
+
+class JSONLinesSink:
+    """Appends each finished span as a JSON line"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def emit(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    
+    def flush(self) -> None:
+        pass
+
+
+class PrometheusSink:
+    """
+    Aggregates spans per name and renders the Prometheus text format
+    
+    With a path, flush() rewrites that file so it can be picked up by the
+    node exporter's textfile collector.
+    """
+    
+    def __init__(self, path: str = None, prefix: str = 'listing_pipeline'):
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._count = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._seconds = defaultdict(float)
+        self._counters = defaultdict(lambda: defaultdict(float))
+    
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            self._count[span.name] += 1
+            self._seconds[span.name] += span.duration
+            if 'error' in span.attrs:
+                self._errors[span.name] += 1
+            for key, value in span.counts.items():
+                self._counters[key][span.name] += value
+    
+    def render(self) -> str:
+        prefix = self.prefix
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_span_seconds Wall time spent in each pipeline stage",
+                f"# TYPE {prefix}_span_seconds summary"
+            ]
+            for name in sorted(self._count):
+                lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {self._count[name]}')
+                lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {self._seconds[name]:.6f}')
+            lines.append(f"# TYPE {prefix}_span_errors_total counter")
+            for name in sorted(self._count):
+                lines.append(f'{prefix}_span_errors_total{{span="{name}"}} {self._errors[name]}')
+            for key in sorted(self._counters):
+                lines.append(f"# TYPE {prefix}_{key}_total counter")
+                for name, value in sorted(self._counters[key].items()):
+                    lines.append(f'{prefix}_{key}_total{{span="{name}"}} {value:g}')
+        return '\n'.join(lines) + '\n'
+    
+    def flush(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, self.path)
+
+
+class Tracer:
+    """Creates spans and hands every finished span to the sinks"""
+    
+    def __init__(self, sinks: List):
+        self.sinks = list(sinks)
+    
+    def span(self, name: str, **attrs) -> Span:
+        return Span(self, name, attrs)
+    
+    def finish(self, span: Span) -> None:
+        for sink in self.sinks:
+            try:
+                sink.emit(span)
+            except Exception as e:
+                # Metrics must never break the pipeline
+                logger.warning("Metrics sink %s failed: %s", type(sink).__name__, e)
+    
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def span(name: str, **attrs):
+    """
+    Time a pipeline stage
+    
+    Usage:
+        with metrics.span('scrape.download') as s:
+            s.add(bytes=len(body))
+    
+    Returns the shared no-op span when metrics are disabled, so
+    instrumented code costs one function call and a global lookup.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, attrs)
+
+
+def add(**counts) -> None:
+    """Add counters (bytes, tokens) to the innermost open span, if any"""
+    if _tracer is None:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.add(**counts)
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def configure(sinks: List) -> Tracer:
+    """Enable metrics with the given sinks (replaces any previous tracer)"""
+    global _tracer
+    _tracer = Tracer(sinks)
+    return _tracer
+
+
+def disable() -> None:
+    global _tracer
+    if _tracer is not None:
+        _tracer.flush()
+    _tracer = None
+
+
+def flush() -> None:
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def sinks_from_config() -> List:
+    """Build sinks from METRICS_SINKS (comma-separated: log, json, prometheus)"""
+    sinks = []
+    for name in config.METRICS_SINKS:
+        if name == 'log':
+            sinks.append(LogSink())
+        elif name == 'json':
+            sinks.append(JSONLinesSink(config.METRICS_JSON_FILE))
+        elif name == 'prometheus':
+            sinks.append(PrometheusSink(config.METRICS_PROMETHEUS_FILE))
+        else:
+            raise ValueError(f"Unknown metrics sink: {name}")
+    return sinks
+
+
+if config.METRICS_SINKS:
+    configure(sinks_from_config())
@@ -0,0 +1,165 @@
+"""
+Model Router
+Picks the OpenAI model for each caption task and keeps rolling latency and
+error statistics per model, which also set the delay for hedged requests
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import config
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ModelStats:
+    """Latency and outcome of the latest requests to one model"""
+    
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.last_probe = 0.0
+        self.probing = False
+    
+    def record(self, seconds: float, ok: bool) -> None:
+        if self.probing:
+            self.probing = False
+            if ok:
+                # The model answered its probe: judge it on fresh requests again
+                self.outcomes.clear()
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+    
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    def percentile(self, pct: float) -> Optional[float]:
+        return _percentile(sorted(self.latencies), pct) if self.latencies else None
+
+
+class ModelRouter:
+    """
+    Routes single captions (and repairs of one variation) to the fast model
+    and full variation sets to the strong model
+    
+    A model whose recent error rate is above max_error_rate is skipped in
+    favour of the other one while it recovers. Every probe_interval seconds
+    one request is still sent to it (like a half-open circuit breaker); a
+    successful probe clears its error history so it takes traffic again.
+    """
+    
+    def __init__(self, strong_model: str = None, fast_model: str = None, window: int = None,
+                 hedge_percentile: float = None, hedge_min_samples: int = None,
+                 max_error_rate: float = None, probe_interval: float = None):
+        """
+        Args:
+            strong_model: Model for variation sets (config.OPENAI_MODEL if omitted)
+            fast_model: Model for single captions (config.OPENAI_FAST_MODEL if omitted)
+            window: Latest requests per model the statistics cover
+            hedge_percentile: Latency percentile after which a hedged second
+                request is sent; 0 disables hedging
+            hedge_min_samples: Successful requests a model needs before its
+                requests are hedged
+            max_error_rate: Recent error rate above which a model is avoided
+            probe_interval: Seconds between probe requests to an avoided model
+        """
+        self.strong_model = strong_model or config.OPENAI_MODEL
+        self.fast_model = fast_model or config.OPENAI_FAST_MODEL
+        self.window = window or config.OPENAI_ROUTER_WINDOW
+        self.hedge_percentile = (config.OPENAI_HEDGE_PERCENTILE if hedge_percentile is None
+                                 else hedge_percentile)
+        self.hedge_min_samples = (config.OPENAI_HEDGE_MIN_SAMPLES if hedge_min_samples is None
+                                  else hedge_min_samples)
+        self.max_error_rate = (config.OPENAI_ROUTER_MAX_ERROR_RATE if max_error_rate is None
+                               else max_error_rate)
+        self.probe_interval = (config.OPENAI_ROUTER_PROBE_INTERVAL if probe_interval is None
+                               else probe_interval)
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+    
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(self.window)
+        return stats
+    
+    def model_for(self, num_variations: int) -> str:
+        """Model a task is meant for, ignoring health (used for cache keys)"""
+        return self.fast_model if num_variations <= 1 else self.strong_model
+    
+    def choose(self, num_variations: int) -> str:
+        """Model to send a task to now"""
+        preferred = self.model_for(num_variations)
+        other = self.strong_model if preferred == self.fast_model else self.fast_model
+        if other == preferred:
+            return preferred
+        with self._lock:
+            stats = self._model_stats(preferred)
+            unhealthy = stats.error_rate() > self.max_error_rate
+            other_healthy = self._model_stats(other).error_rate() <= self.max_error_rate
+            if not (unhealthy and other_healthy):
+                return preferred
+            now = time.monotonic()
+            if now - stats.last_probe >= self.probe_interval:
+                # Probe the avoided model, otherwise its error rate never changes
+                stats.last_probe = now
+                stats.probing = True
+                return preferred
+        return other
+    
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """
+        Seconds to wait before hedging a request to this model, or None to
+        send a single request (hedging disabled or too few samples yet)
+        """
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            stats = self._model_stats(model)
+            if len(stats.latencies) < self.hedge_min_samples:
+                return None
+            return stats.percentile(self.hedge_percentile)
+    
+    def record(self, model: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._model_stats(model).record(seconds, ok)
+    
+    def record_hedge(self, model: str, won: bool) -> None:
+        """Count a hedged request and whether it answered before the original"""
+        with self._lock:
+            stats = self._model_stats(model)
+            stats.hedges += 1
+            stats.hedge_wins += int(won)
+    
+    def stats(self) -> Dict[str, Dict]:
+        """Rolling statistics per model"""
+        with self._lock:
+            snapshot = {}
+            for model, stats in self._stats.items():
+                latencies = sorted(stats.latencies)
+                entry = {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'error_rate': round(stats.error_rate(), 4),
+                    'hedges': stats.hedges,
+                    'hedge_wins': stats.hedge_wins
+                }
+                for pct in (50, 90, 99):
+                    entry[f'p{pct}_ms'] = (round(_percentile(latencies, pct) * 1000, 1)
+                                           if latencies else None)
+                snapshot[model] = entry
+            return snapshot
@@ -0,0 +1,330 @@
+"""
+Page Parsers
+HTML parser backends for ListingScraper. The lxml backend reads lxml's C
+tree directly; the BeautifulSoup backend builds the Python object model
+the scraper used before and is kept for compatibility. Both expose the
+same small element API (name, attrs, get(), get_text(), string, find_all())
+and produce the same page text, so extraction gives identical results.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EncodingDetector
+from lxml import etree
+
+import config
+
+
+PARSER_LXML = 'lxml'
+PARSER_BS4 = 'bs4'
+PARSERS = (PARSER_LXML, PARSER_BS4)
+
+# Tags whose strings BeautifulSoup gives their own type and leaves out of
+# get_text() on any other element (script and style bodies, templates and
+# ruby annotations)
+STRING_CONTAINERS = frozenset(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+# Tags inside which whitespace-only strings are kept as they are
+PRESERVE_WHITESPACE_TAGS = frozenset(HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS)
+# Attributes split into lists of tokens, per tag ('*' for every tag)
+LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_TOKENS = re.compile(r'\S+')
+
+# lxml gives script and style elements nothing but their text
+_RAW_TEXT_TAGS = ('script', 'style')
+# Tags that make the page text need the per-node checks
+_SPECIAL_TEXT_TAGS = tuple(sorted((STRING_CONTAINERS - set(_RAW_TEXT_TAGS)) | PRESERVE_WHITESPACE_TAGS))
+
+_CONTAINER_TEST = ' or '.join(f'ancestor::{name}' for name in sorted(STRING_CONTAINERS))
+_DOCUMENT_TEXT = etree.XPath(f'//text()[not({_CONTAINER_TEST})]')
+_PLAIN_DOCUMENT_TEXT = etree.XPath(f'//text()[not({" or ".join(f"parent::{name}" for name in _RAW_TEXT_TAGS)})]',
+                                   smart_strings=False)
+_ELEMENT_TEXT = etree.XPath(f'.//text()[not({_CONTAINER_TEST})]')
+_ALL_TEXT = etree.XPath('.//text()')
+
+
+def _collapse(node) -> str:
+    """
+    A text node as BeautifulSoup stores it: whitespace-only strings become
+    a single newline or space unless they are inside <pre> or <textarea>
+    """
+    if node.strip(_ASCII_SPACES):
+        return node
+    parent = node.getparent()
+    if node.is_tail:
+        parent = parent.getparent()
+    if parent is not None and (parent.tag in PRESERVE_WHITESPACE_TAGS or
+                               next(parent.iterancestors(*PRESERVE_WHITESPACE_TAGS), None) is not None):
+        return str(node)
+    return '\n' if '\n' in node else ' '
+
+
+def _collapse_plain(text: str) -> str:
+    """_collapse for a page without <pre> or <textarea>"""
+    if text.strip(_ASCII_SPACES):
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+@lru_cache(maxsize=None)
+def _list_attributes(tag: str) -> frozenset:
+    return frozenset(LIST_ATTRIBUTES['*'] + LIST_ATTRIBUTES.get(tag, []))
+
+
+def _innermost_container(node) -> Optional[str]:
+    """Tag of the closest string container around a text node"""
+    parent = node.getparent()
+    if node.is_tail:
+        parent = parent.getparent()
+    while parent is not None:
+        if parent.tag in STRING_CONTAINERS:
+            return parent.tag
+        parent = parent.getparent()
+    return None
+
+
+def _trailing_whitespace(content) -> str:
+    """The string BeautifulSoup keeps for whitespace after the closing </html> tag"""
+    tail = content[-1024:]
+    if isinstance(tail, bytes):
+        tail = tail.decode('latin-1')
+    end = tail.lower().rfind('</html')
+    if end == -1 or tail.find('>', end) == -1:
+        return ''
+    rest = tail[tail.find('>', end) + 1:]
+    if not rest or rest.strip(_ASCII_SPACES):
+        return ''
+    return '\n' if '\n' in rest else ' '
+
+
+def _join(strings, separator: str, strip: bool) -> str:
+    if strip:
+        strings = (text.strip() for text in strings)
+        return separator.join(text for text in strings if text)
+    return separator.join(strings)
+
+
+class LxmlElement:
+    """An lxml element behind the subset of BeautifulSoup's Tag API the scraper uses"""
+    
+    __slots__ = ('element', '_attrs')
+    
+    def __init__(self, element):
+        self.element = element
+        self._attrs = None
+    
+    @property
+    def name(self) -> str:
+        return self.element.tag
+    
+    @property
+    def attrs(self) -> Dict:
+        if self._attrs is None:
+            listed = _list_attributes(self.element.tag)
+            self._attrs = {attr: _TOKENS.findall(value) if attr in listed else value
+                           for attr, value in self.element.attrib.items()}
+        return self._attrs
+    
+    def get(self, key: str, default=None):
+        return self.attrs.get(key, default)
+    
+    def __getitem__(self, key: str):
+        return self.attrs[key]
+    
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LxmlElement) and other.element is self.element
+    
+    def __hash__(self) -> int:
+        return hash(self.element)
+    
+    def _strings(self) -> List:
+        if self.element.tag not in STRING_CONTAINERS:
+            return _ELEMENT_TEXT(self.element)
+        # A container's own get_text() returns the strings of its own kind
+        return [node for node in _ALL_TEXT(self.element)
+                if _innermost_container(node) == self.element.tag]
+    
+    def get_text(self, separator: str = '', strip: bool = False) -> str:
+        return _join((_collapse(node) for node in self._strings()), separator, strip)
+    
+    @property
+    def string(self) -> Optional[str]:
+        """The only string inside the element, as BeautifulSoup's Tag.string"""
+        element = self.element
+        children = len(element)
+        if not children:
+            return _collapse(_ALL_TEXT(element)[0]) if element.text else None
+        if children == 1 and not element.text and not element[0].tail:
+            child = element[0]
+            if not isinstance(child.tag, str):
+                # A lone comment or processing instruction
+                return child.text
+            return LxmlElement(child).string
+        return None
+    
+    def find_all(self, name: Optional[str] = None, attrs: Optional[Dict] = None) -> List['LxmlElement']:
+        """
+        Descendants with a tag name and/or attributes, in document order
+        
+        Attribute values may be True (present) or a string (equal).
+        """
+        found = []
+        for element in self.element.iterdescendants(name or etree.Element):
+            if not isinstance(element.tag, str):
+                continue
+            if attrs and not all(
+                    element.get(attr) is not None if wanted is True else element.get(attr) == wanted
+                    for attr, wanted in attrs.items()):
+                continue
+            found.append(LxmlElement(element))
+        return found
+
+
+class LxmlDocument:
+    """Page parsed with lxml.html; no Python object per node is built"""
+    
+    name = PARSER_LXML
+    
+    def __init__(self, root, roots: List = None, trailing_text: str = ''):
+        """
+        Args:
+            root: Root element of the tree
+            roots: Top-level elements when parsing was restricted (children of root)
+            trailing_text: Whitespace string after </html>, which
+                BeautifulSoup keeps at the document level but lxml's tree drops
+        """
+        self.root = root
+        self._roots = roots
+        self.trailing_text = trailing_text
+    
+    @classmethod
+    def parse(cls, content, keep: Callable = None) -> 'LxmlDocument':
+        if isinstance(content, str):
+            if content[:1] == '\N{BYTE ORDER MARK}':
+                content = content[1:]
+            # lxml refuses str input that starts with an <?xml encoding=...?>
+            # declaration, so hand it UTF-8 bytes and say so
+            content = content.encode('utf-8', 'surrogatepass')
+            parser = etree.HTMLParser(encoding='utf-8')
+        else:
+            # The encoding BeautifulSoup would pick for these bytes
+            detector = EncodingDetector(content, is_html=True)
+            parser = etree.HTMLParser(encoding=next(iter(detector.encodings), None))
+            content = detector.markup
+        root = etree.fromstring(content, parser) if content else None
+        if root is None:
+            # Nothing but whitespace or comments
+            return cls(etree.Element('document'), [])
+        if keep is None:
+            return cls(root, trailing_text=_trailing_whitespace(content))
+        return cls._restrict(root, keep)
+    
+    @classmethod
+    def _restrict(cls, root, keep: Callable) -> 'LxmlDocument':
+        """
+        Keep elements the predicate accepts, with their whole subtree, as
+        top-level elements (what a SoupStrainer keeps); other text is dropped
+        """
+        kept = []
+        stack = [root]
+        while stack:
+            element = stack.pop()
+            if not isinstance(element.tag, str):
+                continue
+            if keep(element.tag, dict(element.attrib)):
+                kept.append(element)
+            else:
+                stack.extend(reversed(element))
+        
+        document = etree.Element('document')
+        for element in kept:
+            element.tail = None
+            document.append(element)
+        return cls(document, kept)
+    
+    wrap = LxmlElement
+    
+    def _nodes(self) -> Iterator:
+        roots = self._roots if self._roots is not None else [self.root]
+        for root in roots:
+            yield from root.iter(etree.Element)
+    
+    def elements(self) -> Iterator[LxmlElement]:
+        """Every element in document order"""
+        return map(LxmlElement, self._nodes())
+    
+    def index_items(self) -> Iterator[tuple]:
+        """
+        (node, tag name, attribute items) for every element in document
+        order, without wrapping each one; list attributes are split
+        """
+        for element in self._nodes():
+            attrib = element.attrib
+            if not attrib:
+                yield element, element.tag, ()
+                continue
+            listed = _list_attributes(element.tag)
+            yield element, element.tag, [(attr, _TOKENS.findall(value) if attr in listed else value)
+                                         for attr, value in attrib.items()]
+    
+    def get_text(self) -> str:
+        if next(self.root.iter(*_SPECIAL_TEXT_TAGS), None) is None:
+            # Strings can only be left out for sitting directly in script or style
+            text = ''.join(map(_collapse_plain, _PLAIN_DOCUMENT_TEXT(self.root)))
+        else:
+            text = ''.join(_collapse(node) for node in _DOCUMENT_TEXT(self.root))
+        return text + self.trailing_text
+
+
+class SoupDocument:
+    """Page parsed into BeautifulSoup's object model"""
+    
+    name = PARSER_BS4
+    
+    def __init__(self, soup: BeautifulSoup):
+        self.soup = soup
+    
+    @classmethod
+    def parse(cls, content, keep: Callable = None) -> 'SoupDocument':
+        return cls(BeautifulSoup(content, 'lxml', parse_only=SoupStrainer(keep) if keep else None))
+    
+    @staticmethod
+    def wrap(element):
+        return element
+    
+    def elements(self) -> Iterator:
+        return iter(self.soup.find_all(True))
+    
+    def index_items(self) -> Iterator[tuple]:
+        for element in self.soup.find_all(True):
+            yield element, element.name, element.attrs.items()
+    
+    def get_text(self) -> str:
+        return self.soup.get_text()
+
+
+_DOCUMENTS = {PARSER_LXML: LxmlDocument, PARSER_BS4: SoupDocument}
+
+
+def parse_html(content, parser: str = None, keep: Callable = None):
+    """
+    Parse a page with one of the backends
+    
+    Args:
+        content: HTML as bytes (encoding detected as BeautifulSoup does) or str
+        parser: PARSER_LXML or PARSER_BS4 (config.HTML_PARSER if omitted)
+        keep: Optional predicate (tag name, attributes) restricting the
+            document to the elements it accepts and their contents
+    
+    Returns:
+        LxmlDocument or SoupDocument
+    """
+    parser = parser or config.HTML_PARSER
+    if parser not in _DOCUMENTS:
+        raise ValueError(f"Unknown HTML parser: {parser} (expected one of {', '.join(PARSERS)})")
+    return _DOCUMENTS[parser].parse(content, keep)
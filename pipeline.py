@@ -0,0 +1,432 @@
+"""
+Batch Listing Pipeline
+Streams listing URLs through scrape -> caption -> enqueue with bounded queues
+between the stages and a checkpoint file so interrupted runs can resume
+
+Usage:
+    python pipeline.py urls.txt
+    cat urls.txt | python pipeline.py - --post-type "Open House"
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from itertools import cycle
+from typing import Callable, Dict, Iterable, Optional
+
+import validators
+
+import config
+import metrics
+from ai_captions import FALLBACK_CAPTION, CaptionGenerator
+from http_cache import HTTPCache
+from listing_store import ListingStore
+from queue_store import QueueStore, get_queue_store
+from scraper import ListingScraper, create_session
+
+
+STAGE_SCRAPED = 'scraped'
+STAGE_CAPTIONED = 'captioned'
+STAGE_ENQUEUED = 'enqueued'
+STAGE_FAILED = 'failed'
+
+# Marks the end of a stage's input
+_STOP = object()
+
+
+class Checkpoint:
+    """
+    Append-only JSON-lines record of each URL's progress
+    
+    A line is written as soon as a URL finishes a stage, together with that
+    stage's output, so a restarted run can pick every URL up at the stage
+    after the last one it completed. The file also records a batch id that
+    stays the same across resumed runs.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Dict[str, Dict] = {}
+        self.batch = None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        complete = True
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    complete = line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of an interrupted write
+                        continue
+                    if 'url' not in record:
+                        self.batch = record.get('batch', self.batch)
+                        continue
+                    previous = self.state.get(record['url'], {})
+                    self.state[record['url']] = dict(previous, **record)
+        self._file = open(path, 'a', encoding='utf-8')
+        if not complete:
+            # Keep new records off the end of a partial line
+            self._file.write('\n')
+        if self.batch is None:
+            self.batch = uuid.uuid4().hex
+            self._file.write(json.dumps({'batch': self.batch}) + '\n')
+            self._file.flush()
+    
+    def get(self, url: str) -> Optional[Dict]:
+        return self.state.get(url)
+    
+    def record(self, url: str, stage: str, **fields) -> None:
+        record = dict(fields, url=url, stage=stage)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.state[url] = dict(self.state.get(url, {}), **record)
+            self._file.write(line + '\n')
+            self._file.flush()
+    
+    def close(self) -> None:
+        self._file.close()
+
+
+class BatchPipeline:
+    """Concurrent scrape, caption and enqueue stages connected by bounded queues"""
+    
+    def __init__(self, checkpoint: Checkpoint, generator: CaptionGenerator = None,
+                 store: QueueStore = None, post_type: str = "New Listing",
+                 num_variations: int = 3, agents: list = None,
+                 scrape_workers: int = 8, caption_workers: int = 4,
+                 queue_size: int = 32, cache: HTTPCache = None,
+                 schedule_start: float = None, schedule_interval: float = 0,
+                 retry_failed: bool = True, progress: Callable[[Counter], None] = None,
+                 listing_store: ListingStore = None, skip_processed: bool = False):
+        """
+        Args:
+            checkpoint: Progress file used to skip finished work
+            generator: Caption generator (created from config if omitted)
+            store: Post queue (the shared store if omitted)
+            post_type: Post type for every listing
+            num_variations: Caption variations per listing
+            agents: Agents assigned round-robin (config.AGENTS if omitted)
+            scrape_workers: Concurrent page downloads
+            caption_workers: Concurrent caption requests
+            queue_size: Capacity of each queue between stages; a full queue
+                pauses the stage feeding it
+            cache: Optional HTTP cache for listing pages
+            schedule_start: Epoch time of the first post (now if omitted)
+            schedule_interval: Seconds between consecutive posts
+            retry_failed: Retry URLs that failed in an earlier run
+            progress: Called with the running counts after each URL
+            listing_store: Columnar store that scraped listings and their
+                caption counts are appended to
+            skip_processed: Skip URLs the listing store already holds
+                captions for (from any earlier run)
+        """
+        self.checkpoint = checkpoint
+        self.generator = generator or CaptionGenerator()
+        self.store = store or get_queue_store()
+        self.post_type = post_type
+        self.num_variations = num_variations
+        self.scrape_workers = scrape_workers
+        self.caption_workers = caption_workers
+        self.queue_size = queue_size
+        self.cache = cache
+        self.schedule_start = time.time() if schedule_start is None else schedule_start
+        self.schedule_interval = schedule_interval
+        self.retry_failed = retry_failed
+        self.progress = progress
+        self.listing_store = listing_store
+        self.skip_processed = skip_processed and listing_store is not None
+        self.counts = Counter()
+        self._agents = cycle(agents or config.AGENTS)
+        self._themes = cycle(config.COLOR_THEMES)
+        self._scheduled = 0
+        self._counts_lock = threading.Lock()
+        self._session = create_session(pool_size=scrape_workers)
+    
+    def _count(self, outcome: str) -> None:
+        with self._counts_lock:
+            self.counts[outcome] += 1
+            counts = Counter(self.counts)
+        if self.progress:
+            try:
+                self.progress(counts)
+            except Exception:
+                # A broken progress display must not fail the URL being counted
+                pass
+    
+    def _failed(self, stage: str) -> Callable[[object, Exception], None]:
+        """Error handler for a stage: record the item's URL as failed at that stage"""
+        def handle(item, error: Exception) -> None:
+            url = item['url'] if isinstance(item, dict) else item
+            self.checkpoint.record(url, STAGE_FAILED, failed_stage=stage, error=str(error))
+            self._count('failed')
+        return handle
+    
+    def _scrape(self, url: str) -> Optional[Dict]:
+        try:
+            if not validators.url(url):
+                raise ValueError("Invalid URL provided")
+            with metrics.span('pipeline.scrape'):
+                data = ListingScraper(url, session=self._session, cache=self.cache).extract_data()
+        except Exception as e:
+            self.checkpoint.record(url, STAGE_FAILED, failed_stage=STAGE_SCRAPED, error=str(e))
+            self._count('failed')
+            return None
+        self.checkpoint.record(url, STAGE_SCRAPED, data=data)
+        if self.listing_store is not None:
+            self.listing_store.append(data)
+        return {'url': url, 'data': data}
+    
+    def _caption(self, item: Dict) -> Optional[Dict]:
+        url = item['url']
+        try:
+            with metrics.span('pipeline.caption'):
+                captions = self.generator.generate_captions(item['data'], self.post_type,
+                                                            self.num_variations)
+        except Exception as e:
+            self.checkpoint.record(url, STAGE_FAILED, failed_stage=STAGE_CAPTIONED, error=str(e))
+            self._count('failed')
+            return None
+        if captions == [FALLBACK_CAPTION]:
+            # Not a real caption: leave the URL to be captioned again on resume
+            self.checkpoint.record(url, STAGE_FAILED, failed_stage=STAGE_CAPTIONED,
+                                   error="No usable captions in the response")
+            self._count('failed')
+            return None
+        self.checkpoint.record(url, STAGE_CAPTIONED, captions=captions)
+        if self.listing_store is not None and not self.listing_store.mark_captioned(url, len(captions)):
+            # Resumed from an earlier checkpoint, before the store was in use
+            self.listing_store.append(item['data'], captions=len(captions))
+        return dict(item, captions=captions)
+    
+    def _enqueue(self, item: Dict) -> None:
+        url = item['url']
+        data = item['data']
+        try:
+            post_id = self.store.enqueue({
+                'listing_url': url,
+                'post_type': self.post_type,
+                'agent': next(self._agents),
+                'color_theme': next(self._themes),
+                'scheduled_at': self.schedule_start + self._scheduled * self.schedule_interval,
+                'listing': data,
+                'captions': item['captions'],
+                'images': data.get('images', []),
+                # A resumed run that lost the enqueued checkpoint line gets
+                # the existing post back instead of a duplicate
+                'batch_key': f"{self.checkpoint.batch}:{url}"
+            })
+            self._scheduled += 1
+        except Exception as e:
+            self.checkpoint.record(url, STAGE_FAILED, failed_stage=STAGE_ENQUEUED, error=str(e))
+            self._count('failed')
+            return
+        self.checkpoint.record(url, STAGE_ENQUEUED, post_id=post_id)
+        self._count('enqueued')
+    
+    def _feed(self, urls: Iterable[str], scrape_queue: queue.Queue,
+              caption_queue: queue.Queue, enqueue_queue: queue.Queue) -> None:
+        """Route each URL to the stage after the last one it completed"""
+        seen = set()
+        for url in urls:
+            url = url.strip()
+            if not url or url.startswith('#') or url in seen:
+                continue
+            seen.add(url)
+            
+            state = self.checkpoint.get(url) or {}
+            stage = state.get('stage')
+            if not state and self.skip_processed and self.listing_store.has(url, captioned=True):
+                self._count('already_processed')
+                continue
+            if stage == STAGE_FAILED:
+                if not self.retry_failed:
+                    self._count('skipped')
+                    continue
+                # Resume after the last stage that succeeded
+                stage = {STAGE_CAPTIONED: STAGE_SCRAPED,
+                         STAGE_ENQUEUED: STAGE_CAPTIONED}.get(state.get('failed_stage'))
+            
+            if stage == STAGE_ENQUEUED:
+                self._count('already_enqueued')
+            elif stage == STAGE_CAPTIONED and 'captions' in state:
+                self._count('resumed')
+                enqueue_queue.put({'url': url, 'data': state['data'], 'captions': state['captions']})
+            elif stage == STAGE_SCRAPED and 'data' in state:
+                self._count('resumed')
+                caption_queue.put({'url': url, 'data': state['data']})
+            else:
+                scrape_queue.put(url)
+    
+    def run(self, urls: Iterable[str]) -> Counter:
+        """
+        Process URLs until the input is exhausted
+        
+        Returns:
+            Counts of outcomes (enqueued, failed, resumed, already_enqueued,
+            already_processed, skipped)
+        """
+        scrape_queue = queue.Queue(maxsize=self.queue_size)
+        caption_queue = queue.Queue(maxsize=self.queue_size)
+        enqueue_queue = queue.Queue(maxsize=self.queue_size)
+        
+        stages = [
+            _Stage(self._scrape, scrape_queue, caption_queue, self.scrape_workers,
+                   self._failed(STAGE_SCRAPED)),
+            _Stage(self._caption, caption_queue, enqueue_queue, self.caption_workers,
+                   self._failed(STAGE_CAPTIONED)),
+            # One writer keeps the schedule order and agent rotation simple
+            _Stage(self._enqueue, enqueue_queue, None, 1, self._failed(STAGE_ENQUEUED))
+        ]
+        for stage, downstream in zip(stages, stages[1:] + [None]):
+            stage.start(downstream)
+        
+        try:
+            self._feed(urls, scrape_queue, caption_queue, enqueue_queue)
+        except BaseException:
+            # Interrupted: finished work is already checkpointed and the
+            # workers are daemon threads, so don't wait for them
+            self._session.close()
+            raise
+        
+        stages[0].stop()
+        for stage in stages:
+            stage.join()
+        self._session.close()
+        metrics.flush()
+        return self.counts
+
+
+class _Stage:
+    """A pool of worker threads reading one queue and writing the next"""
+    
+    def __init__(self, handle: Callable, source: queue.Queue,
+                 sink: Optional[queue.Queue], workers: int,
+                 on_error: Optional[Callable[[object, Exception], None]] = None):
+        self.handle = handle
+        self.on_error = on_error
+        self.source = source
+        self.sink = sink
+        self.workers = workers
+        self.downstream = None
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self._threads = []
+    
+    def start(self, downstream: Optional['_Stage']) -> None:
+        self.downstream = downstream
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def stop(self) -> None:
+        """Signal that no more input will arrive"""
+        for _ in range(self.workers):
+            self.source.put(_STOP)
+    
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+    
+    def _work(self) -> None:
+        try:
+            while True:
+                item = self.source.get()
+                if item is _STOP:
+                    break
+                try:
+                    result = self.handle(item)
+                except Exception as e:
+                    # One bad item must not take the worker (and the run) down
+                    if self.on_error:
+                        try:
+                            self.on_error(item, e)
+                        except Exception:
+                            pass
+                    continue
+                if result is not None and self.sink is not None:
+                    self.sink.put(result)
+        finally:
+            with self._lock:
+                self._remaining -= 1
+                last = self._remaining == 0
+            # The last worker out closes the next stage's input, even after an error
+            if last and self.downstream is not None:
+                self.downstream.stop()
+
+
+def _read_urls(path: str) -> Iterable[str]:
+    if path == '-':
+        yield from sys.stdin
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from f
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape, caption and queue listing URLs in bulk")
+    parser.add_argument('urls', help="File with one listing URL per line, or - for stdin")
+    parser.add_argument('--checkpoint', default=os.path.join(config.DATA_DIR, 'pipeline_checkpoint.jsonl'),
+                        help="Progress file; rerunning with the same file resumes the batch")
+    parser.add_argument('--post-type', default='New Listing', choices=config.POST_TYPES)
+    parser.add_argument('--variations', type=int, default=3)
+    parser.add_argument('--agent', action='append', choices=config.AGENTS,
+                        help="Assign posts to this agent (repeat for round-robin; default all agents)")
+    parser.add_argument('--scrape-workers', type=int, default=8)
+    parser.add_argument('--caption-workers', type=int, default=config.OPENAI_MAX_CONCURRENCY)
+    parser.add_argument('--queue-size', type=int, default=32)
+    parser.add_argument('--interval', type=float, default=0,
+                        help="Minutes between scheduled posts")
+    parser.add_argument('--no-retry-failed', action='store_true',
+                        help="Skip URLs that failed in an earlier run")
+    parser.add_argument('--cache', action='store_true', help="Use the HTTP page cache")
+    parser.add_argument('--store', action='store_true',
+                        help="Append scraped listings to the columnar listing store")
+    parser.add_argument('--skip-processed', action='store_true',
+                        help="Skip URLs the listing store already holds captions for (implies --store)")
+    args = parser.parse_args()
+    
+    def progress(counts: Counter) -> None:
+        done = sum(counts.values())
+        if done % 25 == 0:
+            print(f"{done} processed: {dict(counts)}", file=sys.stderr)
+    
+    checkpoint = Checkpoint(args.checkpoint)
+    pipeline = BatchPipeline(
+        checkpoint,
+        post_type=args.post_type,
+        num_variations=args.variations,
+        agents=args.agent,
+        scrape_workers=args.scrape_workers,
+        caption_workers=args.caption_workers,
+        queue_size=args.queue_size,
+        cache=HTTPCache() if args.cache else None,
+        schedule_interval=args.interval * 60,
+        retry_failed=not args.no_retry_failed,
+        progress=progress,
+        listing_store=ListingStore() if args.store or args.skip_processed else None,
+        skip_processed=args.skip_processed
+    )
+    try:
+        counts = pipeline.run(_read_urls(args.urls))
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with the same --checkpoint to resume", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        checkpoint.close()
+    
+    print(json.dumps(dict(counts), indent=2))
+
+
+if __name__ == '__main__':
+    main()
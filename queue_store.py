@@ -0,0 +1,380 @@
+"""
+Post Queue Store
+SQLite-backed queue of scheduled social posts with atomic claim/complete
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import config
+
+
+STATUS_PENDING = 'pending'
+STATUS_CLAIMED = 'claimed'
+STATUS_POSTED = 'posted'
+STATUS_FAILED = 'failed'
+
+# Post fields stored in their own columns; anything else goes in the payload
+COLUMNS = ('listing_url', 'post_type', 'agent', 'color_theme', 'status', 'scheduled_at',
+           'batch_key')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    listing_url TEXT,
+    post_type TEXT,
+    agent TEXT,
+    color_theme TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    scheduled_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT NOT NULL DEFAULT '{}',
+    batch_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_posts_status_scheduled ON posts (status, scheduled_at, id);
+CREATE INDEX IF NOT EXISTS idx_posts_agent_status_scheduled ON posts (agent, status, scheduled_at, id);
+CREATE INDEX IF NOT EXISTS idx_posts_scheduled ON posts (scheduled_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _timestamp(value) -> float:
+    """Accept epoch seconds, datetimes or ISO 8601 strings"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+class QueueStore:
+    """
+    Post queue in a SQLite database (WAL mode)
+    
+    Every operation is a single transaction, so concurrent workers and
+    processes never lose updates, and claim hands each post to exactly one
+    worker. Claims use the (status, scheduled_at) index, so their cost does
+    not grow with the size of the queue.
+    """
+    
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: Database file (config.QUEUE_DB if omitted)
+        """
+        self.path = path or config.QUEUE_DB
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+        with self._transaction() as conn:
+            # Databases created before batch keys existed
+            if 'batch_key' not in {row['name'] for row in conn.execute("PRAGMA table_info(posts)")}:
+                conn.execute("ALTER TABLE posts ADD COLUMN batch_key TEXT")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_batch_key ON posts (batch_key) "
+                         "WHERE batch_key IS NOT NULL")
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _transaction(self):
+        return _Transaction(self._connection())
+    
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _row(self, post: Dict, now: float) -> tuple:
+        payload = {key: value for key, value in post.items()
+                   if key not in COLUMNS and key != 'id'}
+        return (
+            post.get('listing_url') or post.get('url'),
+            post.get('post_type'),
+            post.get('agent'),
+            post.get('color_theme'),
+            post.get('status') or STATUS_PENDING,
+            _timestamp(post.get('scheduled_at')),
+            now,
+            now,
+            json.dumps(payload, default=str),
+            post.get('batch_key')
+        )
+    
+    def enqueue(self, post: Dict) -> int:
+        """
+        Add a post to the queue
+        
+        Args:
+            post: Post dictionary; listing_url, post_type, agent,
+                color_theme, status and scheduled_at (epoch, datetime or
+                ISO string, default now) are indexed columns, other keys
+                (captions, images, listing data) are kept as JSON. A post
+                with a batch_key is only added once; enqueueing the same
+                key again returns the existing post's id
+        
+        Returns:
+            The post id
+        """
+        return self.enqueue_many([post])[0]
+    
+    def enqueue_many(self, posts: Iterable[Dict]) -> List[int]:
+        """Add several posts in one transaction"""
+        with self._transaction() as conn:
+            return self._insert(conn, posts)
+    
+    def _insert(self, conn: sqlite3.Connection, posts: Iterable[Dict]) -> List[int]:
+        """Insert posts inside an open transaction"""
+        now = time.time()
+        ids = []
+        for post in posts:
+            if post.get('batch_key') is not None:
+                row = conn.execute("SELECT id FROM posts WHERE batch_key = ?",
+                                   (post['batch_key'],)).fetchone()
+                if row is not None:
+                    ids.append(row['id'])
+                    continue
+            cursor = conn.execute(
+                "INSERT INTO posts (listing_url, post_type, agent, color_theme, status, "
+                "scheduled_at, created_at, updated_at, payload, batch_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(post, now))
+            ids.append(cursor.lastrowid)
+        return ids
+    
+    def claim(self, worker: str, agent: str = None, now: float = None) -> Optional[Dict]:
+        """
+        Atomically take the next due post
+        
+        Args:
+            worker: Name recorded on the claimed post
+            agent: Only claim posts for this agent
+            now: Claim posts scheduled at or before this time (default now)
+        
+        Returns:
+            The claimed post, or None if nothing is due
+        """
+        now = time.time() if now is None else now
+        agent_filter = "AND agent = ? " if agent is not None else ""
+        params = [STATUS_PENDING] + ([agent] if agent is not None else []) + [now]
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE posts SET status = ?, claimed_by = ?, claimed_at = ?, updated_at = ?, "
+                "attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM posts WHERE status = ? " + agent_filter +
+                "AND scheduled_at <= ? ORDER BY scheduled_at, id LIMIT 1) "
+                "RETURNING *",
+                [STATUS_CLAIMED, worker, now, now] + params).fetchone()
+        return _post(row) if row else None
+    
+    def complete(self, post_id: int, worker: str = None, **updates) -> bool:
+        """
+        Mark a claimed post as posted
+        
+        Args:
+            post_id: Post id from claim
+            worker: If given, only complete when this worker holds the claim
+            updates: Extra payload fields to store (e.g. meta_post_id)
+        
+        Returns:
+            True if the post was completed, False if it was not claimed
+            (or is claimed by another worker)
+        """
+        return self._finish(post_id, worker, STATUS_POSTED, None, None, updates)
+    
+    def fail(self, post_id: int, error: str, worker: str = None,
+             retry_at: float = None) -> bool:
+        """
+        Record a failed attempt; the post is rescheduled when retry_at is given
+        
+        Returns:
+            True if the claimed post was updated
+        """
+        status = STATUS_PENDING if retry_at is not None else STATUS_FAILED
+        return self._finish(post_id, worker, status, error, retry_at, {})
+    
+    def _finish(self, post_id: int, worker: Optional[str], status: str,
+                error: Optional[str], retry_at: Optional[float], updates: Dict) -> bool:
+        now = time.time()
+        worker_filter = " AND claimed_by = ?" if worker is not None else ""
+        params = [post_id, STATUS_CLAIMED] + ([worker] if worker is not None else [])
+        with self._transaction() as conn:
+            row = conn.execute("SELECT payload FROM posts WHERE id = ? AND status = ?" + worker_filter,
+                               params).fetchone()
+            if row is None:
+                return False
+            payload = row['payload']
+            if updates:
+                payload = json.dumps(dict(json.loads(payload), **updates), default=str)
+            scheduled = "scheduled_at = ?, " if retry_at is not None else ""
+            conn.execute(
+                "UPDATE posts SET status = ?, error = ?, payload = ?, updated_at = ?, " + scheduled +
+                "claimed_by = NULL WHERE id = ?",
+                [status, error, payload, now] + ([_timestamp(retry_at)] if retry_at is not None else []) +
+                [post_id])
+        return True
+    
+    def requeue_stale(self, timeout: float) -> int:
+        """
+        Return posts claimed more than timeout seconds ago to the queue
+        (their worker is assumed to have died)
+        
+        Returns:
+            Number of posts requeued
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE posts SET status = ?, claimed_by = NULL, updated_at = ? "
+                "WHERE status = ? AND claimed_at < ?",
+                (STATUS_PENDING, now, STATUS_CLAIMED, now - timeout))
+        return cursor.rowcount
+    
+    def get(self, post_id: int) -> Optional[Dict]:
+        row = self._connection().execute("SELECT * FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return _post(row) if row else None
+    
+    def list(self, status: str = None, agent: str = None, limit: int = 100,
+             offset: int = 0) -> List[Dict]:
+        """Posts in schedule order, optionally filtered by status and agent"""
+        clauses = []
+        params = []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if agent is not None:
+            clauses.append("agent = ?")
+            params.append(agent)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT * FROM posts {where}ORDER BY scheduled_at, id LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+        return [_post(row) for row in rows]
+    
+    def counts(self, agent: str = None) -> Dict[str, int]:
+        """Number of posts per status"""
+        if agent is None:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM posts GROUP BY status").fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM posts WHERE agent = ? GROUP BY status",
+                (agent,)).fetchall()
+        return {status: count for status, count in rows}
+    
+    def migrate_from_json(self, path: str = None) -> int:
+        """
+        Import posts from the old queue.json file
+        
+        The import is recorded in the database in the same transaction, so
+        it runs only once even if several processes start together; the
+        file is then renamed to '<path>.migrated'.
+        
+        Args:
+            path: JSON queue file (config.QUEUE_FILE if omitted)
+        
+        Returns:
+            Number of posts imported
+        """
+        path = path or config.QUEUE_FILE
+        if not os.path.exists(path):
+            return 0
+        
+        key = f"migrated:{os.path.abspath(path)}"
+        imported = 0
+        # The import is recorded in the same transaction, so a crash before
+        # the rename or a second process can't import the file twice
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone() is None:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    # Migrated and renamed by another process meanwhile
+                    return 0
+                if isinstance(data, dict):
+                    data = data.get('queue') or data.get('posts') or []
+                
+                posts = []
+                for item in data:
+                    post = dict(item)
+                    post.pop('id', None)
+                    if 'scheduled_at' not in post:
+                        post['scheduled_at'] = (post.pop('scheduled_time', None) or
+                                                post.pop('scheduled_for', None) or
+                                                post.get('created_at'))
+                    posts.append(post)
+                
+                imported = len(self._insert(conn, posts))
+                conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)",
+                             (key, str(time.time())))
+        try:
+            os.replace(path, f"{path}.migrated")
+        except FileNotFoundError:
+            pass
+        return imported
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+    
+    def __enter__(self) -> sqlite3.Connection:
+        # Take the write lock up front so read-then-write can't deadlock
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+def _post(row: sqlite3.Row) -> Dict:
+    post = json.loads(row['payload'])
+    post.update({key: row[key] for key in row.keys() if key != 'payload'})
+    return post
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_queue_store() -> QueueStore:
+    """Shared store at config.QUEUE_DB, importing queue.json on first use"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            store = QueueStore()
+            store.migrate_from_json()
+            _default_store = store
+    return _default_store
@@ -0,0 +1,87 @@
+"""
+Rate Limiter
+Token-bucket limits on requests and tokens per minute for OpenAI calls
+"""
+
+import asyncio
+import random
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Bucket refilled continuously at a per-minute rate"""
+    
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay_for(self, amount: float) -> float:
+        """Seconds until the bucket holds the amount (0 if it already does)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+    
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the server reported a rate limit"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """Limits both requests per minute and estimated tokens per minute"""
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+    
+    async def acquire(self, tokens: float) -> None:
+        """
+        Wait until one request with the estimated token count may be sent
+        
+        Args:
+            tokens: Estimated prompt plus completion tokens for the request
+        """
+        while True:
+            delay = max(self.requests.delay_for(1), self.tokens.delay_for(tokens))
+            if delay <= 0:
+                # No await between the check and consume, so this is atomic
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+                return
+            await asyncio.sleep(delay)
+    
+    def penalize(self) -> None:
+        """Back off all callers after the server returned a 429"""
+        self.requests.drain()
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def decorrelated_jitter(previous: float, base: float = 0.5, cap: float = 20.0) -> float:
+    """
+    Decorrelated-jitter backoff: the next delay is drawn between base and
+    three times the previous delay, so concurrent retries spread out
+    
+    Args:
+        previous: Delay before the last retry (base for the first retry)
+        base: Smallest delay in seconds
+        cap: Largest delay in seconds
+    """
+    return min(cap, random.uniform(base, max(base, previous * 3)))
@@ -4,53 +4,530 @@ Extracts property details and images from real estate listing URLs
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 import re
 import json
-from typing import Dict, List, Optional
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
 import validators
 
+import metrics
+from host_control import FetchError, HostController, get_default_controller
+from http_cache import HTTPCache
+from keywords import get_default_matcher
+from page_parsers import parse_html
+from structured_data import from_json_ld, from_microdata, from_page_state, parse_json
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# Streaming fetch settings
+STREAM_CHUNK_SIZE = 64 * 1024
+# Listing content sits before these markers, so reading can stop once one arrives
+STREAM_STOP_MARKERS = (b'<footer', b'</main>')
+# Pages showing these were rendered from embedded page state, which portals
+# usually put after the footer; reading goes on until that script has closed
+STREAM_STATE_HINTS = (b'id="__next"', b'/_next/')
+STREAM_STATE_START = b'__next_data__'
+STREAM_STATE_END = b'</script>'
+
+# Fields returned by extract_data, each produced by the matching _extract_* method
+LISTING_FIELDS = ('title', 'price', 'address', 'bedrooms', 'bathrooms', 'square_feet',
+                  'description', 'images', 'property_type', 'features')
+
+# Image URLs returned per listing (one carousel)
+MAX_IMAGES = 10
+
+# Field sources reported in ListingScraper.field_sources
+SOURCE_JSON_LD = 'json-ld'
+SOURCE_PAGE_STATE = 'page-state'
+SOURCE_MICRODATA = 'microdata'
+SOURCE_HEURISTIC = 'heuristic'
+
+# Embedded front-end state blobs read by the structured-data tier
+PAGE_STATE_IDS = ('__NEXT_DATA__',)
+
+# Microdata item types describing a listing
+MICRODATA_TYPES = re.compile(r'schema\.org/(?:RealEstateListing|Offer|Product|Residence|'
+                             r'Accommodation|House|SingleFamilyResidence|Apartment)\b')
+
+# Tags and attribute keywords kept when parsing is restricted
+RESTRICTED_TAGS = frozenset(['title', 'meta', 'img', 'h1', 'h2', 'h3'])
+RESTRICTED_KEYWORDS = ('price', 'address', 'bed', 'bath', 'description', 'detail',
+                       'feature', 'fact', 'spec')
+RESTRICTED_ATTRIBUTES = ('class', 'id', 'itemprop', 'data-testid')
+
+# Page text patterns as (key, regex, case_insensitive, anchor); each field
+# tries its keys in order. Case-insensitive patterns run against the
+# lowercased text, which is much cheaper than re.I over the original text.
+# Patterns that begin with a number are anchored to the starts of digit runs
+# ('digits') or digit/comma runs ('number') and evaluated together in one
+# pass over the numbers on the page; the rest are plain searches.
+TEXT_PATTERNS = [
+    ('price:0', r'\$[\d,]+', False, None),
+    ('price:1', r'Price[:\s]*\$?[\d,]+', False, None),
+    ('bedrooms:0', r'(\d+)\s*(?:bed|bd|bedroom)', True, 'digits'),
+    ('bedrooms:1', r'(?:bed|bd|bedroom)[:\s]*(\d+)', True, None),
+    ('bathrooms:0', r'(\d+\.?\d*)\s*(?:bath|ba|bathroom)', True, 'digits'),
+    ('bathrooms:1', r'(?:bath|ba|bathroom)[:\s]*(\d+\.?\d*)', True, None),
+    ('square_feet:0', r'([\d,]*\d[\d,]*)\s*(?:sq\.?\s*ft|sqft|square feet)', True, 'number'),
+    ('square_feet:1', r'(?:sq\.?\s*ft|sqft|square feet)[:\s]*([\d,]+)', True, None),
+]
+
+_NUMBER_RUN = re.compile(r'[\d,]*\d[\d,]*')
+_DIGIT_RUN = re.compile(r'\d+')
+
+
+def _compile_patterns(anchor: Optional[str]) -> List:
+    return [
+        (key, re.compile(regex), case_insensitive)
+        for key, regex, case_insensitive, pattern_anchor in TEXT_PATTERNS
+        if pattern_anchor == anchor
+    ]
+
+
+_SEARCH_PATTERNS = _compile_patterns(None)
+_DIGIT_PATTERNS = _compile_patterns('digits')
+_NUMBER_PATTERNS = _compile_patterns('number')
+
+
+def _scan_numbers(lowered: str, matches: Dict) -> None:
+    """
+    Evaluate every number-led pattern in one pass over the numbers in the text
+    
+    A greedy number-led pattern that fails at the start of a run also fails
+    at every later position inside it, so trying run starts only finds the
+    same leftmost match that re.search() would.
+    """
+    remaining = len(_DIGIT_PATTERNS) + len(_NUMBER_PATTERNS)
+    for run in _NUMBER_RUN.finditer(lowered):
+        for key, pattern, _ in _NUMBER_PATTERNS:
+            if key not in matches:
+                match = pattern.match(lowered, run.start())
+                if match:
+                    matches[key] = match
+                    remaining -= 1
+        for digits in _DIGIT_RUN.finditer(lowered, run.start(), run.end()):
+            for key, pattern, _ in _DIGIT_PATTERNS:
+                if key not in matches:
+                    match = pattern.match(lowered, digits.start())
+                    if match:
+                        matches[key] = match
+                        remaining -= 1
+        if not remaining:
+            break
+
+
+def analyze_text(text: str) -> Dict:
+    """
+    Run every numeric pattern and keyword check over the page text once
+    
+    Args:
+        text: Full page text
+        
+    Returns:
+        Dictionary with 'matches' (pattern key -> first match),
+        'property_types' and 'features' (vocabulary names found in the
+        text, most mentioned first)
+    """
+    lowered = text.lower()
+    matches = {}
+    for key, pattern, case_insensitive in _SEARCH_PATTERNS:
+        match = pattern.search(lowered if case_insensitive else text)
+        if match:
+            matches[key] = match
+    _scan_numbers(lowered, matches)
+    keywords = get_default_matcher().scan(lowered, lowercase=False,
+                                          categories=['property_types', 'features'])
+    
+    return {
+        'matches': matches,
+        'property_types': [entry['name'] for entry in keywords['property_types']],
+        'features': [entry['name'] for entry in keywords['features']]
+    }
+
+
+_PRICE_AMOUNT = re.compile(r'(\d[\d,\s]*(?:\.\d+)?)\s*([km])?\b', re.I)
+_PRICE_MULTIPLIERS = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_price(price) -> Optional[float]:
+    """
+    Numeric amount of an extracted price
+    
+    Args:
+        price: Price as returned by the scraper, e.g. '$689,000',
+            'R 2 450 000' or '$1.2M' (numbers are returned unchanged)
+        
+    Returns:
+        The amount, or None when the text holds no price
+        (e.g. 'Price not listed')
+    """
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        return float(price)
+    if not isinstance(price, str):
+        return None
+    match = _PRICE_AMOUNT.search(price)
+    if not match:
+        return None
+    amount = float(re.sub(r'[,\s]', '', match.group(1)))
+    suffix = (match.group(2) or '').lower()
+    return amount * _PRICE_MULTIPLIERS.get(suffix, 1)
+
+
+def _keep_listing_element(name: str, attrs: Dict) -> bool:
+    """Decide during parsing whether an element can hold listing data"""
+    if name in RESTRICTED_TAGS:
+        return True
+    if name == 'script':
+        # Structured data blocks; other scripts are never needed
+        return ((attrs.get('type') or '').lower() == 'application/ld+json' or
+                attrs.get('id') in PAGE_STATE_IDS)
+    if 'itemtype' in attrs or 'itemprop' in attrs:
+        return True
+    for attr in RESTRICTED_ATTRIBUTES:
+        value = attrs.get(attr)
+        if value:
+            value = ' '.join(value) if isinstance(value, list) else value
+            value = value.lower()
+            if any(keyword in value for keyword in RESTRICTED_KEYWORDS):
+                return True
+    return False
+
+
+def read_limited(response: requests.Response, max_bytes: Optional[int] = None,
+                 stop_markers: Iterable[bytes] = STREAM_STOP_MARKERS,
+                 state_hints: Iterable[bytes] = STREAM_STATE_HINTS) -> tuple:
+    """
+    Read a streamed response in chunks under a byte budget
+    
+    Args:
+        response: Response opened with stream=True
+        max_bytes: Maximum number of bytes to read (None for no limit)
+        stop_markers: Byte strings after which the rest of the page is not needed
+        state_hints: Byte strings showing the page carries a page-state
+            script; on such pages the stop markers only end reading once
+            that script has been read in full
+        
+    Returns:
+        Tuple of (body bytes, whether the body was cut short)
+    """
+    markers = [marker.lower() for marker in stop_markers]
+    hints = [hint.lower() for hint in state_hints]
+    overlap = max((len(marker) for marker in markers + hints +
+                   [STREAM_STATE_START, STREAM_STATE_END]), default=1) - 1
+    chunks = []
+    size = 0
+    tail = b''
+    truncated = False
+    stop_seen = False
+    has_state = False
+    # None until the state script starts, then False until it has closed
+    state_read = None
+    
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            if max_bytes is not None and size + len(chunk) >= max_bytes:
+                chunks.append(chunk[:max_bytes - size])
+                truncated = size + len(chunk) > max_bytes
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            
+            # Check chunk boundaries too, markers may be split across chunks
+            window = (tail + chunk).lower()
+            has_state = has_state or any(hint in window for hint in hints)
+            if not state_read:
+                start = 0
+                if state_read is None:
+                    start = window.find(STREAM_STATE_START)
+                    if start != -1:
+                        has_state = True
+                        state_read = False
+                if state_read is False and window.find(STREAM_STATE_END, start) != -1:
+                    state_read = True
+            stop_seen = stop_seen or any(marker in window for marker in markers)
+            if stop_seen and (not has_state or state_read):
+                truncated = True
+                break
+            tail = window[-overlap:] if overlap else b''
+    finally:
+        response.close()
+    
+    return b''.join(chunks), truncated
+
+
+class PageIndex:
+    """
+    Lookup index over a parsed page, built in a single traversal
+    
+    Maps tag names and the attributes the extractors query (meta property
+    and name, itemprop, itemtype, id, data-testid and class tokens) to elements in
+    document order. Lookups accept the same selectors as BeautifulSoup's
+    find() and return the same element, but only test the distinct values
+    of one attribute instead of walking every node. Works over any
+    page_parsers document.
+    """
+    
+    ATTRIBUTES = frozenset(['property', 'name', 'itemprop', 'itemtype', 'id', 'data-testid', 'class'])
+    
+    def __init__(self, document):
+        self.tags = defaultdict(list)
+        # attribute -> value -> [(document order, element)]
+        self.values = {attr: defaultdict(list) for attr in self.ATTRIBUTES}
+        # Elements are indexed as the backend's nodes and wrapped when returned
+        self._wrap = document.wrap
+        
+        for order, (element, name, attrs) in enumerate(document.index_items()):
+            self.tags[name].append(element)
+            for attr, value in attrs:
+                if attr not in self.ATTRIBUTES:
+                    continue
+                if isinstance(value, list):
+                    # Multi-valued attributes match per token or as a whole
+                    keys = set(value)
+                    keys.add(' '.join(value))
+                else:
+                    keys = (value,)
+                for key in keys:
+                    self.values[attr][key].append((order, element))
+    
+    def find(self, name: Optional[str] = None, attrs: Optional[Dict] = None, **kwargs):
+        """
+        Return the first element matching a tag name and/or one attribute
+        
+        Args:
+            name: Optional tag name the element must have
+            attrs: Single attribute selector; the value may be a string
+                (exact match) or a compiled regex (searched)
+            **kwargs: Attribute selector given as a keyword argument
+            
+        Returns:
+            First matching element in document order, or None
+        """
+        selector = dict(attrs or {}, **kwargs)
+        if not selector:
+            elements = self.tags.get(name)
+            return self._wrap(elements[0]) if elements else None
+        if len(selector) > 1:
+            raise ValueError("PageIndex.find supports a single attribute selector")
+        
+        (attr, wanted), = selector.items()
+        if isinstance(wanted, re.Pattern):
+            candidates = [entries for value, entries in self.values[attr].items()
+                          if wanted.search(value)]
+        else:
+            entries = self.values[attr].get(wanted)
+            candidates = [entries] if entries else []
+        
+        best = None
+        for entries in candidates:
+            for order, element in entries:
+                if name is None or self._wrap(element).name == name:
+                    if best is None or order < best[0]:
+                        best = (order, element)
+                    break
+        return self._wrap(best[1]) if best else None
+    
+    def find_all(self, name: str) -> List:
+        """Return all elements with a tag name in document order"""
+        return [self._wrap(element) for element in self.tags.get(name, [])]
+
 
 class ListingScraper:
     """Scrapes real estate listing data from URLs"""
     
-    def __init__(self, url: str):
+    def __init__(self, url: str, session: Optional[requests.Session] = None,
+                 cache: Optional[HTTPCache] = None, stream: bool = False,
+                 max_bytes: Optional[int] = None, restrict_parse: bool = False,
+                 parser: Optional[str] = None, controller: Optional[HostController] = None):
+        """
+        Args:
+            url: Listing URL
+            session: Optional pooled session shared between scrapers
+            cache: Optional HTTP cache for the page
+            stream: Read the page in chunks and stop once the listing
+                content has arrived
+            max_bytes: Byte budget for the page body (implies streaming)
+            restrict_parse: Only build the tree for elements that can hold
+                listing data (head meta, images, headings, detail containers)
+            parser: HTML parser backend, 'lxml' or 'bs4' (config.HTML_PARSER
+                if omitted); both extract the same data
+            controller: Per-host concurrency, retries and circuit breakers
+                for the request (the process-wide controller if omitted)
+        """
         self.url = url
-        self.soup = None
+        self.session = session
+        self.cache = cache
+        self.stream = stream or max_bytes is not None
+        self.max_bytes = max_bytes
+        self.restrict_parse = restrict_parse
+        self.parser = parser
+        self.controller = controller or get_default_controller()
+        self.document = None
         self.data = {}
-        
+        self._page_text = None
+        self._text_analysis = None
+        self._index = None
+        self._structured = None
+        # Where each extracted field came from (structured source or heuristic)
+        self.field_sources = {}
+        
+    def load_html(self, content) -> None:
+        """Parse raw HTML and reset any per-page analysis caches"""
+        keep = _keep_listing_element if self.restrict_parse else None
+        with metrics.span('scrape.parse', bytes=len(content)) as span:
+            self.document = parse_html(content, self.parser, keep)
+            span.set(parser=self.document.name)
+        self._page_text = None
+        self._text_analysis = None
+        self._index = None
+        self._structured = None
+    
+    @property
+    def index(self) -> PageIndex:
+        """Attribute index answering every selector lookup, built once"""
+        if self._index is None:
+            with metrics.span('scrape.index'):
+                self._index = PageIndex(self.document)
+        return self._index
+    
+    @property
+    def page_text(self) -> str:
+        """Full page text, serialized once and cached"""
+        if self._page_text is None:
+            self._page_text = self.document.get_text()
+        return self._page_text
+    
+    @property
+    def text_analysis(self) -> Dict:
+        """Pattern and keyword results shared by all text-based extractors"""
+        if self._text_analysis is None:
+            with metrics.span('scrape.text_analysis'):
+                self._text_analysis = analyze_text(self.page_text)
+        return self._text_analysis
+    
+    @property
+    def structured_data(self) -> Dict:
+        """Fields published as JSON-LD, page state or microdata, read once"""
+        if self._structured is None:
+            with metrics.span('scrape.structured_data'):
+                self._structured = self._read_structured_data()
+        return self._structured
+    
+    def _read_structured_data(self) -> Dict:
+        """
+        Collect listing fields from the page's structured data
+        
+        Sources are tried from most to least reliable; the first source to
+        provide a field wins.
+        
+        Returns:
+            Mapping of field name to (value, source)
+        """
+        fields = {}
+        
+        def merge(found: Dict, source: str) -> None:
+            for field, value in found.items():
+                if field == 'images':
+                    value = [src for src in value if validators.url(src)][:MAX_IMAGES]
+                    if not value:
+                        continue
+                fields.setdefault(field, (value, source))
+        
+        documents = []
+        for script in self.index.find_all('script'):
+            if (script.get('type') or '').lower() == 'application/ld+json':
+                document = parse_json(script.string)
+                if document is not None:
+                    documents.append(document)
+        if documents:
+            merge(from_json_ld(documents, self.url), SOURCE_JSON_LD)
+        
+        for state_id in PAGE_STATE_IDS:
+            script = self.index.find('script', id=state_id)
+            if script:
+                state = parse_json(script.string)
+                if state is not None:
+                    merge(from_page_state(state, self.url), SOURCE_PAGE_STATE)
+        
+        item = self.index.find(attrs={'itemtype': MICRODATA_TYPES})
+        if item:
+            merge(from_microdata(item, self.url), SOURCE_MICRODATA)
+        
+        return fields
+    
+    def _first_text_match(self, field: str) -> Optional[re.Match]:
+        """Return the match of the first pattern for a field that matched"""
+        matches = self.text_analysis['matches']
+        for key, *_ in TEXT_PATTERNS:
+            if key.startswith(field + ':') and key in matches:
+                return matches[key]
+        return None
+    
+    def download(self) -> bytes:
+        """Download the raw HTML of the listing page"""
+        with metrics.span('scrape.download') as span:
+            content = self._download()
+            span.add(bytes=len(content))
+        return content
+    
+    def _download(self) -> bytes:
+        read_body = self._read_body if self.stream else None
+        # Reuse a pooled keep-alive session when one is provided; every
+        # request goes through the host's limits, retries and breaker
+        http = self.controller.bind(self.session or requests)
+        timeout = self.controller.timeout(self.url)
+        if self.cache:
+            return self.cache.fetch(self.url, session=http, headers=DEFAULT_HEADERS,
+                                    timeout=timeout, read_body=read_body)
+        
+        response = http.get(self.url, headers=DEFAULT_HEADERS, timeout=timeout, stream=self.stream)
+        if read_body:
+            return read_body(response)[0]
+        return response.content
+    
+    def _read_body(self, response: requests.Response) -> tuple:
+        return read_limited(response, self.max_bytes)
+    
     def fetch_page(self) -> bool:
         """Fetch the HTML content of the listing page"""
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(self.url, headers=headers, timeout=10)
-            response.raise_for_status()
-            self.soup = BeautifulSoup(response.content, 'lxml')
+            with metrics.span('scrape.fetch_page'):
+                self.load_html(self.download())
             return True
+        except FetchError:
+            raise
         except Exception as e:
             raise Exception(f"Failed to fetch page: {str(e)}")
     
     def extract_data(self) -> Dict:
         """Extract all relevant listing data"""
-        if not self.soup:
+        if self.document is None:
             self.fetch_page()
         
-        self.data = {
-            'url': self.url,
-            'title': self._extract_title(),
-            'price': self._extract_price(),
-            'address': self._extract_address(),
-            'bedrooms': self._extract_bedrooms(),
-            'bathrooms': self._extract_bathrooms(),
-            'square_feet': self._extract_square_feet(),
-            'description': self._extract_description(),
-            'images': self._extract_images(),
-            'property_type': self._extract_property_type(),
-            'features': self._extract_features()
-        }
-        
+        data = {'url': self.url}
+        sources = {}
+        with metrics.span('scrape.extract'):
+            structured = self.structured_data
+            for field in LISTING_FIELDS:
+                with metrics.span(f'scrape.extract_{field}') as span:
+                    # Structured data is authoritative; heuristics only fill gaps
+                    if field in structured:
+                        data[field], sources[field] = structured[field]
+                        span.add(structured_hits=1)
+                    else:
+                        data[field] = getattr(self, f'_extract_{field}')()
+                        sources[field] = SOURCE_HEURISTIC
+                        span.add(heuristic_hits=1)
+        
+        self.data = data
+        self.field_sources = sources
         return self.data
     
     def _extract_title(self) -> str:
@@ -59,17 +536,17 @@ class ListingScraper:
         title = None
         
         # Try meta tags first
-        og_title = self.soup.find('meta', property='og:title')
+        og_title = self.index.find('meta', property='og:title')
         if og_title and og_title.get('content'):
             return og_title['content'].strip()
         
         # Try h1 tags
-        h1 = self.soup.find('h1')
+        h1 = self.index.find('h1')
         if h1:
             return h1.get_text(strip=True)
         
         # Fallback to page title
-        title_tag = self.soup.find('title')
+        title_tag = self.index.find('title')
         if title_tag:
             return title_tag.get_text(strip=True)
         
@@ -77,14 +554,8 @@ class ListingScraper:
     
     def _extract_price(self) -> str:
         """Extract property price"""
-        # Look for price patterns
-        patterns = [
-            r'\$[\d,]+',
-            r'Price[:\s]*\$?[\d,]+'
-        ]
-        
         # Check meta tags
-        price_meta = self.soup.find('meta', property='og:price:amount')
+        price_meta = self.index.find('meta', property='og:price:amount')
         if price_meta and price_meta.get('content'):
             return f"${price_meta['content']}"
         
@@ -96,7 +567,7 @@ class ListingScraper:
         ]
         
         for selector in price_selectors:
-            element = self.soup.find(attrs=selector)
+            element = self.index.find(attrs=selector)
             if element:
                 text = element.get_text(strip=True)
                 match = re.search(r'\$[\d,]+', text)
@@ -104,18 +575,16 @@ class ListingScraper:
                     return match.group()
         
         # Search entire page
-        text = self.soup.get_text()
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group()
+        match = self._first_text_match('price')
+        if match:
+            return match.group()
         
         return "Price not listed"
     
     def _extract_address(self) -> str:
         """Extract property address"""
         # Try meta tags
-        address_meta = self.soup.find('meta', property='og:street-address')
+        address_meta = self.index.find('meta', property='og:street-address')
         if address_meta and address_meta.get('content'):
             return address_meta['content'].strip()
         
@@ -127,7 +596,7 @@ class ListingScraper:
         ]
         
         for selector in address_selectors:
-            element = self.soup.find(attrs=selector)
+            element = self.index.find(attrs=selector)
             if element:
                 return element.get_text(strip=True)
         
@@ -135,11 +604,6 @@ class ListingScraper:
     
     def _extract_bedrooms(self) -> Optional[int]:
         """Extract number of bedrooms"""
-        patterns = [
-            r'(\d+)\s*(?:bed|bd|bedroom)',
-            r'(?:bed|bd|bedroom)[:\s]*(\d+)'
-        ]
-        
         # Check for bed/bath containers
         bed_selectors = [
             {'class': re.compile(r'bed', re.I)},
@@ -147,7 +611,7 @@ class ListingScraper:
         ]
         
         for selector in bed_selectors:
-            element = self.soup.find(attrs=selector)
+            element = self.index.find(attrs=selector)
             if element:
                 text = element.get_text()
                 match = re.search(r'\d+', text)
@@ -155,21 +619,14 @@ class ListingScraper:
                     return int(match.group())
         
         # Search entire page
-        text = self.soup.get_text()
-        for pattern in patterns:
-            match = re.search(pattern, text, re.I)
-            if match:
-                return int(match.group(1))
+        match = self._first_text_match('bedrooms')
+        if match:
+            return int(match.group(1))
         
         return None
     
     def _extract_bathrooms(self) -> Optional[float]:
         """Extract number of bathrooms"""
-        patterns = [
-            r'(\d+\.?\d*)\s*(?:bath|ba|bathroom)',
-            r'(?:bath|ba|bathroom)[:\s]*(\d+\.?\d*)'
-        ]
-        
         # Check for bath containers
         bath_selectors = [
             {'class': re.compile(r'bath', re.I)},
@@ -177,7 +634,7 @@ class ListingScraper:
         ]
         
         for selector in bath_selectors:
-            element = self.soup.find(attrs=selector)
+            element = self.index.find(attrs=selector)
             if element:
                 text = element.get_text()
                 match = re.search(r'\d+\.?\d*', text)
@@ -185,34 +642,25 @@ class ListingScraper:
                     return float(match.group())
         
         # Search entire page
-        text = self.soup.get_text()
-        for pattern in patterns:
-            match = re.search(pattern, text, re.I)
-            if match:
-                return float(match.group(1))
+        match = self._first_text_match('bathrooms')
+        if match:
+            return float(match.group(1))
         
         return None
     
     def _extract_square_feet(self) -> Optional[int]:
         """Extract square footage"""
-        patterns = [
-            r'([\d,]+)\s*(?:sq\.?\s*ft|sqft|square feet)',
-            r'(?:sq\.?\s*ft|sqft|square feet)[:\s]*([\d,]+)'
-        ]
-        
-        text = self.soup.get_text()
-        for pattern in patterns:
-            match = re.search(pattern, text, re.I)
-            if match:
-                sqft_str = match.group(1).replace(',', '')
-                return int(sqft_str)
+        match = self._first_text_match('square_feet')
+        if match:
+            sqft_str = match.group(1).replace(',', '')
+            return int(sqft_str)
         
         return None
     
     def _extract_description(self) -> str:
         """Extract property description"""
         # Try meta description
-        meta_desc = self.soup.find('meta', attrs={'name': 'description'})
+        meta_desc = self.index.find('meta', attrs={'name': 'description'})
         if meta_desc and meta_desc.get('content'):
             return meta_desc['content'].strip()
         
@@ -224,7 +672,7 @@ class ListingScraper:
         ]
         
         for selector in desc_selectors:
-            element = self.soup.find(attrs=selector)
+            element = self.index.find(attrs=selector)
             if element:
                 # Get text but limit length
                 text = element.get_text(strip=True)
@@ -237,14 +685,19 @@ class ListingScraper:
         images = []
         
         # Try Open Graph images
-        og_image = self.soup.find('meta', property='og:image')
+        og_image = self.index.find('meta', property='og:image')
         if og_image and og_image.get('content'):
             images.append(og_image['content'])
+        seen = set(images)
         
         # Look for image galleries
-        img_tags = self.soup.find_all('img')
+        img_tags = self.index.find_all('img')
         
         for img in img_tags:
+            # Only the first images are returned, so stop once there are enough
+            if len(images) >= MAX_IMAGES:
+                break
+            
             src = img.get('src') or img.get('data-src') or img.get('data-lazy-src')
             if src:
                 # Filter out small images (likely icons/logos)
@@ -258,46 +711,34 @@ class ListingScraper:
                     from urllib.parse import urljoin
                     src = urljoin(self.url, src)
                 
-                if validators.url(src) and src not in images:
+                if src not in seen and validators.url(src):
+                    seen.add(src)
                     images.append(src)
         
-        # Limit to first 10 images
-        return images[:10]
+        return images[:MAX_IMAGES]
     
     def _extract_property_type(self) -> str:
         """Extract property type (House, Condo, etc.)"""
-        types = ['house', 'condo', 'townhouse', 'apartment', 'land', 'commercial']
-        
-        text = self.soup.get_text().lower()
-        for prop_type in types:
-            if prop_type in text:
-                return prop_type.capitalize()
+        types = self.text_analysis['property_types']
+        if types:
+            return types[0]
         
         return "Property"
     
     def _extract_features(self) -> List[str]:
         """Extract key property features"""
-        features = []
-        common_features = [
-            'pool', 'garage', 'fireplace', 'hardwood', 'granite',
-            'stainless steel', 'updated', 'renovated', 'new roof',
-            'central air', 'walk-in closet', 'basement', 'deck', 'patio'
-        ]
-        
-        text = self.soup.get_text().lower()
-        for feature in common_features:
-            if feature in text:
-                features.append(feature.title())
+        features = self.text_analysis['features']
         
         return features[:5]  # Limit to 5 features
 
 
-def scrape_listing(url: str) -> Dict:
+def scrape_listing(url: str, cache: Optional[HTTPCache] = None) -> Dict:
     """
     Convenience function to scrape a listing URL
     
     Args:
         url: The listing URL to scrape
+        cache: Optional HTTP cache to serve and revalidate the page from
         
     Returns:
         Dictionary containing all extracted listing data
@@ -305,10 +746,117 @@ def scrape_listing(url: str) -> Dict:
     if not validators.url(url):
         raise ValueError("Invalid URL provided")
     
-    scraper = ListingScraper(url)
+    scraper = ListingScraper(url, cache=cache)
     return scraper.extract_data()
 
 
+def create_session(pool_size: int = 10) -> requests.Session:
+    """
+    Create a requests session with a keep-alive connection pool
+    
+    Args:
+        pool_size: Maximum number of pooled connections kept per host
+        
+    Returns:
+        Session that reuses TCP/TLS connections across requests
+    """
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _scrape_one(url: str, session: requests.Session, cache: Optional[HTTPCache],
+                controller: HostController) -> Dict:
+    """Scrape a single URL for scrape_many, capturing errors per URL"""
+    try:
+        if not validators.url(url):
+            raise ValueError("Invalid URL provided")
+        data = ListingScraper(url, session=session, cache=cache, controller=controller).extract_data()
+        return {'url': url, 'data': data, 'error': None}
+    except Exception as e:
+        return {'url': url, 'data': None, 'error': str(e)}
+
+
+def scrape_many(urls: Iterable[str], max_concurrency: int = 8,
+                per_host: int = 2,
+                session: Optional[requests.Session] = None,
+                cache: Optional[HTTPCache] = None,
+                controller: Optional[HostController] = None) -> Iterator[Dict]:
+    """
+    Scrape many listing URLs concurrently over a shared connection pool
+    
+    Results are yielded as soon as each listing finishes, so the order
+    does not follow the input. A failing URL never stops the batch; its
+    result carries the error message instead of data. Hosts that the
+    controller has throttled get fewer workers (and none while they asked
+    to be left alone with Retry-After), so healthy hosts keep the rest.
+    
+    Args:
+        urls: Listing URLs to scrape
+        max_concurrency: Maximum number of requests in flight overall
+        per_host: Maximum number of requests in flight per host
+        session: Optional session to reuse (a pooled one is created if omitted)
+        cache: Optional HTTP cache shared by all workers
+        controller: Per-host adaptive limits, retries and circuit breakers
+            (the process-wide controller if omitted)
+        
+    Yields:
+        Dictionaries with 'url', 'data' (listing dict or None) and 'error'
+    """
+    if max_concurrency < 1 or per_host < 1:
+        raise ValueError("max_concurrency and per_host must be at least 1")
+    
+    controller = controller or get_default_controller()
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=max(max_concurrency, per_host))
+    
+    # Queue URLs per host so one slow portal can't take every worker
+    pending = defaultdict(deque)
+    for url in urls:
+        pending[urlparse(url).netloc.lower()].append(url)
+    
+    active = defaultdict(int)
+    in_flight = {}
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            while pending or in_flight:
+                # Fill free slots, round-robin over hosts with spare capacity
+                paused = []
+                for host in list(pending):
+                    if len(in_flight) >= max_concurrency:
+                        break
+                    delay = controller.delay(pending[host][0])
+                    if delay > 0:
+                        paused.append(delay)
+                        continue
+                    limit = min(per_host, controller.slots(pending[host][0]))
+                    while pending[host] and active[host] < limit and len(in_flight) < max_concurrency:
+                        url = pending[host].popleft()
+                        future = executor.submit(_scrape_one, url, session, cache, controller)
+                        in_flight[future] = host
+                        active[host] += 1
+                    if not pending[host]:
+                        del pending[host]
+                
+                if not in_flight:
+                    # Every remaining host is waiting out a Retry-After
+                    time.sleep(min(paused))
+                    continue
+                done, _ = wait(in_flight, timeout=min(paused) if paused else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    active[in_flight.pop(future)] -= 1
+                    yield future.result()
+    finally:
+        if own_session:
+            session.close()
+
+
 # Example usage
 if __name__ == '__main__':
     # Test with a sample URL
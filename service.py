@@ -0,0 +1,317 @@
+"""
+Listing Service
+Long-running local API for scraping and captions; the HTTP session, OpenAI
+client and caption generator stay warm between requests
+"""
+
+import argparse
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+import requests
+import validators
+from flask import Flask, g, jsonify, request
+from werkzeug.serving import make_server
+
+import config
+import metrics
+from ai_captions import CaptionGenerator
+from host_control import HostController, get_default_controller
+from http_cache import HTTPCache
+from keywords import get_default_matcher
+from listing_store import ListingStore
+from scraper import ListingScraper, create_session
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LatencyStats:
+    """Request counts and rolling latency percentiles per endpoint"""
+    
+    def __init__(self, window: int = None):
+        """
+        Args:
+            window: Latest requests per endpoint the percentiles are taken
+                over (config.SERVICE_STATS_WINDOW if omitted)
+        """
+        self.window = window or config.SERVICE_STATS_WINDOW
+        self.started = time.time()
+        self._latencies = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+    
+    def begin(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+    
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies[endpoint].append(seconds)
+            self._counts[endpoint] += 1
+            if not ok:
+                self._errors[endpoint] += 1
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = {endpoint: sorted(values) for endpoint, values in self._latencies.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+            in_flight = self._in_flight
+        
+        endpoints = {}
+        for endpoint, values in latencies.items():
+            stats = {'requests': counts[endpoint], 'errors': errors.get(endpoint, 0)}
+            for pct in PERCENTILES:
+                stats[f'p{pct}_ms'] = round(percentile(values, pct) * 1000, 3)
+            stats['max_ms'] = round(values[-1] * 1000, 3) if values else 0.0
+            endpoints[endpoint] = stats
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'in_flight': in_flight,
+            'window': self.window,
+            'endpoints': endpoints
+        }
+
+
+class ListingService:
+    """Scraper and caption generator shared by every request"""
+    
+    def __init__(self, generator: CaptionGenerator = None,
+                 session: requests.Session = None, cache: HTTPCache = None,
+                 pool_size: int = None, controller: HostController = None,
+                 store: ListingStore = None):
+        """
+        Args:
+            generator: Caption generator (created on warm() if omitted)
+            session: Pooled HTTP session for listing pages
+            cache: Optional HTTP cache for listing pages
+            pool_size: Keep-alive connections per host (config default if omitted)
+            controller: Per-host limits, retries and circuit breakers for
+                listing pages (the process-wide controller if omitted)
+            store: Optional columnar store that scraped listings and
+                caption counts are appended to, and /listings/stats reads
+        """
+        self.session = session or create_session(pool_size or config.SERVICE_POOL_SIZE)
+        self.cache = cache
+        self.controller = controller or get_default_controller()
+        self.store = store
+        self._generator = generator
+        self._lock = threading.Lock()
+    
+    @property
+    def generator(self) -> CaptionGenerator:
+        if self._generator is None:
+            with self._lock:
+                if self._generator is None:
+                    self._generator = CaptionGenerator()
+        return self._generator
+    
+    def warm(self) -> None:
+        """Build everything the first request would otherwise pay for"""
+        get_default_matcher()
+        if config.OPENAI_API_KEY or self._generator is not None:
+            self.generator
+    
+    def scrape(self, url: str) -> Dict:
+        data = ListingScraper(url, session=self.session, cache=self.cache,
+                              controller=self.controller).extract_data()
+        if self.store is not None:
+            self.store.append(data)
+        return data
+    
+    def captions(self, listing_data: Dict, post_type: str = 'New Listing',
+                 num_variations: int = 3, tones: Optional[List[str]] = None,
+                 force_refresh: bool = False) -> List[Dict]:
+        captions = self.generator.generate_captions(listing_data, post_type, num_variations,
+                                                    force_refresh=force_refresh, tones=tones)
+        if self.store is not None and listing_data.get('url'):
+            if not self.store.mark_captioned(listing_data['url'], len(captions)):
+                self.store.append(listing_data, captions=len(captions))
+        return captions
+    
+    def model_stats(self) -> Dict:
+        """Rolling latency and errors per OpenAI model, once captions were requested"""
+        return self._generator.router.stats() if self._generator is not None else {}
+    
+    def host_stats(self) -> Dict:
+        """Adaptive limit, circuit state and request counts per listing host"""
+        return self.controller.stats()
+    
+    def close(self) -> None:
+        self.session.close()
+
+
+def create_app(service: ListingService = None, stats: LatencyStats = None) -> Flask:
+    """
+    Flask app exposing the service
+    
+    Endpoints:
+        POST /scrape    {"url"} -> listing data
+        POST /captions  {"url" or "listing", "post_type", "num_variations",
+                         "tones", "force_refresh"} -> listing and captions
+        GET  /stats     request counts and latency percentiles per endpoint,
+                        per OpenAI model and per listing host
+        GET  /listings/stats?value=price_per_bedroom&by=suburb&<filters>
+                        grouped count/mean/min/max from the listing store
+                        (filters as for ListingStore.select())
+        GET  /health
+    """
+    service = service or ListingService()
+    stats = stats or LatencyStats()
+    app = Flask(__name__)
+    app.config['listing_service'] = service
+    app.config['latency_stats'] = stats
+    
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+        stats.begin()
+    
+    @app.after_request
+    def record_latency(response):
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        stats.record(endpoint, time.perf_counter() - g.started, response.status_code < 400)
+        return response
+    
+    def payload() -> Dict:
+        body = request.get_json(silent=True)
+        return body if isinstance(body, dict) else {}
+    
+    @app.post('/scrape')
+    def scrape():
+        url = payload().get('url')
+        if not url or not validators.url(url):
+            return jsonify({'error': 'A valid url is required'}), 400
+        with metrics.span('service.scrape'):
+            try:
+                return jsonify({'url': url, 'listing': service.scrape(url)})
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                return jsonify({'error': str(e)}), 502
+    
+    @app.post('/captions')
+    def captions():
+        body = payload()
+        listing_data = body.get('listing')
+        url = body.get('url')
+        if not listing_data and (not url or not validators.url(url)):
+            return jsonify({'error': 'A listing or a valid url is required'}), 400
+        post_type = body.get('post_type', 'New Listing')
+        if post_type not in config.POST_TYPES:
+            return jsonify({'error': f"Unknown post_type: {post_type}"}), 400
+        
+        with metrics.span('service.captions', post_type=post_type):
+            try:
+                if not listing_data:
+                    listing_data = service.scrape(url)
+                result = service.captions(listing_data, post_type,
+                                          int(body.get('num_variations', 3)),
+                                          tones=body.get('tones'),
+                                          force_refresh=bool(body.get('force_refresh')))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Exception as e:
+                return jsonify({'error': str(e)}), 502
+        return jsonify({'url': url, 'listing': listing_data, 'captions': result})
+    
+    @app.get('/stats')
+    def get_stats():
+        return jsonify(dict(stats.snapshot(), models=service.model_stats(),
+                            hosts=service.host_stats()))
+    
+    @app.get('/listings/stats')
+    def listing_stats():
+        if service.store is None:
+            return jsonify({'error': 'The listing store is not enabled'}), 404
+        args = request.args
+        filters = {}
+        try:
+            for name in ('suburb', 'property_type'):
+                if name in args:
+                    filters[name] = args[name]
+            for name in ('min_price', 'max_price', 'min_bathrooms'):
+                if name in args:
+                    filters[name] = float(args[name])
+            for name in ('min_bedrooms', 'max_bedrooms'):
+                if name in args:
+                    filters[name] = int(args[name])
+            if 'captioned' in args:
+                filters['captioned'] = args['captioned'].lower() == 'true'
+            groups = service.store.group_stats(args.get('value', 'price'), args.get('by', 'suburb'),
+                                               **filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'summary': service.store.summary(), 'groups': groups})
+    
+    @app.get('/health')
+    def health():
+        return jsonify({'status': 'ok'})
+    
+    return app
+
+
+def serve(host: str = None, port: int = None, socket_path: str = None,
+          service: ListingService = None):
+    """
+    Run the API until interrupted, one thread per request
+    
+    Args:
+        host: Interface to bind (config.SERVICE_HOST if omitted)
+        port: TCP port (config.SERVICE_PORT if omitted)
+        socket_path: Listen on this Unix socket instead of TCP
+        service: Shared service (a new one is created and warmed if omitted)
+    """
+    service = service or ListingService()
+    service.warm()
+    app = create_app(service)
+    if socket_path or config.SERVICE_SOCKET:
+        server = make_server(f"unix://{socket_path or config.SERVICE_SOCKET}", 0, app, threaded=True)
+        address = socket_path or config.SERVICE_SOCKET
+    else:
+        server = make_server(host or config.SERVICE_HOST, port or config.SERVICE_PORT, app,
+                             threaded=True)
+        address = f"http://{server.host}:{server.port}"
+    print(f"Listing service on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        metrics.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve scraping and captions over a local API')
+    parser.add_argument('--host', default=None, help=f'Interface (default {config.SERVICE_HOST})')
+    parser.add_argument('--port', type=int, default=None, help=f'Port (default {config.SERVICE_PORT})')
+    parser.add_argument('--socket', default=None, help='Unix socket path instead of TCP')
+    parser.add_argument('--cache', action='store_true', help='Cache listing pages on disk')
+    parser.add_argument('--store', action='store_true',
+                        help='Keep scraped listings in the columnar listing store for /listings/stats')
+    args = parser.parse_args()
+    
+    service = ListingService(cache=HTTPCache() if args.cache else None,
+                             store=ListingStore() if args.store else None)
+    serve(args.host, args.port, args.socket, service)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""
+Structured Listing Data
+Reads listing fields from schema.org JSON-LD, embedded page state
+(__NEXT_DATA__) and microdata, which portals publish for search engines
+and their own front ends
+"""
+
+import json
+import re
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urljoin
+
+from keywords import get_default_matcher
+
+
+# schema.org types that describe the listing itself or the home being sold;
+# objects are read outermost first, so a listing's own fields win over the
+# residence it wraps (about / itemOffered)
+LISTING_TYPES = frozenset([
+    'RealEstateListing', 'Offer', 'Product', 'Residence', 'Accommodation',
+    'House', 'SingleFamilyResidence', 'Apartment', 'ApartmentComplex'
+])
+
+# schema.org @type to the property type names used by the scraper
+SCHEMA_PROPERTY_TYPES = {
+    'House': 'House',
+    'SingleFamilyResidence': 'House',
+    'Apartment': 'Apartment',
+    'ApartmentComplex': 'Apartment'
+}
+
+CURRENCY_SYMBOLS = {
+    'USD': '$', 'CAD': '$', 'AUD': '$', 'NZD': '$',
+    'ZAR': 'R', 'GBP': '£', 'EUR': '€'
+}
+
+SYMBOL_CURRENCIES = {'$': 'USD', 'R': 'ZAR', '£': 'GBP', '€': 'EUR'}
+
+SQFT_PER_SQM = 10.7639
+
+# Key aliases used by portal state blobs, in order of preference
+STATE_KEYS = {
+    'title': ('title', 'headline', 'listingTitle'),
+    'price': ('price', 'listPrice', 'listingPrice', 'askingPrice'),
+    'address': ('address', 'fullAddress', 'displayAddress', 'streetAddress'),
+    'bedrooms': ('bedrooms', 'beds', 'bedroomCount', 'numberOfBedrooms'),
+    'bathrooms': ('bathrooms', 'baths', 'bathroomCount', 'numberOfBathrooms'),
+    'square_feet': ('squareFeet', 'sqft', 'livingArea', 'floorSize', 'floorArea',
+                    'floorAreaM2', 'floorAreaSqm', 'floorAreaSqft'),
+    'description': ('description', 'listingDescription'),
+    'images': ('images', 'photos', 'media', 'gallery'),
+    'property_type': ('propertyType', 'homeType', 'listingType')
+}
+STATE_CURRENCY_KEYS = ('currency', 'priceCurrency', 'currencyCode')
+
+# A state object needs this many listing keys to be taken for the listing
+MIN_STATE_KEYS = 3
+
+_NUMBER = re.compile(r'\d[\d,\s]*(?:\.\d+)?')
+
+
+def _number(value) -> Optional[float]:
+    """Parse numbers written as 3, '3', '2.5', '2,940' or '2 450 000'"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return _number(value.get('value') or value.get('amount'))
+    if isinstance(value, str):
+        match = _NUMBER.search(value)
+        if match:
+            try:
+                return float(re.sub(r'[,\s]', '', match.group()))
+            except ValueError:
+                return None
+    return None
+
+
+def format_price(amount, currency: str = None) -> Optional[str]:
+    """
+    Format a price the way the scraper reports it, e.g. '$689,000'
+    
+    Args:
+        amount: Number or numeric string
+        currency: ISO 4217 code (USD when omitted)
+    """
+    value = _number(amount)
+    if not value:
+        return None
+    currency = (currency or 'USD').upper()
+    text = f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{text}" if symbol else f"{text} {currency}"
+
+
+def _types(obj: Dict) -> List[str]:
+    value = obj.get('@type', [])
+    return value if isinstance(value, list) else [value]
+
+
+def _walk(value) -> Iterator[Dict]:
+    """Every dictionary in a JSON document, outermost first"""
+    pending = deque([value])
+    while pending:
+        current = pending.popleft()
+        if isinstance(current, dict):
+            yield current
+            pending.extend(current.values())
+        elif isinstance(current, list):
+            pending.extend(current)
+
+
+def _text(value) -> Optional[str]:
+    if isinstance(value, str):
+        value = ' '.join(value.split())
+        return value or None
+    return None
+
+
+def _address(value) -> Optional[str]:
+    if isinstance(value, str):
+        return _text(value)
+    if isinstance(value, dict):
+        parts = [value.get(key) for key in ('streetAddress', 'street', 'line1',
+                                            'addressLocality', 'suburb', 'city',
+                                            'addressRegion', 'state', 'province',
+                                            'postalCode', 'zip')]
+        parts = [_text(str(part)) for part in parts if part not in (None, '')]
+        return ', '.join(part for part in parts if part) or None
+    return None
+
+
+def _images(value, base_url: str) -> List[str]:
+    if value is None:
+        return []
+    items = value if isinstance(value, list) else [value]
+    images = []
+    for item in items:
+        if isinstance(item, dict):
+            item = (item.get('url') or item.get('contentUrl') or item.get('src')
+                    or item.get('href'))
+        if isinstance(item, str) and item.strip():
+            url = urljoin(base_url, item.strip())
+            if url not in images:
+                images.append(url)
+    return images
+
+
+def _floor_area(value, key: str = '') -> Optional[int]:
+    """Floor area in square feet, converting square metres"""
+    area = _number(value)
+    if not area:
+        return None
+    unit = ''
+    if isinstance(value, dict):
+        unit = str(value.get('unitCode') or value.get('unitText') or value.get('unit') or '')
+    elif isinstance(value, str):
+        unit = value
+    unit = unit.lower() + key.lower()
+    if 'mtk' in unit or 'm²' in unit or 'm2' in unit or 'sqm' in unit or 'square met' in unit:
+        area *= SQFT_PER_SQM
+    return int(round(area))
+
+
+def _property_type(value) -> Optional[str]:
+    text = _text(value)
+    if not text:
+        return None
+    return get_default_matcher().best(text, 'property_types')
+
+
+def _clean(fields: Dict) -> Dict:
+    return {key: value for key, value in fields.items() if value not in (None, '', [])}
+
+
+def from_json_ld(documents: List, base_url: str) -> Dict:
+    """
+    Listing fields from schema.org JSON-LD documents
+    
+    Args:
+        documents: Parsed contents of the page's application/ld+json scripts
+        base_url: Page URL for resolving relative image URLs
+    """
+    fields = {}
+    for obj in (obj for document in documents for obj in _walk(document)):
+        types = _types(obj)
+        if not LISTING_TYPES.intersection(types):
+            continue
+        
+        offers = obj.get('offers')
+        if isinstance(offers, list):
+            offers = offers[0] if offers else None
+        offer = offers if isinstance(offers, dict) else (obj if 'Offer' in types else None)
+        
+        found = {
+            'title': _text(obj.get('name')) or _text(obj.get('headline')),
+            'price': format_price(offer.get('price'), offer.get('priceCurrency')) if offer else None,
+            'address': _address(obj.get('address')),
+            'bedrooms': _number(obj.get('numberOfBedrooms') or obj.get('numberOfRooms')),
+            'bathrooms': _number(obj.get('numberOfBathroomsTotal') or
+                                 obj.get('numberOfFullBathrooms')),
+            'square_feet': _floor_area(obj.get('floorSize')),
+            'description': _text(obj.get('description')),
+            'images': _images(obj.get('image') or obj.get('photo'), base_url),
+            'property_type': next((SCHEMA_PROPERTY_TYPES[t] for t in types
+                                   if t in SCHEMA_PROPERTY_TYPES), None)
+        }
+        for key, value in _clean(found).items():
+            fields.setdefault(key, value)
+    return _typed(fields)
+
+
+def from_page_state(state, base_url: str) -> Dict:
+    """
+    Listing fields from an embedded front-end state blob such as __NEXT_DATA__
+    
+    The blob layout differs per portal, so the object with the most
+    listing-like keys is taken as the listing.
+    """
+    best = None
+    best_score = 0
+    for obj in _walk(state):
+        score = sum(1 for aliases in STATE_KEYS.values() if any(key in obj for key in aliases))
+        if score > best_score:
+            best, best_score = obj, score
+    if best is None or best_score < MIN_STATE_KEYS:
+        return {}
+    
+    def first(field):
+        for key in STATE_KEYS[field]:
+            if best.get(key) not in (None, '', []):
+                return key, best[key]
+        return None, None
+    
+    currency = next((best[key] for key in STATE_CURRENCY_KEYS if isinstance(best.get(key), str)), None)
+    price = first('price')[1]
+    if isinstance(price, dict):
+        currency = price.get('currency') or price.get('currencyCode') or currency
+    area_key, area = first('square_feet')
+    
+    if isinstance(price, str) and price.strip()[:1] in SYMBOL_CURRENCIES:
+        # Already written with a symbol, e.g. 'R 2 450 000'
+        currency = SYMBOL_CURRENCIES[price.strip()[0]]
+    
+    fields = {
+        'title': _text(first('title')[1]),
+        'price': format_price(price, currency),
+        'address': _address(first('address')[1]),
+        'bedrooms': _number(first('bedrooms')[1]),
+        'bathrooms': _number(first('bathrooms')[1]),
+        'square_feet': _floor_area(area, area_key or ''),
+        'description': _text(first('description')[1]),
+        'images': _images(first('images')[1], base_url),
+        'property_type': _property_type(first('property_type')[1])
+    }
+    return _typed(_clean(fields))
+
+
+def from_microdata(item, base_url: str) -> Dict:
+    """
+    Listing fields from a microdata item (an element with itemscope/itemtype)
+    
+    Nested items such as the offer and postal address are read as part of
+    the listing.
+    """
+    props = {}
+    images = []
+    for element in item.find_all(attrs={'itemprop': True}):
+        value = (element.get('content') or element.get('src') or element.get('href')
+                 or element.get_text(' ', strip=True))
+        for name in element['itemprop'].split() if isinstance(element['itemprop'], str) else element['itemprop']:
+            if name in ('image', 'photo'):
+                images.append(value)
+            else:
+                props.setdefault(name, value)
+    
+    obj = {
+        '@type': [item.get('itemtype', '').rstrip('/').rsplit('/', 1)[-1]],
+        'name': props.get('name'),
+        'description': props.get('description'),
+        'numberOfBedrooms': props.get('numberOfBedrooms'),
+        'numberOfRooms': props.get('numberOfRooms'),
+        'numberOfBathroomsTotal': props.get('numberOfBathroomsTotal'),
+        'floorSize': {'value': props.get('floorSize'), 'unitCode': props.get('unitCode')}
+        if props.get('floorSize') else None,
+        'image': images,
+        'offers': {'price': props.get('price'), 'priceCurrency': props.get('priceCurrency')}
+        if props.get('price') else None,
+        'address': {key: props[key] for key in ('streetAddress', 'addressLocality',
+                                                'addressRegion', 'postalCode') if key in props}
+        or None
+    }
+    return from_json_ld([obj], base_url)
+
+
+def _typed(fields: Dict) -> Dict:
+    """Match the types the heuristic extractors return"""
+    if 'bedrooms' in fields:
+        fields['bedrooms'] = int(fields['bedrooms'])
+    if 'bathrooms' in fields:
+        fields['bathrooms'] = float(fields['bathrooms'])
+    return fields
+
+
+def parse_json(text: Optional[str]):
+    """Parse a script body, returning None for anything that isn't JSON"""
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        # Some portals wrap JSON-LD in HTML comments or CDATA
+        stripped = text.strip().removeprefix('<!--').removesuffix('-->')
+        stripped = stripped.removeprefix('//<![CDATA[').removesuffix('//]]>')
+        try:
+            return json.loads(stripped)
+        except ValueError:
+            return None